@@ -36,9 +36,9 @@ if __name__ == '__main__':
 
             # Sample from posterior
             mc.warm_up()
-            mc.sample()
+            mc.sample(run=run)
 
             # Log sampling statistics and save samples to file
             mc.log_statistics()
-            mc.save_samples(run=run)
+            mc.save_samples()
 
@@ -32,7 +32,7 @@ if __name__ == '__main__':
 
             # 4. Warm-up and sample from posterior
             mc.warm_up()
-            mc.sample()
+            mc.sample(run=run)
 
             # 5. Evaluate ground truth
             mc.eval_ground_truth()
@@ -35,11 +35,11 @@ if __name__ == '__main__':
 
             # 4. Warm-up and sample from posterior
             mc.warm_up()
-            mc.sample()
+            mc.sample(run=run)
 
             # 5. Evaluate ground truth
             mc.eval_ground_truth()
 
             # 6. Log sampling statistics and save samples to file
             mc.log_statistics()
-            mc.save_samples(run=run)
+            mc.save_samples()
@@ -35,8 +35,8 @@ if __name__ == '__main__':
 
             # Sample
             mc.warm_up()
-            mc.sample()
+            mc.sample(run=run)
 
             # Save samples to file
             mc.log_statistics()
-            mc.save_samples(run=run)
+            mc.save_samples()
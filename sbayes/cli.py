@@ -1,4 +1,6 @@
 import argparse
+import copy
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 import tkinter as tk
 from tkinter import filedialog
@@ -7,32 +9,100 @@ from sbayes.experiment_setup import Experiment
 from sbayes.load_data import Data
 from sbayes.mcmc_setup import MCMC
 from sbayes.simulation import Simulation
+from sbayes.util import get_logger
 
 NUMBER_AREAS_GRID = range(1, 8)
 
 
-def run_experiment(experiment, data, run, initial_sample=None):
-    mcmc = MCMC(data=data, experiment=experiment)
+def run_experiment(experiment, data, run, initial_sample=None, logger=None, resume=False):
+    mcmc = MCMC(data=data, experiment=experiment, logger=logger)
     mcmc.log_setup()
 
-    # Sample
-    mcmc.sample(initial_sample=initial_sample)
+    # Sample (or continue an interrupted run from its checkpoint)
+    mcmc.sample(run=run, initial_sample=initial_sample, resume=resume)
 
     # Save samples to file
     mcmc.log_statistics()
-    mcmc.save_samples(run=run)
+    mcmc.save_samples()
 
     # Use the last sample as the new initial sample
     return mcmc.samples['last_sample']
 
 
+def experiment_for_job(experiment, n_areas):
+    """Copy the experiment for one job of the N_AREAS grid, such that jobs running in parallel
+    neither share the config nor write to the same output files.
+
+    Args:
+        experiment (Experiment): The experiment.
+        n_areas (int): The number of areas in this job.
+    Returns:
+        Experiment: The experiment of the job.
+    """
+    job_experiment = copy.copy(experiment)
+    job_experiment.config = copy.deepcopy(experiment.config)
+    job_experiment.config['model']['N_AREAS'] = n_areas
+
+    # Results are only separated by the number of areas if the file names contain it
+    if job_experiment.config['results']['FILE_INFO'] != 'n':
+        job_experiment.path_results = experiment.path_results / 'n{n}'.format(n=n_areas)
+        job_experiment.path_results.mkdir(exist_ok=True)
+
+    return job_experiment
+
+
+def run_job(experiment, data, run, n_areas=None, resume=False):
+    """Run one independent (run, n_areas) job of the experiment, logging to a separate file.
+
+    Args:
+        experiment (Experiment): The experiment.
+        data (Data or Simulation): The data.
+        run (int): The index of the run.
+        n_areas (int): The number of areas (None: as specified in the config).
+        resume (bool): Continue the job from its checkpoint (if there is one).
+    """
+    if n_areas is not None:
+        experiment = experiment_for_job(experiment, n_areas)
+    n_areas = experiment.config['model']['N_AREAS']
+
+    log_name = 'experiment_n{n}_{run}'.format(n=n_areas, run=run)
+    logger = get_logger('sbayes.{name}.{log}'.format(name=experiment.experiment_name, log=log_name),
+                        experiment.path_results / (log_name + '.log'))
+
+    run_experiment(experiment, data, run, logger=logger, resume=resume)
+
+
+def run_jobs_in_parallel(experiment, data, jobs, max_parallel, resume=False):
+    """Run independent (run, n_areas) jobs in a pool of processes.
+
+    Args:
+        experiment (Experiment): The experiment.
+        data (Data or Simulation): The data.
+        jobs (list): The (run, n_areas) pairs.
+        max_parallel (int): The maximum number of jobs running at the same time.
+        resume (bool): Continue the jobs from their checkpoints (if there are any).
+    """
+    with ProcessPoolExecutor(max_workers=max_parallel) as pool:
+        futures = {pool.submit(run_job, experiment, data, run, n_areas, resume): (run, n_areas)
+                   for run, n_areas in jobs}
+
+        for future in as_completed(futures):
+            run, n_areas = futures[future]
+            # Re-raise errors of the job
+            future.result()
+            experiment.logger.info("Finished run %s (%s areas)", run, n_areas)
+
+
 def main(args=None):
     if args is None:
         parser = argparse.ArgumentParser(
             description="An MCMC algorithm to identify contact zones")
         parser.add_argument("config", nargs="?", type=Path,
                             help="The JSON configuration file")
+        parser.add_argument("--resume", action="store_true",
+                            help="Continue interrupted runs from their last checkpoint")
         args = parser.parse_args()
+    resume = getattr(args, 'resume', False)
 
     # 0. Ask for config file via files-dialog, if not provided as argument.
     config = args.config
@@ -65,24 +135,37 @@ def main(args=None):
         # Log
         data.log_loading()
 
+    n_runs = experiment.config['mcmc']['N_RUNS']
+    determine_n_areas = isinstance(experiment.config['model']['N_AREAS'], str)
+    if determine_n_areas:
+        assert experiment.config['model']['N_AREAS'].lower() == 'tbd'
+
+    # Independent runs are executed in parallel processes
+    max_parallel = experiment.config['mcmc']['N_PARALLEL_RUNS']
+    if max_parallel > 1:
+        if determine_n_areas:
+            jobs = [(run, N) for run in range(n_runs) for N in NUMBER_AREAS_GRID]
+        else:
+            jobs = [(run, None) for run in range(n_runs)]
+        run_jobs_in_parallel(experiment, data, jobs, max_parallel, resume=resume)
+        return
+
     initial_sample = None
 
     # Rerun experiment to check for consistency
-    for run in range(experiment.config['mcmc']['N_RUNS']):
-        if isinstance(experiment.config['mcmc']['N_AREAS'], str):
-            assert experiment.config['mcmc']['N_AREAS'].lower() == 'tbd'
-
+    for run in range(n_runs):
+        if determine_n_areas:
             # Run the experiment multiple times to determine the number of areas.
             for N in NUMBER_AREAS_GRID:
                 # Update config information according to the current setup
-                experiment.config['mcmc']['N_AREAS'] = N
+                job_experiment = experiment_for_job(experiment, N)
 
                 # Run the experiment with the specified number of areas
-                initial_sample = run_experiment(experiment, data, run,
-                                                initial_sample=initial_sample)
+                initial_sample = run_experiment(job_experiment, data, run,
+                                                initial_sample=initial_sample, resume=resume)
 
         else:
             # Run the experiment once, with the specified settings
-            run_experiment(experiment, data, run)
+            run_experiment(experiment, data, run, resume=resume)
 
         initial_sample = None
@@ -19,7 +19,7 @@ from pathlib import Path
 
 import pycldf
 
-from sbayes.util import set_experiment_name
+from sbayes.util import set_experiment_name, get_logger
 from sbayes import config
 
 REQUIRED = '<REQUIRED>'
@@ -40,6 +40,7 @@ class Experiment:
         self.config = {}
         self.base_directory = None
         self.path_results = None
+        self.logger = None
 
         if config_file is not None:
             self.load_config(config_file)
@@ -81,6 +82,10 @@ class Experiment:
         if not os.path.exists(self.path_results):
             os.makedirs(self.path_results)
 
+        # Log to a file in the results directory (and to the screen)
+        self.logger = get_logger('sbayes.' + self.experiment_name, self.path_results / 'experiment.log',
+                                 to_screen=True)
+
     @staticmethod
     def decompose_config_path(config_path):
         abs_config_path = Path(config_path).absolute()
@@ -126,6 +131,13 @@ class Experiment:
             prior = priors_cfg[key]
             if 'type' not in prior:
                 raise NameError(f"type for prior \'{key}\' is not defined in {self.config_file}.")
+            if key == 'geo':
+                # Graph of the minimum spanning trees: "delaunay" (triangulate each zone) or "network"
+                # (precomputed Delaunay graph of the network, optionally with the k nearest neighbours)
+                if 'mst_graph' not in prior:
+                    prior['mst_graph'] = "delaunay"
+                if 'k_nearest' not in prior:
+                    prior['k_nearest'] = 0
             if prior['type'] == 'counts':
                 if 'file_type' not in prior:
                     raise NameError(f"counts file for prior \'{key}\' is not defined in {self.config_file}.")
@@ -296,8 +308,29 @@ class Experiment:
         if 'MC3' not in self.config['mcmc']:
             self.config['mcmc']['N_CHAINS'] = 1
         else:
-            # todo: activate for MC3
-            pass
+            mc3 = self.config['mcmc']['MC3']
+            # Number of parallel Markov chains
+            if 'N_CHAINS' not in mc3:
+                mc3['N_CHAINS'] = 5
+            # Steps between two attempted chain swaps
+            if 'SWAP_PERIOD' not in mc3:
+                mc3['SWAP_PERIOD'] = 1000
+            # Number of attempted chain swaps
+            if 'N_SWAPS' not in mc3:
+                mc3['N_SWAPS'] = 3
+            # Temperature of the hottest chain (temperatures are spaced geometrically)
+            if 'MAX_TEMPERATURE' not in mc3:
+                mc3['MAX_TEMPERATURE'] = 10.
+            # Adapt the spacing of the temperatures to the target swap rate?
+            if 'ADAPT_TEMPERATURES' not in mc3:
+                mc3['ADAPT_TEMPERATURES'] = False
+            if 'TARGET_SWAP_RATE' not in mc3:
+                mc3['TARGET_SWAP_RATE'] = 0.234
+            if mc3['MAX_TEMPERATURE'] < 1.:
+                raise ValueError("MAX_TEMPERATURE must be at least 1 (the temperature of the cold chain).")
+            if mc3['ADAPT_TEMPERATURES'] and mc3['MAX_TEMPERATURE'] == 1.:
+                raise ValueError("ADAPT_TEMPERATURES needs tempered chains. Set MAX_TEMPERATURE > 1.")
+            self.config['mcmc']['N_CHAINS'] = mc3['N_CHAINS']
 
         # Tracer does not like unevenly spaced samples
         spacing = self.config['mcmc']['N_STEPS'] % self.config['mcmc']['N_SAMPLES']
@@ -394,9 +427,10 @@ class Experiment:
                 logging.warning('STEPS for inheritance was set to 0, because ´inheritance´ is disabled.')
             self.config['mcmc']['STEPS']['inheritance'] = 0.0
 
-        # Normalize weights
-        weights_sum = sum(self.config['mcmc']['STEPS'].values())
-        for operator, weight in self.config['mcmc']['STEPS'].items():
+        # Normalize weights (the number of tries per area operator is not a weight)
+        weights = {k: v for k, v in self.config['mcmc']['STEPS'].items() if k != 'MULTIPLE_TRIES'}
+        weights_sum = sum(weights.values())
+        for operator, weight in weights.items():
             self.config['mcmc']['STEPS'][operator] = weight / weights_sum
 
         if 'results' in self.config:
@@ -404,11 +438,14 @@ class Experiment:
                 self.config['results']['RESULTS_PATH'] = "results"
             if 'FILE_INFO' not in self.config['results']:
                 self.config['results']['FILE_INFO'] = "n"
+            if 'STREAM_SAMPLES' not in self.config['results']:
+                self.config['results']['STREAM_SAMPLES'] = True
 
         else:
             self.config['results'] = {}
             self.config['results']['RESULTS_PATH'] = "results"
             self.config['results']['FILE_INFO'] = "n"
+            self.config['results']['STREAM_SAMPLES'] = True
 
         # Data
         if 'data' not in self.config:
@@ -442,11 +479,8 @@ class Experiment:
                         self.config['data']['FEATURE_STATES'] = self.fix_relative_path(self.config['data']['FEATURE_STATES'])
 
     def log_experiment(self):
-        log_path = self.path_results / 'experiment.log'
-        logging.basicConfig(format='%(message)s', filename=log_path, level=logging.DEBUG)
-        logging.getLogger().addHandler(logging.StreamHandler())
-        logging.info("Experiment: %s", self.experiment_name)
-        logging.info("File location for results: %s", self.path_results)
+        self.logger.info("Experiment: %s", self.experiment_name)
+        self.logger.info("File location for results: %s", self.path_results)
 
 
 def set_defaults(cfg: dict, default_cfg: dict):
@@ -13,12 +13,11 @@ try:
 except ImportError:
     from typing_extensions import Literal
 
-import logging
 
 import numpy
 
-from sbayes.util import read_features_from_csv
 from sbayes.preprocessing import (compute_network,
+                                  read_features_and_network,
                                   read_inheritance_counts,
                                   read_universal_counts)
 
@@ -28,6 +27,7 @@ class Data:
 
         self.path_results = experiment.path_results
         self.experiment_name = experiment.experiment_name
+        self.logger = experiment.logger
 
         # Config file
         self.config = experiment.config
@@ -62,11 +62,13 @@ class Data:
         self.is_simulated = False
 
     def load_features(self):
+        features, self.network = read_features_and_network(file=self.config['data']['FEATURES'],
+                                                           feature_states_file=self.config['data']['FEATURE_STATES'],
+                                                           crs=self.crs, cache=self.config['data']['CACHE'],
+                                                           logger=self.logger)
         (self.sites, self.site_names, self.features, self.feature_names,
          self.state_names, self.states, self.families, self.family_names,
-         self.log_load_features) = read_features_from_csv(file=self.config['data']['FEATURES'],
-                                                          feature_states_file=self.config['data']['FEATURE_STATES'])
-        self.network = compute_network(self.sites, crs=self.crs)
+         self.log_load_features) = features
 
     def load_universal_counts(self):
         config_universal = self.config['model']['PRIOR']['universal']
@@ -112,14 +114,12 @@ class Data:
                                   'states': self.state_names['internal']}
 
     def log_loading(self):
-        log_path = self.path_results / 'experiment.log'
-        logging.basicConfig(format='%(message)s', filename=log_path, level=logging.DEBUG)
-        logging.info("\n")
-        logging.info("DATA IMPORT")
-        logging.info("##########################################")
-        logging.info(self.log_load_features)
-        logging.info(self.log_load_universal_counts)
-        logging.info(self.log_load_inheritance_counts)
+        self.logger.info("\n")
+        self.logger.info("DATA IMPORT")
+        self.logger.info("##########################################")
+        self.logger.info(self.log_load_features)
+        self.logger.info(self.log_load_universal_counts)
+        self.logger.info(self.log_load_inheritance_counts)
 
 
 @dataclass
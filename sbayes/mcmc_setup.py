@@ -5,7 +5,6 @@
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
-import logging
 import numpy as np
 import os
 import random
@@ -14,12 +13,12 @@ import typing
 from sbayes.postprocessing import (contribution_per_area, log_operator_statistics,
                                    log_operator_statistics_header, match_areas, rank_areas)
 from sbayes.sampling.zone_sampling import Sample, ZoneMCMCGenerative, ZoneMCMCWarmup
-from sbayes.util import (normalize, counts_to_dirichlet,
-                         inheritance_counts_to_dirichlet, samples2file, scale_counts, get_max_size_list)
+from sbayes.util import (normalize, compute_mst_graph, counts_to_dirichlet, ground_truth2file, inheritance_counts_to_dirichlet,
+                         content_hash, dump, load_from, samples2file, scale_counts, get_max_size_list, SampleWriter)
 
 
 class MCMC:
-    def __init__(self, data, experiment):
+    def __init__(self, data, experiment, logger=None):
 
         # Retrieve the data
         self.data = data
@@ -28,9 +27,11 @@ class MCMC:
         self.config = experiment.config
 
         # Paths
-        self.path_log = experiment.path_results / 'experiment.log'
         self.path_results = experiment.path_results
 
+        # Logger (by default the logger of the experiment)
+        self.logger = logger if logger is not None else experiment.logger
+
         # Assign steps to operators
         self.ops = {}
         self.steps_per_operator()
@@ -44,6 +45,9 @@ class MCMC:
         self.samples = None
         self.sample_from_warm_up = None
 
+        # The index of the sampled run: the samples are written to (and saved in) the files of this run
+        self.run = None
+
     def define_priors(self):
         self.prior_structured = dict.fromkeys(self.config['model']['PRIOR'])
 
@@ -54,7 +58,16 @@ class MCMC:
             # todo:  change prior if cost matrix is provided
             # todo: move config['model']['scale_geo_prior'] to config['model']['PRIOR']['geo']['scale']
             self.prior_structured['geo'] = {'type': 'cost_based',
-                                            'scale': self.config['model']['scale_geo_prior']}
+                                            'scale': self.config['model']['scale_geo_prior'],
+                                            'graph': None}
+
+            cfg_geo = self.config['model']['PRIOR']['geo']
+            if cfg_geo['mst_graph'] == 'network':
+                self.prior_structured['geo']['graph'] = compute_mst_graph(self.data.network['adj_mat'],
+                                                                          self.data.network['distances'],
+                                                                          k_nearest=cfg_geo['k_nearest'])
+            elif cfg_geo['mst_graph'] != 'delaunay':
+                raise ValueError('mst_graph must be either \"delaunay\" or \"network\".')
         else:
             raise ValueError('Geo prior not supported')
         # weights
@@ -151,51 +164,67 @@ class MCMC:
         mcmc_config = self.config['mcmc']
         model_config = self.config['model']
 
-        logging.basicConfig(format='%(message)s', filename=self.path_log, level=logging.DEBUG)
-
-        logging.info('\n')
+        self.logger.info('\n')
 
-        logging.info("Model")
-        logging.info("##########################################")
-        logging.info("Number of inferred areas: %i", model_config['N_AREAS'])
-        logging.info("Areas have a minimum size of %s and a maximum size of %s.",
-                     model_config['MIN_M'], model_config['MAX_M'])
-        logging.info("Inheritance is considered for inference: %s",
-                     model_config['INHERITANCE'])
+        self.logger.info("Model")
+        self.logger.info("##########################################")
+        self.logger.info("Number of inferred areas: %i", model_config['N_AREAS'])
+        self.logger.info("Areas have a minimum size of %s and a maximum size of %s.",
+                         model_config['MIN_M'], model_config['MAX_M'])
+        self.logger.info("Inheritance is considered for inference: %s",
+                         model_config['INHERITANCE'])
 
-        logging.info("Geo-prior: %s ", self.prior_structured['geo']['type'])
-        logging.info("Prior on weights: %s ", self.prior_structured['weights']['type'])
-        logging.info("Prior on universal pressure (alpha): %s ", self.prior_structured['universal']['type'])
+        self.logger.info("Geo-prior: %s ", self.prior_structured['geo']['type'])
+        self.logger.info("Prior on weights: %s ", self.prior_structured['weights']['type'])
+        self.logger.info("Prior on universal pressure (alpha): %s ", self.prior_structured['universal']['type'])
         if self.config['model']['INHERITANCE']:
-            logging.info("Prior on inheritance (beta): %s ", self.prior_structured['inheritance']['type'])
-
-        logging.info("Prior on contact (gamma): %s ", self.prior_structured['contact']['type'])
-        logging.info('\n')
-
-        logging.info("MCMC SETUP")
-        logging.info("##########################################")
-
-        logging.info("MCMC with %s steps and %s samples",
-                     mcmc_config['N_STEPS'], mcmc_config['N_SAMPLES'])
-        logging.info("Warm-up: %s chains exploring the parameter space in %s steps",
-                     mcmc_config['WARM_UP']['N_WARM_UP_CHAINS'],  mcmc_config['WARM_UP']['N_WARM_UP_STEPS'])
-        logging.info("Pseudocounts for tuning the width of the proposal distribution for weights: %s ",
-                     mcmc_config['PROPOSAL_PRECISION']['weights'])
-        logging.info("Pseudocounts for tuning the width of the proposal distribution for "
-                     "universal pressure (alpha): %s ",
-                     mcmc_config['PROPOSAL_PRECISION']['universal'])
+            self.logger.info("Prior on inheritance (beta): %s ", self.prior_structured['inheritance']['type'])
+
+        self.logger.info("Prior on contact (gamma): %s ", self.prior_structured['contact']['type'])
+        self.logger.info('\n')
+
+        self.logger.info("MCMC SETUP")
+        self.logger.info("##########################################")
+
+        self.logger.info("MCMC with %s steps and %s samples",
+                         mcmc_config['N_STEPS'], mcmc_config['N_SAMPLES'])
+        self.logger.info("Warm-up: %s chains exploring the parameter space in %s steps",
+                         mcmc_config['WARM_UP']['N_WARM_UP_CHAINS'],  mcmc_config['WARM_UP']['N_WARM_UP_STEPS'])
+        if 'MC3' in mcmc_config:
+            self.logger.info("MC3: %s chains, %s swaps attempted every %s steps",
+                             mcmc_config['MC3']['N_CHAINS'], mcmc_config['MC3']['N_SWAPS'],
+                             mcmc_config['MC3']['SWAP_PERIOD'])
+            self.logger.info("MC3: maximum temperature %s, adaptive temperatures: %s (target swap rate %s)",
+                             mcmc_config['MC3']['MAX_TEMPERATURE'], mcmc_config['MC3']['ADAPT_TEMPERATURES'],
+                             mcmc_config['MC3']['TARGET_SWAP_RATE'])
+        self.logger.info("Chains are distributed to %s worker processes", mcmc_config['N_WORKERS'])
+        self.logger.info("Chains step together (vectorized across chains): %s", mcmc_config['VECTORIZE_CHAINS'])
+        self.logger.info("Steps between checkpoints (0: no checkpoints): %s", mcmc_config['CHECKPOINT_EVERY'])
+        self.logger.info("Warm-up sample cached (cache invalidated): %s (%s)",
+                         mcmc_config['WARM_UP']['CACHE'], mcmc_config['WARM_UP']['INVALIDATE_CACHE'])
+        self.logger.info("Pseudocounts for tuning the width of the proposal distribution for weights: %s ",
+                         mcmc_config['PROPOSAL_PRECISION']['weights'])
+        self.logger.info("Pseudocounts for tuning the width of the proposal distribution for "
+                         "universal pressure (alpha): %s ",
+                         mcmc_config['PROPOSAL_PRECISION']['universal'])
         if mcmc_config['PROPOSAL_PRECISION']['inheritance'] is not None:
-            logging.info("Pseudocounts for tuning the width of the proposal distribution for inheritance (beta): %s ",
-                         mcmc_config['PROPOSAL_PRECISION']['inheritance'])
-        logging.info("Pseudocounts for tuning the width of the proposal distribution for areas (gamma): %s ",
-                     mcmc_config['PROPOSAL_PRECISION']['contact'])
-
-        logging.info("Ratio of areal steps (growing, shrinking, swapping areas): %s",
-                     mcmc_config['STEPS']['area'])
-        logging.info("Ratio of weight steps (changing weights): %s", mcmc_config['STEPS']['weights'])
-        logging.info("Ratio of universal steps (changing alpha) : %s", mcmc_config['STEPS']['universal'])
-        logging.info("Ratio of inheritance steps (changing beta): %s", mcmc_config['STEPS']['inheritance'])
-        logging.info("Ratio of contact steps (changing gamma): %s", mcmc_config['STEPS']['contact'])
+            self.logger.info("Pseudocounts for tuning the width of the proposal distribution for inheritance (beta): %s ",
+                             mcmc_config['PROPOSAL_PRECISION']['inheritance'])
+        self.logger.info("Pseudocounts for tuning the width of the proposal distribution for areas (gamma): %s ",
+                         mcmc_config['PROPOSAL_PRECISION']['contact'])
+
+        self.logger.info("Probabilities resampled by data-augmentation (Gibbs) steps: %s",
+                         mcmc_config['GIBBS_PROBABILITIES'])
+        self.logger.info("Informed (locally balanced) grow and shrink steps: %s",
+                         mcmc_config['INFORMED_AREA_STEPS'])
+        self.logger.info("Number of tries of multiple-try area steps: %s",
+                         mcmc_config['STEPS']['MULTIPLE_TRIES'])
+        self.logger.info("Ratio of areal steps (growing, shrinking, swapping areas): %s",
+                         mcmc_config['STEPS']['area'])
+        self.logger.info("Ratio of weight steps (changing weights): %s", mcmc_config['STEPS']['weights'])
+        self.logger.info("Ratio of universal steps (changing alpha) : %s", mcmc_config['STEPS']['universal'])
+        self.logger.info("Ratio of inheritance steps (changing beta): %s", mcmc_config['STEPS']['inheritance'])
+        self.logger.info("Ratio of contact steps (changing gamma): %s", mcmc_config['STEPS']['contact'])
 
     def steps_per_operator(self):
         # Assign steps per operator
@@ -206,9 +235,33 @@ class MCMC:
                'alter_p_global': self.config['mcmc']['STEPS']['universal'],
                'alter_p_zones': self.config['mcmc']['STEPS']['contact'],
                'alter_p_families': self.config['mcmc']['STEPS']['inheritance']}
+
+        # Resample the probabilities by data-augmentation (Gibbs) steps instead of random-walk steps
+        if self.config['mcmc']['GIBBS_PROBABILITIES']:
+            for p in ['p_global', 'p_zones', 'p_families']:
+                ops['gibbs_' + p] = ops.pop('alter_' + p)
+
+        # Grow and shrink zones by informed (locally balanced) proposals
+        if self.config['mcmc']['INFORMED_AREA_STEPS']:
+            for op in ['grow_zone', 'shrink_zone']:
+                ops[op + '_informed'] = ops.pop(op)
+
+        # Area operators with more than one try are replaced by multiple-try Metropolis steps
+        for op, k in self.config['mcmc']['STEPS']['MULTIPLE_TRIES'].items():
+            if k > 1 and op in ops:
+                ops[op + '_mtm'] = ops.pop(op)
         self.ops = ops
 
-    def sample(self, lh_per_area=True, initial_sample: typing.Optional[typing.Any] = None):
+    def sample(self, run, lh_per_area=True, initial_sample: typing.Optional[typing.Any] = None, resume=False):
+        self.run = run
+        paths = self.get_paths(run)
+        paths['parameters'].parent.mkdir(exist_ok=True)
+
+        # Continue an interrupted run from its last checkpoint
+        checkpoint = None
+        if resume and paths['checkpoint'].exists():
+            checkpoint = load_from(paths['checkpoint'])
+            self.logger.info("Resuming run %s from the checkpoint at step %s", run, checkpoint['i_step'])
 
         if initial_sample is None:
             if self.sample_from_warm_up is None:
@@ -216,11 +269,27 @@ class MCMC:
             else:
                 initial_sample = self.sample_from_warm_up
 
+        mc3 = self.config['mcmc'].get('MC3')
+        if mc3 is not None:
+            mc3_kwargs = dict(mc3=True, swap_period=mc3['SWAP_PERIOD'], chain_swaps=mc3['N_SWAPS'],
+                              max_temperature=mc3['MAX_TEMPERATURE'],
+                              adapt_temperatures=mc3['ADAPT_TEMPERATURES'],
+                              target_swap_rate=mc3['TARGET_SWAP_RATE'])
+        else:
+            mc3_kwargs = dict(mc3=False)
+
         self.sampler = ZoneMCMCGenerative(network=self.data.network, features=self.data.features,
                                           inheritance=self.config['model']['INHERITANCE'],
                                           prior=self.prior_structured,
                                           n_zones=self.config['model']['N_AREAS'],
                                           n_chains=self.config['mcmc']['N_CHAINS'],
+                                          n_workers=self.config['mcmc']['N_WORKERS'],
+                                          vectorize_chains=self.config['mcmc']['VECTORIZE_CHAINS'],
+                                          zone_cache_mb=self.config['mcmc']['ZONE_CACHE_MB'],
+                                          multiple_tries=self.config['mcmc']['STEPS']['MULTIPLE_TRIES'],
+                                          checkpoint_path=paths['checkpoint'],
+                                          checkpoint_every=self.config['mcmc']['CHECKPOINT_EVERY'],
+                                          **mc3_kwargs,
                                           min_size=self.config['model']['MIN_M'],
                                           max_size=self.config['model']['MAX_M'],
                                           initial_sample=initial_sample,
@@ -229,22 +298,34 @@ class MCMC:
                                           p_grow_connected=self.config['mcmc']['P_GROW_CONNECTED'],
                                           initial_size=self.config['mcmc']['M_INITIAL'])
 
+        # Write the samples to file while sampling (instead of collecting them in memory)
+        if self.config['results']['STREAM_SAMPLES']:
+            self.sampler.sample_writer = SampleWriter(
+                paths=paths, data=self.data, config=self.config,
+                evaluate_single_zones=self.sampler.evaluate_single_zones if lh_per_area else None,
+                true_zones=self.data.areas if self.data.is_simulated else None,
+                state=None if checkpoint is None else checkpoint['sample_writer']
+            )
+
         self.sampler.generate_samples(self.config['mcmc']['N_STEPS'],
-                                      self.config['mcmc']['N_SAMPLES'])
+                                      self.config['mcmc']['N_SAMPLES'],
+                                      checkpoint=checkpoint)
 
         # Evaluate likelihood and prior for each zone alone (makes it possible to rank zones)
-        if lh_per_area:
+        if lh_per_area and self.sampler.sample_writer is None:
             self.sampler = contribution_per_area(self.sampler)
 
         self.samples = self.sampler.statistics
 
     def log_statistics(self):
-        logging.info("\n")
-        logging.info("MCMC STATISTICS")
-        logging.info("##########################################")
-        logging.info(log_operator_statistics_header())
+        self.logger.info("\n")
+        self.logger.info("MCMC STATISTICS")
+        self.logger.info("##########################################")
+        self.logger.info(log_operator_statistics_header())
         for op_name in self.ops:
-            logging.info(log_operator_statistics(op_name, self.samples))
+            self.logger.info(log_operator_statistics(op_name, self.samples))
+        self.logger.info("Zone cache: %s hits, %s misses",
+                         self.samples['zone_cache_hits'], self.samples['zone_cache_misses'])
 
     @staticmethod
     def empty_sample():
@@ -306,7 +387,35 @@ class MCMC:
                 self.samples['true_prior_single_zones'] = ground_truth_prior_single_area
                 self.samples['true_posterior_single_zones'] = ground_truth_posterior_single_area
 
+    def warm_up_cache_key(self):
+        """The key of the warm-up in the cache: a hash of the data, the priors and the warm-up settings.
+
+        Returns:
+            str: The hexadecimal hash.
+        """
+        mcmc_config = self.config['mcmc']
+        network = self.data.network
+        return content_hash(self.data.features, self.data.families,
+                            network['adj_mat'], network['locations'],
+                            network['distances'].points, network['distances'].metric_name,
+                            self.prior_structured,
+                            {key: self.config['model'][key] for key in ['N_AREAS', 'MIN_M', 'MAX_M', 'INHERITANCE']},
+                            self.ops,
+                            {key: mcmc_config[key] for key in ['P_GROW_CONNECTED', 'PROPOSAL_PRECISION', 'M_INITIAL']},
+                            mcmc_config['STEPS']['MULTIPLE_TRIES'],
+                            mcmc_config['WARM_UP']['N_WARM_UP_STEPS'], mcmc_config['WARM_UP']['N_WARM_UP_CHAINS'])
+
     def warm_up(self):
+        # The best sample of a previous warm-up with the same data and settings is loaded from the cache
+        warm_up_config = self.config['mcmc']['WARM_UP']
+        cache_path = None
+        if warm_up_config['CACHE']:
+            cache_path = self.path_results / ('warm_up_' + self.warm_up_cache_key()[:16] + '.pkl')
+            if cache_path.exists() and not warm_up_config['INVALIDATE_CACHE']:
+                self.sample_from_warm_up = load_from(cache_path)
+                self.logger.info("Loaded the warm-up sample from %s", cache_path)
+                return
+
         initial_sample = self.empty_sample()
 
         # In warmup chains can have a different max_size for areas
@@ -327,6 +436,10 @@ class MCMC:
                                 prior=self.prior_structured,
                                 inheritance=self.config['model']['INHERITANCE'],
                                 n_chains=self.config['mcmc']['WARM_UP']['N_WARM_UP_CHAINS'],
+                                n_workers=self.config['mcmc']['N_WORKERS'],
+                                vectorize_chains=self.config['mcmc']['VECTORIZE_CHAINS'],
+                                zone_cache_mb=self.config['mcmc']['ZONE_CACHE_MB'],
+                                multiple_tries=self.config['mcmc']['STEPS']['MULTIPLE_TRIES'],
                                 operators=self.ops, families=self.data.families,
                                 var_proposal=self.config['mcmc']['PROPOSAL_PRECISION'],
                                 p_grow_connected=p_grow_connected_list,
@@ -338,11 +451,18 @@ class MCMC:
                                                            warm_up=True,
                                                            warm_up_steps=self.config['mcmc']['WARM_UP']['N_WARM_UP_STEPS'])
 
-    def save_samples(self, run=1):
+        if cache_path is not None:
+            dump(self.sample_from_warm_up.copy(), cache_path)
+            self.logger.info("Saved the warm-up sample to %s", cache_path)
 
-        self.samples = match_areas(self.samples)
-        self.samples = rank_areas(self.samples)
+    def get_paths(self, run):
+        """Get the paths of the result files of a run.
 
+        Args:
+            run (int): The current run.
+        Returns:
+            dict: file path for stats, areas and ground truth
+        """
         file_info = self.config['results']['FILE_INFO']
 
         if file_info == "n":
@@ -368,15 +488,34 @@ class MCMC:
         ext = '.txt'
         gt_pth = pth / 'ground_truth'
 
-        paths = {'parameters': pth / ('stats_' + fi + run + ext),
-                 'areas': pth / ('areas_' + fi + run + ext),
-                 'gt': gt_pth / ('stats' + ext),
-                 'gt_areas': gt_pth / ('areas' + ext)}
+        return {'parameters': pth / ('stats_' + fi + run + ext),
+                'areas': pth / ('areas_' + fi + run + ext),
+                'gt': gt_pth / ('stats' + ext),
+                'gt_areas': gt_pth / ('areas' + ext),
+                'checkpoint': pth / ('checkpoint_' + fi + run + '.pkl')}
 
-        pth.mkdir(exist_ok=True)
+    def save_samples(self):
+        # The samples are saved in the files of the sampled run (they may have been streamed there already)
+        paths = self.get_paths(self.run)
+        paths['parameters'].parent.mkdir(exist_ok=True)
 
         if self.data.is_simulated:
             self.eval_ground_truth()
-            gt_pth.mkdir(exist_ok=True)
+            paths['gt'].parent.mkdir(exist_ok=True)
+
+        if self.sampler.sample_writer is not None:
+            # The samples were written while sampling: only rank the areas and add the ground truth
+            self.sampler.sample_writer.close()
+            self.sampler.sample_writer = None
+            if self.data.is_simulated:
+                ground_truth2file(self.samples, self.data, self.config, paths)
+
+        else:
+            self.samples = match_areas(self.samples)
+            self.samples = rank_areas(self.samples)
+
+            samples2file(self.samples, self.data, self.config, paths)
 
-        samples2file(self.samples, self.data, self.config, paths)
+        # The run is complete: its checkpoint is not needed any more
+        if paths['checkpoint'].exists():
+            paths['checkpoint'].unlink()
@@ -1,33 +1,101 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import itertools
+from collections import OrderedDict
+
 import numpy as np
 import scipy.stats as stats
-from scipy.sparse.csgraph import minimum_spanning_tree
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components, minimum_spanning_tree
 
-from sbayes.util import (compute_delaunay, n_smallest_distances, log_binom,
-                         counts_to_dirichlet, inheritance_counts_to_dirichlet,
-                         dirichlet_logpdf)
+from sbayes.util import (NA_STATE, DistanceProvider, bitset_changes, compute_delaunay, encode_state_indices,
+                         n_smallest_distances, log_binom, counts_to_dirichlet,
+                         inheritance_counts_to_dirichlet, dirichlet_logpdf)
 EPS = np.finfo(float).eps
 
 
+class ZoneCache(object):
+    """A least-recently-used cache for the evaluation of single zones. Entries are keyed by the packed
+    membership of a zone (and the parameters the evaluation depends on). The memory of the cached keys
+    and values is bounded by a budget, the least recently used entries are evicted first.
+
+    Attributes:
+        max_bytes (int): The memory budget of the cache.
+        n_bytes (int): The memory used by the cached entries.
+        hits (int): The number of lookups which were found in the cache.
+        misses (int): The number of lookups which were not found in the cache.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(kind, zone, *parameters):
+        """Compose the key of a zone evaluation.
+
+        Args:
+            kind (str): The kind of the evaluation (e.g. 'lh' or 'geo').
+            zone (np.array): Boolean array representing the zone.
+                shape: (n_sites)
+            parameters (np.array): The parameters the evaluation depends on.
+        Returns:
+            tuple: The key.
+        """
+        return (kind, np.packbits(zone).tobytes()) + tuple(np.ascontiguousarray(p).tobytes() for p in parameters)
+
+    def get(self, key):
+        """Look up a zone evaluation (None if it is not cached)."""
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return value[0]
+
+    def put(self, key, value):
+        """Cache a zone evaluation (a numpy array or a tuple of numpy arrays) and evict the least
+        recently used entries when the memory budget is exceeded."""
+        if key in self.entries:
+            return
+
+        arrays = value if isinstance(value, tuple) else (value,)
+        n_bytes = sum(len(k) for k in key) + sum(a.nbytes for a in arrays)
+        if n_bytes > self.max_bytes:
+            return
+
+        self.entries[key] = (value, n_bytes)
+        self.n_bytes += n_bytes
+        while self.n_bytes > self.max_bytes:
+            _, (_, n_bytes_evicted) = self.entries.popitem(last=False)
+            self.n_bytes -= n_bytes_evicted
+
+
 def compute_global_likelihood(features, p_global=None,
                               outdated_indices=None, cached_lh=None):
     """Computes the global likelihood, that is the likelihood per site and features
     without knowledge about family or zones.
 
     Args:
-        features (np.array or 'SparseMatrix'): The feature values for all sites and features.
-                shape: (n_sites, n_features, n_categories)
+        features (np.array or 'SparseMatrix'): The feature values for all sites and features, either
+            one-hot encoded or as state indices (see encode_state_indices).
+                shape: (n_sites, n_features, n_categories) or (n_sites, n_features)
         p_global (np.array): The estimated global probabilities of all features in all site
             shape: (1, n_features, n_sites)
-        outdated_indices (IndexSet): Features which changed, i.e. where lh needs to be recomputed.
+        outdated_indices (np.array): Boolean mask of the features which changed, i.e. where lh needs
+            to be recomputed.
+            shape: (n_features)
         cached_lh (np.array): the global likelihood computed previously
     Returns:
         (np.array): the global likelihood per site and feature
             shape: (n_sites, n_features)
     """
-    n_sites, n_features, n_categories = features.shape
+    n_sites, n_features = features.shape[:2]
 
     # # Estimate the global probability to find a feature/category
     # p_glob = np.sum(features, axis=0) / n_sites
@@ -37,106 +105,123 @@ def compute_global_likelihood(features, p_global=None,
 
     if cached_lh is None:
         lh_global = np.ones((n_sites, n_features))
-        assert outdated_indices.all
+        i_f = slice(None)
     else:
         lh_global = cached_lh
+        i_f = np.flatnonzero(outdated_indices)
 
-    if outdated_indices.all:
-        outdated_indices = range(n_features)
-
-    for i_f in outdated_indices:
-        f = features[:, i_f, :]
-
-        # Compute the feature likelihood vector (for all sites in zone)
-        lh_global[:, i_f] = f.dot(p_global[0, i_f, :])
+    # Compute the feature likelihood of all outdated features at once
+    lh_global[:, i_f] = zone_likelihood_kernel(features[:, i_f], p_global[0, i_f, :])
 
     return lh_global
 
 
-def compute_zone_likelihood(features, zones, p_zones=None,
-                            outdated_indices=None, outdated_zones=None, cached_lh=None):
+def compute_zone_likelihood(features, zones, p_zones=None, outdated_indices=None, outdated_zones=None,
+                            cached_lh=None, zone_cache=None, zone_sites=None):
     """Computes the zone likelihood that is the likelihood per site and feature given zones z1, ... zn
     Args:
-        features(np.array or 'SparseMatrix'): The feature values for all sites and features.
-            shape: (n_sites, n_features, n_categories)
+        features(np.array or 'SparseMatrix'): The feature values for all sites and features, either
+            one-hot encoded or as state indices (see encode_state_indices).
+            shape: (n_sites, n_features, n_categories) or (n_sites, n_features)
         zones(np.array): Binary arrays indicating the assignment of a site to the current zones.
             shape: (n_zones, n_sites)
     Kwargs:
         p_zones(np.array): The estimated probabilities of features in all sites according to the zone
             shape: (n_zones, n_features, n_sites)
-        outdated_indices (IndexSet): Set of outdated (zone, feature) index-pairs.
-        outdated_zones (IndexSet): Set of indices, where the zone changed (=> update across features).
+        outdated_indices (np.array): Boolean mask of the outdated (zone, feature) pairs.
+            shape: (n_zones, n_features)
+        outdated_zones (np.array): Boolean mask of the zones which changed (=> update across features).
+            shape: (n_zones)
         cached_lh (np.array): The cached set of likelihood values (to be updated, where outdated).
-
+        zone_cache (ZoneCache): Cache for the likelihood of whole zones (optional).
+        zone_sites (list): Index-list of the sites in each zone (optional, computed from zones if not given).
 
     Returns:
         (np.array): the zone likelihood per site and feature
             shape: (n_sites, n_features)
     """
 
-    n_sites, n_features, n_categories = features.shape
+    n_sites, n_features = features.shape[:2]
     n_zones = len(zones)
 
     if cached_lh is None:
         lh_zone = np.zeros((n_sites, n_features))
-        assert outdated_indices.all
+        outdated = np.ones((n_zones, n_features), dtype=bool)
     else:
         lh_zone = cached_lh
+        outdated = outdated_indices
+        if outdated_zones is not None:
+            outdated = outdated | outdated_zones[:, np.newaxis]
+
+    # Each zone with outdated features is evaluated in one batch
+    for z in np.flatnonzero(np.any(outdated, axis=1)):
+        # Index of the sites in zone z (computed once per zone)
+        if zone_sites is None:
+            idx = zones[z].nonzero()[0]
+        else:
+            idx = zone_sites[z]
 
-    if outdated_indices.all:
-        outdated_indices = itertools.product(range(n_zones), range(n_features))
-    else:
-        if outdated_zones:
-            outdated_zones_expanded = {(zone, feat) for zone in outdated_zones for feat in range(n_features)}
-            outdated_indices = set.union(outdated_indices, outdated_zones_expanded)
-
-    # features_by_zone = {features[zones[z], :, :] for z in range(n_zones)}
-    features_by_zone = {}
-
-    for z, i_f in outdated_indices:
-        # # Estimate the probability to find a feature/category in the zone, given the counts per category
-        # features_zone = features[zones[z], :, :]
-        #
-        # if sample_p_zones:
-        #     p_zone = p_zones[z]
-        # else:
-        #     # Maximum likelihood estimate
-        #     idx = zones[z].nonzero()[0]
-        #     zone_size = len(idx)
-        #     p_zone = np.sum(features_zone, axis=0) / zone_size
-        # # p_zone.shape = (n_features, n_categories)
-        #
-        # # Division by zero could cause troubles
-        # p_zone = p_zone.clip(EPS, 1 - EPS)
-        #
-        # f = features_zone[:, i_f, :]
-        # # f.shape = (zone_size, n_categories)
-
-        # Compute the feature likelihood vector (for all sites in zone)
-        # f = features[zones[z], i_f, :]
-        # f = features_by_zone[z][:, i_f, :]
-        if z not in features_by_zone:
-            features_by_zone[z] = features[zones[z], :, :]
-        f = features_by_zone[z][:, i_f, :]
-        p = p_zones[z, i_f, :]
-        lh_zone[zones[z], i_f] = f.dot(p)
+        if np.all(outdated[z]):
+            # All features of the zone: one einsum over the gathered sites (or look it up in the cache)
+            if zone_cache is None:
+                lh_zone[idx, :] = zone_likelihood_kernel(features[idx], p_zones[z])
+                continue
+
+            key = zone_cache.key('lh', zones[z], p_zones[z])
+            lh_z = zone_cache.get(key)
+            if lh_z is None:
+                lh_z = zone_likelihood_kernel(features[idx], p_zones[z])
+                zone_cache.put(key, lh_z)
+            lh_zone[idx, :] = lh_z
+
+        else:
+            # Only some features of the zone: gather the (site, feature) block and evaluate it at once
+            i_f = np.flatnonzero(outdated[z])
+            block = np.ix_(idx, i_f)
+            lh_zone[block] = zone_likelihood_kernel(features[block], p_zones[z, i_f, :])
 
     return lh_zone
 
 
+def zone_likelihood_kernel(features, p):
+    """Batched likelihood of a block of sites and features, given one probability vector per feature.
+    For integer-coded features the likelihood is gathered from p (0 for NA features), for one-hot encoded
+    features it is the dot product over the categories.
+
+    Args:
+        features (np.array): The features of the sites in the block (one-hot encoded or state indices).
+            shape: (n_block_sites, n_block_features, n_categories) or (n_block_sites, n_block_features)
+        p (np.array): The probabilities of each category per feature.
+            shape: (n_block_features, n_categories)
+
+    Returns:
+        np.array: The likelihood per site and feature in the block.
+            shape: (n_block_sites, n_block_features)
+    """
+    if features.ndim == 2:
+        # The NA_STATE index (-1) points to an appended column of zeros
+        p_na = np.zeros((p.shape[0], p.shape[1] + 1))
+        p_na[:, :-1] = p
+        return p_na[np.arange(p.shape[0]), features]
+
+    return np.einsum('ijk,jk->ij', features, p)
+
+
 def compute_family_likelihood(features, families, p_families=None,
                               outdated_indices=None, cached_lh=None):
     """Computes the family likelihood, that is the likelihood per site and feature given family f1, ... fn
 
     Args:
-        features(np.array or 'SparseMatrix'): The feature values for all sites and features.
-            shape: (n_sites, n_features, n_categories)
+        features(np.array or 'SparseMatrix'): The feature values for all sites and features, either
+            one-hot encoded or as state indices (see encode_state_indices).
+            shape: (n_sites, n_features, n_categories) or (n_sites, n_features)
         families(np.array): Binary arrays indicating the assignment of a site to a family.
                 shape: (n_families, n_sites)
     Kwargs:
         p_families(np.array): The estimated probabilities of features in all sites according to the family
             shape: (n_families, n_features, n_sites)
-        outdated_indices (IndexSet): Set of outdated (family, feature) index-pairs.
+        outdated_indices (np.array): Boolean mask of the outdated (family, feature) pairs.
+            shape: (n_families, n_features)
         cached_lh (np.array): The cached set of likelihood values (to be updated, where outdated).
 
     Returns:
@@ -144,23 +229,22 @@ def compute_family_likelihood(features, families, p_families=None,
             shape: (n_sites, n_features)
     """
 
-    n_sites, n_features, n_categories = features.shape
+    n_sites, n_features = features.shape[:2]
     n_families = len(families)
 
     if cached_lh is None:
         lh_families = np.zeros((n_sites, n_features))
-        assert outdated_indices.all
+        outdated = np.ones((n_families, n_features), dtype=bool)
     else:
         lh_families = cached_lh
+        outdated = outdated_indices
 
-    if outdated_indices.all:
-        outdated_indices = itertools.product(range(n_families), range(n_features))
-
-    for fam, i_f in outdated_indices:
-        # Compute the feature likelihood vector (for all sites in family)
-        f = features[families[fam], i_f, :]
-        p = p_families[fam, i_f, :]
-        lh_families[families[fam], i_f] = f.dot(p)
+    for fam in np.flatnonzero(np.any(outdated, axis=1)):
+        # Compute the likelihood of the outdated features (for all sites in family)
+        idx = families[fam].nonzero()[0]
+        i_f = np.flatnonzero(outdated[fam])
+        block = np.ix_(idx, i_f)
+        lh_families[block] = zone_likelihood_kernel(features[block], p_families[fam, i_f, :])
 
     return lh_families
 
@@ -182,12 +266,55 @@ def normalize_weights(weights, assignment):
     return weights_per_site / weights_per_site.sum(axis=2, keepdims=True)
 
 
+def compute_likelihood_of_chains(likelihoods, samples):
+    """Compute the likelihood of the samples of several chains, each with its own GenerativeLikelihood
+    (and cache). The outdated blocks of the log-likelihood matrices of all chains are stacked and
+    evaluated in a single call.
+
+    Args:
+        likelihoods (list): The GenerativeLikelihood of each chain.
+        samples (list): The current sample of each chain.
+
+    Returns:
+        list: The log-likelihood of each sample.
+    """
+    outdated_blocks = [likelihood.prepare_update(sample) for likelihood, sample in zip(likelihoods, samples)]
+    all_blocks = [block for blocks in outdated_blocks for block in blocks]
+
+    log_lh_blocks = []
+    if len(all_blocks) > 0:
+        # Flatten the (site, feature) pairs of all blocks and compute the log-likelihood at once
+        n_components = all_blocks[0][2].shape[-1]
+        weights = np.concatenate([w.reshape(-1, n_components) for _, _, w, _, _ in all_blocks])
+        all_lh = np.concatenate([lh.reshape(-1, n_components) for _, _, _, lh, _ in all_blocks])
+        na_features = np.concatenate([na.ravel() for _, _, _, _, na in all_blocks])
+        log_lh = GenerativeLikelihood.compute_log_lh(weights, all_lh, na_features)
+
+        split_at = np.cumsum([na.size for _, _, _, _, na in all_blocks])[:-1]
+        log_lh_blocks = [log_lh_block.reshape(na.shape)
+                         for log_lh_block, (_, _, _, _, na) in zip(np.split(log_lh, split_at), all_blocks)]
+
+    log_lh_per_chain = []
+    i = 0
+    for likelihood, sample, blocks in zip(likelihoods, samples, outdated_blocks):
+        log_lh_per_chain.append(likelihood.apply_update(sample, blocks, log_lh_blocks[i:i + len(blocks)]))
+        i += len(blocks)
+
+    return log_lh_per_chain
+
+
 class GenerativeLikelihood(object):
 
-    def __init__(self, data, inheritance, families=None):
+    def __init__(self, data, inheritance, families=None, zone_cache=None):
+        # The features are stored as state indices (one-hot encoded data is converted)
+        if data.ndim == 3:
+            data = encode_state_indices(data)
         self.data = data
         self.families = np.asarray(families, dtype=bool)
-        self.n_sites, self.n_features, self.n_categories = data.shape
+        self.n_sites, self.n_features = data.shape
+
+        # NA features are constant and only evaluated once
+        self.na_features = (data == NA_STATE)
 
         # The assignment (global, zone, family) combined and weighted and the non-normalized likelihood
         self.assignment = None
@@ -202,12 +329,25 @@ class GenerativeLikelihood(object):
         self.family_lh = None
         self.zone_lh = None
 
+        # The zones at the last evaluation (packed) and the sites where the assignment changed since then
+        self.zone_bitsets = None
+        self.outdated_sites = None
+
         # Weights
         self.weights = None
 
+        # The log-likelihood per site and feature, its sums per site and per feature and the total
+        self.log_lh_matrix = None
+        self.site_log_lh = None
+        self.feature_log_lh = None
+        self.log_lh = None
+
         # Set config flags
         self.inheritance = inheritance
 
+        # Cache for the likelihood of whole zones (shared between evaluators)
+        self.zone_cache = zone_cache
+
     def reset_cache(self):
         # The assignment (global, zone, family) combined and weighted and the non-normalized likelihood
         self.assignment = None
@@ -218,8 +358,15 @@ class GenerativeLikelihood(object):
         self.global_lh = None
         self.family_lh = None
         self.zone_lh = None
+        self.zone_bitsets = None
+        self.outdated_sites = None
         # Weights
         self.weights = None
+        # Log-likelihood
+        self.log_lh_matrix = None
+        self.site_log_lh = None
+        self.feature_log_lh = None
+        self.log_lh = None
 
     def __call__(self, sample, caching=True):
         """Compute the likelihood of all sites. The likelihood is defined as a mixture of the global distribution
@@ -238,11 +385,24 @@ class GenerativeLikelihood(object):
         if not caching:
             self.reset_cache()
 
-        features = self.data
-        n_sites, n_features, n_categories = features.shape
+        outdated_blocks = self.prepare_update(sample)
+        log_lh_blocks = [self.compute_log_lh(weights, all_lh, na_features)
+                         for _, _, weights, all_lh, na_features in outdated_blocks]
+
+        return self.apply_update(sample, outdated_blocks, log_lh_blocks)
 
-        # Find NA features in the data
-        na_features = (np.sum(features, axis=-1) == 0)
+    def prepare_update(self, sample):
+        """Update the component likelihoods, assignment and weights and collect the blocks of the
+        log-likelihood matrix which need to be recomputed. If everything changed, the log-likelihood is
+        recomputed right away and no blocks are returned.
+
+        Args:
+            sample (Sample): The current sample.
+
+        Returns:
+            list: The outdated blocks as tuples (axis, index, weights, all_lh, na_features), where axis is 0
+                for the rows of the given sites and 1 for the columns of the given features.
+        """
 
         ##############################
         # Component distributions
@@ -250,79 +410,161 @@ class GenerativeLikelihood(object):
         global_assignment, global_lh = self.get_global_lh(sample)
         family_assignment, family_lh = self.get_family_lh(sample)
         zone_assignment, zone_lh = self.get_zone_lh(sample)
+
         ##############################
         # Combination
         ##############################
-        # Assignments are recombined when initialized or when zones change
-        if self.assignment is None or sample.what_changed['lh']['zones']:
+        outdated_features = self.get_outdated_features(sample)
 
-            # Structure of assignment depends on whether inheritance is considered or not
-            if self.inheritance:
-                assignment = np.array([global_assignment, zone_assignment, family_assignment]).T
-            else:
-                assignment = np.array([global_assignment, zone_assignment]).T
+        if self.log_lh is None or self.outdated_sites is None or outdated_features is None:
+            # Initialized or everything changed: combine all sites and features
+            self.combine_lh(sample, global_assignment, global_lh, family_assignment, family_lh,
+                            zone_assignment, zone_lh)
+            return []
 
-            self.assignment = assignment
-        else:
-            assignment = self.assignment
+        outdated_blocks = []
+
+        # Area steps change the rows of the sites which entered or left a zone...
+        if len(self.outdated_sites) > 0:
+            outdated_blocks.append(self.update_lh_at_sites(sample, self.outdated_sites))
+
+        # ...all other steps change the column of a single feature
+        if len(outdated_features) > 0:
+            outdated_blocks.append(self.update_lh_of_features(sample, outdated_features))
 
-        # Lh is recombined when initialized, when zones change or when p_global, p_zones or p_families change
-        if self.all_lh is None or sample.what_changed['lh']['zones'] or sample.what_changed['lh']['p_global'] or \
-                sample.what_changed['lh']['p_zones'] or sample.what_changed['lh']['p_families']:
+        return outdated_blocks
 
-            # Structure of assignment depends on whether inheritance is considered or not
-            if self.inheritance:
-                all_lh = np.array([global_lh, zone_lh, family_lh]).transpose((1, 2, 0))
+    def apply_update(self, sample, outdated_blocks, log_lh_blocks):
+        """Write the recomputed blocks to the log-likelihood matrix and adjust the sums.
+
+        Args:
+            sample (Sample): The current sample.
+            outdated_blocks (list): The outdated blocks (see prepare_update).
+            log_lh_blocks (list): The log-likelihood of each outdated block.
+
+        Returns:
+            float: The log-likelihood of the sample.
+        """
+        for (axis, index, _, _, _), log_lh_block in zip(outdated_blocks, log_lh_blocks):
+            if axis == 0:
+                self.feature_log_lh += np.sum(log_lh_block - self.log_lh_matrix[index], axis=0)
+                self.site_log_lh[index] = np.sum(log_lh_block, axis=1)
+                self.log_lh_matrix[index] = log_lh_block
             else:
-                all_lh = np.array([global_lh, zone_lh]).transpose((1, 2, 0))
+                self.site_log_lh += np.sum(log_lh_block - self.log_lh_matrix[:, index], axis=1)
+                self.feature_log_lh[index] = np.sum(log_lh_block, axis=0)
+                self.log_lh_matrix[:, index] = log_lh_block
+            self.log_lh = np.sum(self.feature_log_lh)
 
-            self.all_lh = all_lh
-        else:
-            all_lh = self.all_lh
+        # The step is completed. Everything is up-to-date.
+        sample.what_changed['lh'].clear()
 
-        ##############################
-        # Weights
-        ##############################
-        # weights are evaluated when initialized, when weights change or when assignment to zones changes
-        if self.weights is None or sample.what_changed['lh']['weights'] or sample.what_changed['lh']['zones']:
+        return self.log_lh
 
-            abnormal_weights = sample.weights
+    def get_outdated_features(self, sample):
+        """Collect the features where the weights or the component likelihoods changed.
 
-            # Extract weights for each site depending on whether the likelihood is available
-            # Order of columns in weights: global, contact, inheritance (if available)
-            abnormal_weights_per_site = np.repeat(abnormal_weights[np.newaxis, :, :], n_sites, axis=0)
-            weights = normalize_weights(abnormal_weights_per_site, assignment)
-            self.weights = weights
+        Args:
+            sample (Sample): The current sample.
+
+        Returns:
+            np.array: Index-list of the outdated features (None if all features are outdated).
+        """
+        what_changed = sample.what_changed['lh']
+
+        outdated = what_changed.weights | what_changed.p_global | np.any(what_changed.p_zones, axis=0)
+        if self.inheritance:
+            outdated |= np.any(what_changed.p_families, axis=0)
 
+        if np.all(outdated):
+            return None
+        return np.flatnonzero(outdated)
+
+    def combine_lh(self, sample, global_assignment, global_lh, family_assignment, family_lh,
+                   zone_assignment, zone_lh):
+        """Combine the component likelihoods and weights of all sites and compute the log-likelihood."""
+
+        # Structure of assignment depends on whether inheritance is considered or not
+        if self.inheritance:
+            self.assignment = np.array([global_assignment, zone_assignment, family_assignment]).T
+            self.all_lh = np.array([global_lh, zone_lh, family_lh]).transpose((1, 2, 0))
         else:
-            weights = self.weights
+            self.assignment = np.array([global_assignment, zone_assignment]).T
+            self.all_lh = np.array([global_lh, zone_lh]).transpose((1, 2, 0))
 
-        # This is always evaluated
+        # Extract weights for each site depending on whether the likelihood is available
+        # Order of columns in weights: global, contact, inheritance (if available)
+        self.weights = normalize_weights(sample.weights[np.newaxis, :, :], self.assignment)
 
-        weighted_lh = np.sum(weights * all_lh, axis=2)
-        # Replace na values by 1
-        weighted_lh[na_features] = 1.
-        log_lh = np.sum(np.log(weighted_lh))
+        self.log_lh_matrix = self.compute_log_lh(self.weights, self.all_lh, self.na_features)
+        self.site_log_lh = np.sum(self.log_lh_matrix, axis=1)
+        self.feature_log_lh = np.sum(self.log_lh_matrix, axis=0)
+        self.log_lh = np.sum(self.feature_log_lh)
 
-        # The step is completed. Everything is up-to-date.
-        sample.what_changed['lh']['zones'].clear()
-        sample.what_changed['lh']['p_global'].clear()
-        sample.what_changed['lh']['p_zones'].clear()
-        sample.what_changed['lh']['weights'] = False
+    def update_lh_at_sites(self, sample, sites):
+        """Update the assignment, likelihood and weights in the rows of the given sites.
+
+        Args:
+            sample (Sample): The current sample.
+            sites (np.array): Index-list of the sites where the assignment to zones changed.
+        Returns:
+            tuple: The outdated block of rows (see prepare_update).
+        """
+        # Only the zone component changes
+        self.assignment[sites, 1] = self.zone_assignment[sites]
+        self.all_lh[sites, :, 1] = self.zone_lh[sites]
+        self.weights[sites] = normalize_weights(sample.weights[np.newaxis, :, :], self.assignment[sites])
+
+        return 0, sites, self.weights[sites], self.all_lh[sites], self.na_features[sites]
+
+    def update_lh_of_features(self, sample, features):
+        """Update the likelihood and weights in the columns of the given features.
+
+        Args:
+            sample (Sample): The current sample.
+            features (np.array): Index-list of the features where the weights or any of the
+                component likelihoods changed.
+        Returns:
+            tuple: The outdated block of columns (see prepare_update).
+        """
+        self.all_lh[:, features, 0] = self.global_lh[:, features]
+        self.all_lh[:, features, 1] = self.zone_lh[:, features]
         if self.inheritance:
-            sample.what_changed['lh']['p_families'].clear()
+            self.all_lh[:, features, 2] = self.family_lh[:, features]
+        self.weights[:, features] = normalize_weights(sample.weights[np.newaxis, features, :], self.assignment)
+
+        return 1, features, self.weights[:, features], self.all_lh[:, features], self.na_features[:, features]
+
+    @staticmethod
+    def compute_log_lh(weights, all_lh, na_features):
+        """Compute the log-likelihood of the mixture per site and feature.
+
+        Args:
+            weights (np.array): The normalized weights per site and feature.
+                shape: (n_sites, n_features, 3)
+            all_lh (np.array): The component likelihoods per site and feature.
+                shape: (n_sites, n_features, 3)
+            na_features (np.array): Boolean array indicating NA features.
+                shape: (n_sites, n_features)
 
-        return log_lh
+        Returns:
+            np.array: The log-likelihood per site and feature (0 for NA features).
+                shape: (n_sites, n_features)
+        """
+        weighted_lh = np.sum(weights * all_lh, axis=-1)
+        # Replace na values by 1
+        weighted_lh[na_features] = 1.
+        return np.log(weighted_lh)
 
     def global_lh_outdated(self, sample):
-        return (self.global_lh is None) or (sample.what_changed['lh']['p_global'])
+        return (self.global_lh is None) or np.any(sample.what_changed['lh'].p_global)
 
     def get_global_lh(self, sample):
         if self.global_lh_outdated(sample):
 
             self.global_lh = compute_global_likelihood(features=self.data,
                                                        p_global=sample.p_global,
-                                                       outdated_indices=sample.what_changed['lh']['p_global'],
+                                                       outdated_indices=sample.what_changed['lh'].p_global,
                                                        cached_lh=self.global_lh)
 
         return self.global_assignment, self.global_lh
@@ -339,39 +581,75 @@ class GenerativeLikelihood(object):
             self.family_assignment = family_assignment
 
         # Family lh is evaluated when initialized and when p_families is changed
-        if self.family_lh is None or sample.what_changed['lh']['p_families']:
+        if self.family_lh is None or np.any(sample.what_changed['lh'].p_families):
             # assert np.allclose(a=np.sum(sample.p_families, axis=-1), b=1., rtol=EPS)
             self.family_lh = compute_family_likelihood(features=self.data, families=self.families,
                                                        p_families=sample.p_families,
-                                                       outdated_indices=sample.what_changed['lh']['p_families'],
+                                                       outdated_indices=sample.what_changed['lh'].p_families,
                                                        cached_lh=self.family_lh)
 
         return self.family_assignment, self.family_lh
 
     def get_zone_lh(self, sample):
-        if self.zone_assignment is None or sample.what_changed['lh']['zones']:
-            # Compute the assignment of sites to zones
-            zone_assignment = np.any(sample.zones, axis=0)
-            self.zone_assignment = zone_assignment
+        what_changed = sample.what_changed['lh']
+        membership = sample.membership
+
+        if self.zone_lh is None or self.zone_bitsets.shape != membership.bitsets.shape:
+            # Compute the assignment of sites to zones and the zone lh from scratch
+            self.zone_bitsets = membership.bitsets.copy()
+            self.zone_assignment = membership.occupied.copy()
+            self.outdated_sites = None
+
+            self.zone_lh = compute_zone_likelihood(features=self.data, zones=sample.zones,
+                                                   p_zones=sample.p_zones,
+                                                   outdated_indices=what_changed.p_zones,
+                                                   outdated_zones=what_changed.zones,
+                                                   cached_lh=self.zone_lh, zone_cache=self.zone_cache,
+                                                   zone_sites=membership.sites)
+            return self.zone_assignment, self.zone_lh
+
+        # Find the sites which entered or left one of the changed zones since the last evaluation
+        changed_zones = np.flatnonzero(what_changed.zones)
+        if len(changed_zones) > 0:
+            self.outdated_sites = bitset_changes(membership.bitsets[changed_zones],
+                                                 self.zone_bitsets[changed_zones])
+        else:
+            self.outdated_sites = np.zeros(0, dtype=int)
 
-        # Zone lh is evaluated when initialized, or when zones or p_zones change
-        if self.zone_lh is None or sample.what_changed['lh']['zones'] or sample.what_changed['lh']['p_zones']:
+        sites = self.outdated_sites
+        if len(sites) > 0:
+            self.zone_bitsets[changed_zones] = membership.bitsets[changed_zones]
+            self.zone_assignment[sites] = membership.occupied[sites]
+
+            # The zone lh is only evaluated for the sites entering a zone
+            # (sites leaving a zone are masked out by the assignment)
+            for z in changed_zones:
+                entered = sites[sample.zones[z, sites]]
+                self.zone_lh[entered, :] = zone_likelihood_kernel(self.data[entered], sample.p_zones[z])
+
+        # Zone lh is updated when p_zones change
+        if np.any(what_changed.p_zones):
             # assert np.allclose(a=np.sum(p_zones, axis=-1), b=1., rtol=EPS)
-            zone_lh = compute_zone_likelihood(features=self.data, zones=sample.zones,
-                                              p_zones=sample.p_zones,
-                                              outdated_indices=sample.what_changed['lh']['p_zones'],
-                                              outdated_zones=sample.what_changed['lh']['zones'],
-                                              cached_lh=self.zone_lh)
-            self.zone_lh = zone_lh
+            self.zone_lh = compute_zone_likelihood(features=self.data, zones=sample.zones,
+                                                   p_zones=sample.p_zones,
+                                                   outdated_indices=what_changed.p_zones,
+                                                   cached_lh=self.zone_lh, zone_cache=self.zone_cache,
+                                                   zone_sites=membership.sites)
 
         return self.zone_assignment, self.zone_lh
 
 
 class GenerativePrior(object):
 
-    def __init__(self):
+    def __init__(self, zone_cache=None):
         self.size_prior = None
         self.geo_prior = None
+        self.geo_prior_zones = None
+        self.geo_prior_mst_edges = None
+        self.geo_prior_per_zone = None
+
+        # Cache for the geo-prior of whole zones (shared between evaluators)
+        self.zone_cache = zone_cache
         self.prior_weights = None
         self.prior_p_global = None
         self.prior_p_zones = None
@@ -420,19 +698,13 @@ class GenerativePrior(object):
             log_prior += prior_p_families
 
         # The step is completed. Everything is up-to-date.
-        sample.what_changed['prior']['zones'].clear()
-        sample.what_changed['prior']['weights'] = False
-        sample.what_changed['prior']['p_global'].clear()
-        sample.what_changed['prior']['p_zones'].clear()
-
-        if inheritance:
-            sample.what_changed['prior']['p_families'].clear()
+        sample.what_changed['prior'].clear()
 
         return log_prior
 
     def weights_prior_outdated(self, sample):
         """Check whether the cached prior_weights is up-to-date or needs to be recomputed."""
-        return self.prior_weights is None or sample.what_changed['prior']['weights']
+        return self.prior_weights is None or np.any(sample.what_changed['prior'].weights)
 
     def get_prior_weights(self, sample, prior_weights_meta):
         """Compute the prior for weights (or load from cache).
@@ -458,9 +730,9 @@ class GenerativePrior(object):
         """Check whether the cached prior_p_zones is up-to-date or needs to be recomputed."""
         if self.prior_p_zones is None:
             return True
-        elif sample.what_changed['prior']['p_zones']:
+        elif np.any(sample.what_changed['prior'].p_zones):
             return True
-        elif prior_type == 'universal' and sample.what_changed['prior']['p_global']:
+        elif prior_type == 'universal' and np.any(sample.what_changed['prior'].p_global):
             return True
         else:
             return False
@@ -490,13 +762,13 @@ class GenerativePrior(object):
                 #
                 # self.prior_p_zones_distr = counts_to_dirichlet(counts=c_universal,
                 #                                                categories=prior_p_zones_meta['states'],
-                #                                                outdated_features=what_changed['p_global'],
+                #                                                outdated_features=what_changed.p_global,
                 #                                                dirichlet=self.prior_p_zones_distr)
                 # prior_p_zones = prior_p_families_dirichlet(p_families=sample.p_zones,
                 #                                                 dirichlet=self.prior_p_zones_distr,
                 #                                                 categories=prior_p_zones_meta['states'],
-                #                                                 outdated_indices=what_changed['p_zones'],
-                #                                                 outdated_distributions=what_changed['p_global'],
+                #                                                 outdated_indices=what_changed.p_zones,
+                #                                                 outdated_distributions=what_changed.p_global,
                 #                                                 cached_prior=self.prior_p_zones,
                 #                                                 broadcast=True)
             else:
@@ -510,9 +782,9 @@ class GenerativePrior(object):
         """Check whether the cached prior_p_families is up-to-date or needs to be recomputed."""
         if self.prior_p_families is None:
             return True
-        elif sample.what_changed['prior']['p_families']:
+        elif np.any(sample.what_changed['prior'].p_families):
             return True
-        elif (prior_type in ['universal', 'counts_and_universal']) and (sample.what_changed['prior']['p_global']):
+        elif (prior_type in ['universal', 'counts_and_universal']) and np.any(sample.what_changed['prior'].p_global):
             return True
         else:
             return False
@@ -539,8 +811,8 @@ class GenerativePrior(object):
                 prior_p_families = prior_p_families_dirichlet(p_families=sample.p_families,
                                                               dirichlet=prior_p_families_meta['dirichlet'],
                                                               categories=prior_p_families_meta['states'],
-                                                              outdated_indices=what_changed['p_families'],
-                                                              outdated_distributions=what_changed['p_global'],
+                                                              outdated_indices=what_changed.p_families,
+                                                              outdated_distributions=what_changed.p_global,
                                                               cached_prior=self.prior_p_families,
                                                               broadcast=False)
 
@@ -549,14 +821,14 @@ class GenerativePrior(object):
                 c_universal = s * sample.p_global[0]
                 self.prior_p_families_distr = counts_to_dirichlet(counts=c_universal,
                                                                   categories=prior_p_families_meta['states'],
-                                                                  outdated_features=what_changed['p_global'],
+                                                                  outdated_features=what_changed.p_global,
                                                                   dirichlet=self.prior_p_families_distr)
 
                 prior_p_families = prior_p_families_dirichlet(p_families=sample.p_families,
                                                               dirichlet=self.prior_p_families_distr,
                                                               categories=prior_p_families_meta['states'],
-                                                              outdated_indices=what_changed['p_families'],
-                                                              outdated_distributions=what_changed['p_global'],
+                                                              outdated_indices=what_changed.p_families,
+                                                              outdated_distributions=what_changed.p_global,
                                                               cached_prior=self.prior_p_families,
                                                               broadcast=True)
 
@@ -568,14 +840,14 @@ class GenerativePrior(object):
                 self.prior_p_families_distr = \
                     inheritance_counts_to_dirichlet(counts=c_universal + c_pseudocounts,
                                                     categories=prior_p_families_meta['states'],
-                                                    outdated_features=what_changed['p_global'],
+                                                    outdated_features=what_changed.p_global,
                                                     dirichlet=self.prior_p_families_distr)
 
                 prior_p_families = prior_p_families_dirichlet(p_families=sample.p_families,
                                                               dirichlet=self.prior_p_families_distr,
                                                               categories=prior_p_families_meta['states'],
-                                                              outdated_indices=what_changed['p_families'],
-                                                              outdated_distributions=what_changed['p_global'],
+                                                              outdated_indices=what_changed.p_families,
+                                                              outdated_distributions=what_changed.p_global,
                                                               cached_prior=self.prior_p_families,
                                                               broadcast=False)
 
@@ -588,7 +860,7 @@ class GenerativePrior(object):
 
     def prior_p_global_outdated(self, sample):
         """Check whether the cached prior_p_global is up-to-date or needs to be recomputed."""
-        return self.prior_p_global is None or sample.what_changed['prior']['p_global']
+        return self.prior_p_global is None or np.any(sample.what_changed['prior'].p_global)
 
     def get_prior_p_global(self, sample, prior_p_global_meta):
         """Compute the prior for p_global (or load from cache).
@@ -609,7 +881,7 @@ class GenerativePrior(object):
                 prior_p_global = prior_p_global_dirichlet(p_global=sample.p_global,
                                                           dirichlet=prior_p_global_meta['dirichlet'],
                                                           categories=prior_p_global_meta['states'],
-                                                          outdated_features=sample.what_changed['prior']['p_global'],
+                                                          outdated_features=sample.what_changed['prior'].p_global,
                                                           cached_prior=self.prior_p_global)
 
             else:
@@ -621,7 +893,7 @@ class GenerativePrior(object):
 
     def geo_prior_outdated(self, sample):
         """Check whether the cached geo_prior is up-to-date or needs to be recomputed."""
-        return self.geo_prior is None or sample.what_changed['prior']['zones']
+        return self.geo_prior is None or np.any(sample.what_changed['prior'].zones)
 
     def get_geo_prior(self, sample, geo_prior_meta, network):
         """Compute the geo-prior of the current zones (or load from cache).
@@ -638,11 +910,8 @@ class GenerativePrior(object):
             if geo_prior_meta['type'] == 'uniform':
                 geo_prior = 0.
 
-            elif geo_prior_meta['type'] == 'gaussian':
-                geo_prior = geo_prior_gaussian(sample.zones, network, geo_prior_meta['gaussian'])
-
-            elif geo_prior_meta['type'] == 'cost_based':
-                geo_prior = geo_prior_distance(sample.zones, network, geo_prior_meta['scale'])
+            elif geo_prior_meta['type'] in ('gaussian', 'cost_based'):
+                geo_prior = np.mean(np.concatenate(self.get_geo_prior_per_zone(sample, geo_prior_meta, network)))
 
             else:
                 raise ValueError('geo_prior must be either \"uniform\", \"gaussian\" or \"cost_based\".')
@@ -651,9 +920,46 @@ class GenerativePrior(object):
 
         return self.geo_prior
 
+    def get_geo_prior_per_zone(self, sample, geo_prior_meta, network):
+        """Compute the geo-prior of each edge in the minimum spanning tree of each zone. The minimum
+        spanning trees are cached per zone and only the zones with changed membership are updated.
+
+        Args:
+            sample (Sample): Current MCMC sample.
+            geo_prior_meta (dict): Meta-information about the prior.
+            network (dict): network containing the graph, location,...
+
+        Returns:
+            list: Logarithm of the prior probability density of each edge (one array per zone).
+        """
+        n_zones = sample.zones.shape[0]
+        if self.geo_prior_zones is None or self.geo_prior_zones.shape != sample.zones.shape:
+            self.geo_prior_zones = np.zeros_like(sample.zones)
+            self.geo_prior_mst_edges = [None] * n_zones
+            self.geo_prior_per_zone = [None] * n_zones
+
+        for z in range(n_zones):
+            if self.geo_prior_per_zone[z] is not None:
+                if not sample.what_changed['prior'].zones[z]:
+                    continue
+                if np.array_equal(self.geo_prior_zones[z], sample.zones[z]):
+                    continue
+
+            previous = None
+            if self.geo_prior_mst_edges[z] is not None:
+                previous = (self.geo_prior_zones[z], self.geo_prior_mst_edges[z])
+            edges, log_prior = compute_geo_prior_of_zone(sample.zones[z], geo_prior_meta, network,
+                                                         zone_cache=self.zone_cache, previous=previous)
+
+            self.geo_prior_zones[z] = sample.zones[z]
+            self.geo_prior_mst_edges[z] = edges
+            self.geo_prior_per_zone[z] = log_prior
+
+        return self.geo_prior_per_zone
+
     def size_prior_outdated(self, sample):
         """Check whether the cached size_prior is up-to-date or needs to be recomputed."""
-        return self.size_prior is None or sample.what_changed['prior']['zones']
+        return self.size_prior is None or np.any(sample.what_changed['prior'].zones)
 
     def get_size_prior(self, sample):
         """Compute the size-prior of the current zone (or load from cache).
@@ -708,78 +1014,207 @@ def evaluate_size_prior(zones):
     return logp
 
 
-def geo_prior_gaussian(zones: np.array, network: dict, cov: np.array):
+def get_distances(network: dict):
+    """The distances between the sites of a network (see util.DistanceProvider). Networks which only
+    contain a dense distance matrix ('dist_mat') are wrapped in a provider.
+    Args:
+        network (dict): network containing the graph, location,...
+
+    Returns:
+        DistanceProvider: the distances of the network
+    """
+    if isinstance(network, dict) and 'distances' not in network:
+        return DistanceProvider.from_matrix(network['dist_mat'])
+    return network['distances']
+
+
+def compute_mst_edges(zone: np.array, network: dict, graph=None):
     """
-    This function computes the two-dimensional Gaussian geo-prior for all edges in the zone
+    This function computes the minimum spanning tree of a zone, either on the Delaunay triangulation
+    of its sites or on a precomputed graph (see util.compute_mst_graph). If the zone is not connected
+    in the precomputed graph, the minimum spanning tree is computed on all pairwise distances.
     Args:
-        zones (np.array): boolean array representing the current zone
+        zone (np.array): boolean array representing the current zone
+            shape: (n_sites)
         network (dict): network containing the graph, location,...
-        cov (np.array): Covariance matrix of the multivariate gaussian (estimated from the data)
+        graph (csr_matrix): precomputed sparse graph, weighted by distance (None: triangulate the zone)
+            shape: (n_sites, n_sites)
 
     Returns:
-        float: the log geo-prior of the zones
+        (np.array, np.array): the two sites connected by each edge of the minimum spanning tree
     """
-    log_prior = np.ndarray([])
-    for z in zones:
-        dist_mat = network['dist_mat'][z][:, z]
-        locations = network['locations'][z]
+    sites = np.flatnonzero(zone)
+    distances = get_distances(network)
+    locations = network['locations'][sites]
 
-        if len(locations) > 3:
+    if len(locations) > 3:
 
+        if graph is None:
             delaunay = compute_delaunay(locations)
-            mst = minimum_spanning_tree(delaunay.multiply(dist_mat))
-            i1, i2 = mst.nonzero()
+            mst = minimum_spanning_tree(distances.sparse(delaunay, sites))
 
-        elif len(locations) == 3:
-            i1, i2 = n_smallest_distances(dist_mat, n=2, return_idx=True)
+        else:
+            zone_graph = graph[sites][:, sites]
+            if connected_components(zone_graph, directed=False, return_labels=False) == 1:
+                mst = minimum_spanning_tree(zone_graph)
+            else:
+                mst = minimum_spanning_tree(distances.submatrix(sites))
 
-        elif len(locations) == 2:
-            i1, i2 = n_smallest_distances(dist_mat, n=1, return_idx=True)
+        i1, i2 = mst.nonzero()
 
-        else:
-            raise ValueError("Too few locations to compute distance.")
+    elif len(locations) == 3:
+        i1, i2 = n_smallest_distances(distances.submatrix(sites), n=2, return_idx=True)
 
-        diffs = locations[i1] - locations[i2]
-        prior_z = stats.multivariate_normal.logpdf(diffs, mean=[0, 0], cov=cov)
-        log_prior = np.append(log_prior, prior_z)
+    elif len(locations) == 2:
+        i1, i2 = n_smallest_distances(distances.submatrix(sites), n=1, return_idx=True)
 
-    return np.mean(log_prior)
+    else:
+        raise ValueError("Too few locations to compute distance.")
 
+    return sites[i1], sites[i2]
 
-def geo_prior_distance(zones: np.array, network: dict, scale: float):
 
-    """ This function computes the geo prior for the sum of all distances of the mst of a zone
+def update_mst_edges(edges: tuple, zone_old: np.array, zone_new: np.array, network: dict, graph=None):
+    """
+    This function updates the minimum spanning tree of a zone after single sites were added or removed.
+    An added site is connected by the minimum spanning tree of the old tree and all edges of the new site.
+    A removed leaf is cut from the tree. The updated tree is the tree of compute_mst_edges: on a precomputed
+    graph, or on the Delaunay triangulation for Euclidean distances of the network locations (which contains
+    the minimum spanning tree of all pairs). In all other cases the tree has to be recomputed.
     Args:
-        zones (np.array): The current zones (boolean array)
-        network (dict):  The full network containing all sites.
-        scale (float): The scale (estimated from the data)
+        edges (tuple): the two sites connected by each edge of the old minimum spanning tree
+        zone_old (np.array): boolean array representing the old zone
+            shape: (n_sites)
+        zone_new (np.array): boolean array representing the new zone
+            shape: (n_sites)
+        network (dict): network containing the graph, location,...
+        graph (csr_matrix): precomputed sparse graph, weighted by distance (None: triangulate the zone)
+            shape: (n_sites, n_sites)
 
     Returns:
-        float: the geo-prior of the zones
+        (np.array, np.array): the edges of the new minimum spanning tree (None if it needs to be recomputed)
     """
-    log_prior = np.ndarray([])
-    for z in zones:
+    added = np.flatnonzero(zone_new & ~zone_old)
+    removed = np.flatnonzero(zone_old & ~zone_new)
 
-        dist_mat = network['dist_mat'][z][:, z]
-        locations = network['locations'][z]
+    # Small zones and larger changes are recomputed
+    if len(added) + len(removed) > 2 or np.count_nonzero(zone_old) <= 3 or np.count_nonzero(zone_new) <= 3:
+        return None
 
-        if len(locations) > 3:
+    i1, i2 = edges
 
-            delaunay = compute_delaunay(locations)
-            mst = minimum_spanning_tree(delaunay.multiply(dist_mat))
-            distances = mst.tocsr()[mst.nonzero()]
+    # On a precomputed graph, only a tree within the graph can be updated (not the fallback on all distances)
+    if graph is not None and not np.all(np.asarray(graph[i1, i2])):
+        return None
+
+    distances = get_distances(network)
 
-        elif len(locations) == 3:
-            distances = n_smallest_distances(dist_mat, n=2, return_idx=False)
+    # Other metrics (e.g. geodesic distances) are restricted to the Delaunay triangulation of the new zone
+    if graph is None and not (distances.metric_name == 'euclidean_distances'
+                              and np.array_equal(distances.points, network['locations'])):
+        return None
 
-        elif len(locations) == 2:
-            distances = n_smallest_distances(dist_mat, n=1, return_idx=False)
+    sites = np.flatnonzero(zone_old)
+    for v in added:
+        # The new tree only contains edges of the old tree or edges of the new site
+        if graph is None:
+            neighbours = np.arange(len(sites))
         else:
-            raise ValueError("Too few locations to compute distance.")
+            neighbours = np.flatnonzero(np.isin(sites, graph.indices[graph.indptr[v]:graph.indptr[v + 1]]))
+            if len(neighbours) == 0:
+                return None
+
+        n = len(sites)
+        rows = np.append(np.searchsorted(sites, i1), np.full(len(neighbours), n))
+        cols = np.append(np.searchsorted(sites, i2), neighbours)
+        edge_distances = np.append(distances.pairs(i1, i2), distances.pairs(v, sites[neighbours]))
+        mst = minimum_spanning_tree(csr_matrix((edge_distances, (rows, cols)), shape=(n + 1, n + 1)))
+
+        sites_v = np.append(sites, v)
+        r, c = mst.nonzero()
+        i1, i2 = sites_v[r], sites_v[c]
+        sites = np.sort(sites_v)
+
+    for v in removed:
+        is_edge_of_v = (i1 == v) | (i2 == v)
+        if np.count_nonzero(is_edge_of_v) != 1:
+            return None
+        i1, i2 = i1[~is_edge_of_v], i2[~is_edge_of_v]
+
+    return i1, i2
+
+
+def compute_geo_prior_of_zone(zone: np.array, geo_prior_meta: dict, network: dict, zone_cache=None, previous=None):
+    """
+    This function computes the geo-prior of each edge in the minimum spanning tree of a single zone. Zones
+    which were evaluated before are looked up in the cache.
+    Args:
+        zone (np.array): boolean array representing the zone
+            shape: (n_sites)
+        geo_prior_meta (dict): Meta-information about the prior (type 'gaussian' or 'cost_based').
+        network (dict): network containing the graph, location,...
+        zone_cache (ZoneCache): cache for the geo-prior of whole zones (None: no caching)
+        previous (tuple): a zone evaluated before and the edges of its minimum spanning tree
+            (the tree is updated instead of recomputed, if possible)
+
+    Returns:
+        (tuple, np.array): the edges of the minimum spanning tree and the log geo-prior of each edge
+    """
+    cached = None
+    if zone_cache is not None:
+        key = zone_cache.key('geo', zone)
+        cached = zone_cache.get(key)
+
+    if cached is not None:
+        return cached[:2], cached[2]
+
+    # Update the minimum spanning tree of the zone (or recompute it)
+    edges = None
+    if previous is not None:
+        edges = update_mst_edges(previous[1], previous[0], zone, network, graph=geo_prior_meta.get('graph'))
+    if edges is None:
+        edges = compute_mst_edges(zone, network, graph=geo_prior_meta.get('graph'))
+
+    if geo_prior_meta['type'] == 'gaussian':
+        log_prior = geo_prior_gaussian_edges(edges, network, geo_prior_meta['gaussian'])
+    else:
+        log_prior = geo_prior_distance_edges(edges, network, geo_prior_meta['scale'])
+
+    if zone_cache is not None:
+        zone_cache.put(key, (edges[0], edges[1], log_prior))
+
+    return edges, log_prior
 
-        log_prior = stats.expon.logpdf(distances, loc=0, scale=scale)
 
-    return np.mean(log_prior)
+def geo_prior_gaussian_edges(edges: tuple, network: dict, cov: np.array):
+    """
+    This function computes the two-dimensional Gaussian geo-prior for the edges of a zone
+    Args:
+        edges (tuple): the two sites connected by each edge
+        network (dict): network containing the graph, location,...
+        cov (np.array): Covariance matrix of the multivariate gaussian (estimated from the data)
+
+    Returns:
+        np.array: the log geo-prior of each edge
+    """
+    i1, i2 = edges
+    diffs = network['locations'][i1] - network['locations'][i2]
+    return np.atleast_1d(stats.multivariate_normal.logpdf(diffs, mean=[0, 0], cov=cov))
+
+
+def geo_prior_distance_edges(edges: tuple, network: dict, scale: float):
+    """
+    This function computes the cost-based geo-prior for the edges of a zone
+    Args:
+        edges (tuple): the two sites connected by each edge
+        network (dict): network containing the graph, location,...
+        scale (float): The scale (estimated from the data)
+
+    Returns:
+        np.array: the log geo-prior of each edge
+    """
+    distances = get_distances(network).pairs(*edges)
+    return stats.expon.logpdf(distances, loc=0, scale=scale)
 
 
 def prior_p_global_dirichlet(p_global, dirichlet, categories, outdated_features, cached_prior=None):
@@ -788,7 +1223,8 @@ def prior_p_global_dirichlet(p_global, dirichlet, categories, outdated_features,
         p_global (np.array): p_global from the sample
         dirichlet (list): list of dirichlet distributions
         categories (list): list of available categories per feature
-        outdated_features (IndexSet): The features which changed and need to be updated.
+        outdated_features (np.array): Boolean mask of the features which changed and need to be updated.
+            shape: (n_features)
     Kwargs:
         cached_prior (list):
 
@@ -797,10 +1233,11 @@ def prior_p_global_dirichlet(p_global, dirichlet, categories, outdated_features,
     """
     _, n_feat, n_cat = p_global.shape
 
-    if outdated_features.all:
+    if cached_prior is None:
         outdated_features = range(n_feat)
         log_prior = np.zeros(n_feat)
     else:
+        outdated_features = np.flatnonzero(outdated_features)
         log_prior = cached_prior
 
     for f in outdated_features:
@@ -820,8 +1257,11 @@ def prior_p_families_dirichlet(p_families, dirichlet, categories, outdated_indic
         p_families(np.array): p_families from the sample
         dirichlet(list): list of dirichlet distributions
         categories(list): list of available categories per feature
-        outdated_indices (IndexSet): The features which need to be updated in each family.
-        outdated_distributions (IndexSet): The features where the dirichlet distributions changed.
+        outdated_indices (np.array): Boolean mask of the features which need to be updated in each family.
+            shape: (n_families, n_features)
+        outdated_distributions (np.array): Boolean mask of the features where the dirichlet distributions
+            changed.
+            shape: (n_features)
     Kwargs:
         cached_prior (list):
         broadcast (bool):
@@ -832,17 +1272,13 @@ def prior_p_families_dirichlet(p_families, dirichlet, categories, outdated_indic
     """
     n_fam, n_feat, n_cat = p_families.shape
     if cached_prior is None:
-        assert outdated_indices.all
         log_prior = np.zeros((n_fam, n_feat))
-    else:
-        log_prior = cached_prior
-
-    if outdated_indices.all or outdated_distributions.all:
         outdated_indices = itertools.product(range(n_fam), range(n_feat))
     else:
-        if outdated_distributions:
-            outdated_distributions_expanded = {(fam, feat) for feat in outdated_distributions for fam in range(n_fam)}
-            outdated_indices = set.union(outdated_indices, outdated_distributions_expanded)
+        log_prior = cached_prior
+        # A changed distribution affects the feature in all families
+        outdated = outdated_indices | outdated_distributions[np.newaxis, :]
+        outdated_indices = zip(*np.nonzero(outdated))
 
     for fam, feat in outdated_indices:
 
@@ -15,8 +15,8 @@ import seaborn as sns
 import math
 
 
-from sbayes.preprocessing import compute_network, read_sites
-from sbayes.util import parse_area_columns, read_features_from_csv
+from sbayes.preprocessing import compute_network, read_features_and_network, read_sites
+from sbayes.util import parse_area_columns
 from sbayes.postprocessing import compute_dic
 
 
@@ -55,7 +55,7 @@ class Plot:
         self.site_names = None
         self.network = None
         self.locations = None
-        self.dist_mat = None
+        self.distances = None
         self.families = None
         self.family_names = None
 
@@ -138,11 +138,11 @@ class Plot:
         print('Reading input data...')
         if self.is_simulation:
             self.sites, self.site_names, _ = read_sites(self.path_data)
+            self.network = compute_network(self.sites)
         else:
-            self.sites, self.site_names, _, _, _, _, self.families, self.family_names, _ = \
-                read_features_from_csv(self.path_data, self.path_feature_states)
-        self.network = compute_network(self.sites)
-        self.locations, self.dist_mat = self.network['locations'], self.network['dist_mat']
+            features, self.network = read_features_and_network(self.path_data, self.path_feature_states)
+            self.sites, self.site_names, _, _, _, _, self.families, self.family_names, _ = features
+        self.locations, self.distances = self.network['locations'], self.network['distances']
 
     # Read areas
     # Read the data from the files:
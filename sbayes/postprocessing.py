@@ -3,6 +3,7 @@ import numpy as np
 import math
 from scipy.special import logsumexp
 from sbayes.sampling.zone_sampling import ZoneMCMCGenerative, Sample
+from sbayes.util import best_area_permutation
 
 
 def compute_dic(lh, burn_in):
@@ -221,17 +222,8 @@ def match_areas(samples):
     perm = list(permutations(range(n_areas)))
     matching_list = []
     for s in area_samples:
-
-        def clustering_agreement(p):
-
-            """In how many sites does the permutation 'p'
-            match the previous sample?
-            """
-
-            return np.sum(s_sum * s[:, p])
-
-        best_match = max(perm, key=clustering_agreement)
-        matching_list.append(list(best_match))
+        best_match = best_area_permutation(s_sum, s, perm)
+        matching_list.append(best_match)
         s_sum += s[:, best_match]
 
     # Reorder chains according to matching
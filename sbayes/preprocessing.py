@@ -9,17 +9,31 @@ except ImportError:
     from typing_extensions import Literal
 
 import csv
+import json
+import logging
+import os
+import warnings
+from pathlib import Path
 
 import numpy as np
 import pandas as pd
 from cartopy import crs as ccrs, geodesic
 import pyproj
+from scipy.sparse import csr_matrix
 
 from sbayes.model import normalize_weights
-from sbayes.util import (compute_delaunay, read_feature_occurrence_from_csv, read_features_from_csv)
+from sbayes.util import (DistanceProvider, compute_delaunay, content_hash, file_hash, range_like,
+                         read_feature_occurrence_from_csv, read_features_from_csv)
 
 EPS = np.finfo(float).eps
 
+# Version of the format of the data cache (a new version invalidates all cached data sets)
+DATA_CACHE_VERSION = 2
+
+# The WGS84 ellipsoid: semi-major axis (in meters) and flattening
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+
 
 def read_sites(file, retrieve_family=False, retrieve_subset=False):
     """ This function reads the simulated sites from a csv, with the following columns:
@@ -100,6 +114,104 @@ def read_sites(file, retrieve_family=False, retrieve_subset=False):
     log = str(len(name)) + " locations read from " + str(file)
     return sites, site_names, log
 
+
+def geodesic_distances(a, b, max_iter=100, tol=1e-12):
+    """Compute the geodesic distances (in meters) between pairs of points on the WGS84 ellipsoid.
+    All pairs are solved at once with the inverse formula of Vincenty (1975), which agrees with the
+    geodesics of cartopy (Karney 2013) to well below a millimeter. The few pairs for which the
+    iteration does not converge (nearly antipodal points) are passed to cartopy.
+
+    Args:
+        a (np.array): The longitude and latitude of the first point of each pair.
+            shape: (n_pairs, 2)
+        b (np.array): The longitude and latitude of the second point of each pair.
+            shape: (n_pairs, 2)
+        max_iter (int): The maximum number of iterations.
+        tol (float): The tolerance (in radians) for the convergence of the iteration.
+
+    Returns:
+        np.array: The distance between the points of each pair.
+            shape: (n_pairs)
+    """
+    a = np.radians(np.asarray(a, dtype=float))
+    b = np.radians(np.asarray(b, dtype=float))
+    semi_minor = WGS84_A * (1 - WGS84_F)
+
+    # Latitudes on the auxiliary sphere and difference in longitude
+    u1 = np.arctan((1 - WGS84_F) * np.tan(a[:, 1]))
+    u2 = np.arctan((1 - WGS84_F) * np.tan(b[:, 1]))
+    sin_u1, cos_u1 = np.sin(u1), np.cos(u1)
+    sin_u2, cos_u2 = np.sin(u2), np.cos(u2)
+    lon_diff = b[:, 0] - a[:, 0]
+
+    distances = np.zeros(len(lon_diff))
+
+    # Iterate the longitude on the auxiliary sphere. Pairs are dropped from the (compacted) working
+    # arrays as soon as they converged, their distance is computed right away.
+    active = np.arange(len(lon_diff))
+    lam = lon_diff.copy()
+    for _ in range(max_iter):
+        sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+
+        sin_sigma = np.hypot(cos_u2 * sin_lam, cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam)
+        cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+        sigma = np.arctan2(sin_sigma, cos_sigma)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            # Coincident points (sin_sigma = 0) and equatorial lines (cos2_alpha = 0) are special cases
+            sin_alpha = np.where(sin_sigma == 0, 0., cos_u1 * cos_u2 * sin_lam / sin_sigma)
+            cos2_alpha = 1 - sin_alpha ** 2
+            cos_2sigma_m = np.where(cos2_alpha == 0, 0., cos_sigma - 2 * sin_u1 * sin_u2 / cos2_alpha)
+        c = WGS84_F / 16 * cos2_alpha * (4 + WGS84_F * (4 - 3 * cos2_alpha))
+        lam_new = lon_diff + (1 - c) * WGS84_F * sin_alpha * (
+            sigma + c * sin_sigma * (cos_2sigma_m + c * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)))
+
+        converged = np.abs(lam_new - lam) <= tol
+        lam = lam_new
+        if not np.any(converged):
+            continue
+
+        u_sq = cos2_alpha[converged] * (WGS84_A ** 2 - semi_minor ** 2) / semi_minor ** 2
+        big_a = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+        big_b = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+        sin_s, cos_s, cos_2s_m = sin_sigma[converged], cos_sigma[converged], cos_2sigma_m[converged]
+        delta_sigma = big_b * sin_s * (cos_2s_m + big_b / 4 * (
+            cos_s * (-1 + 2 * cos_2s_m ** 2) - big_b / 6 * cos_2s_m * (-3 + 4 * sin_s ** 2) * (-3 + 4 * cos_2s_m ** 2)))
+        distances[active[converged]] = semi_minor * big_a * (sigma[converged] - delta_sigma)
+
+        remaining = ~converged
+        active, lam, lon_diff = active[remaining], lam[remaining], lon_diff[remaining]
+        sin_u1, cos_u1, sin_u2, cos_u2 = sin_u1[remaining], cos_u1[remaining], sin_u2[remaining], cos_u2[remaining]
+        if len(active) == 0:
+            break
+
+    # Nearly antipodal points
+    if len(active) > 0:
+        distances[active] = np.asarray(geodesic.Geodesic().inverse(np.degrees(a[active]),
+                                                                   np.degrees(b[active])))[:, 0]
+    return distances
+
+
+def distance_provider(locations, crs=None):
+    """Create the provider of the distances between a set of locations (see util.DistanceProvider).
+
+    Args:
+        locations (np.array): the locations of the sites
+            shape: (n_sites, 2)
+        crs (pyproj.CRS): the coordinate reference system of the locations (None: euclidean distances)
+    Returns:
+        DistanceProvider: the distances
+    """
+    if crs is None:
+        return DistanceProvider(locations)
+
+    transformer = pyproj.transformer.Transformer.from_crs(
+        crs_from=crs, crs_to=pyproj.crs.CRS("epsg:4326"), always_xy=True)
+    w_locations = np.vstack(
+        transformer.transform(locations[:, 0], locations[:, 1])
+    ).T
+    return DistanceProvider(w_locations, metric=geodesic_distances)
+
+
 class compute_network:
     def __init__(
             self,
@@ -146,18 +258,8 @@ class compute_network:
         # Adjacency Matrix
         adj_mat = delaunay.tocsr()
 
-        if crs is None:
-            loc = np.asarray(sites['locations'])
-            diff = loc[:, None] - loc
-            dist_mat = np.linalg.norm(diff, axis=-1)
-        else:
-            transformer = pyproj.transformer.Transformer.from_crs(
-                crs_from=crs, crs_to=pyproj.crs.CRS("epsg:4326"))
-            w_locations = np.vstack(
-                transformer.transform(locations[:, 0], locations[:, 1])
-            ).T
-            geod = geodesic.Geodesic()
-            dist_mat = np.hstack([geod.inverse(location, w_locations)[:, :2] for location in w_locations])
+        # Distances (computed on demand)
+        distances = distance_provider(locations, crs=crs)
 
         self.vertices = vertices
         self.edges = edges
@@ -165,9 +267,51 @@ class compute_network:
         self.adj_mat = adj_mat
         self.n = len(vertices)
         self.m = edges.shape[0]
-        self.dist_mat = dist_mat
+        self.distances = distances
+
+    @property
+    def dist_mat(self):
+        """The dense matrix of all distances (prefer the on-demand distances of `self.distances`). The matrix
+        needs n_sites x n_sites floats: it is computed on first use and kept in `self.distances`."""
+        if self.distances.dist_mat is None:
+            warnings.warn(f"Computing the dense distance matrix of {self.n} sites "
+                          f"({self.n ** 2 * 8 / 2 ** 20:.0f} MB). Use network['distances'] to compute distances "
+                          f"on demand.")
+            self.distances.dist_mat = self.distances.dense()
+        return self.distances.dist_mat
+
+    @dist_mat.setter
+    def dist_mat(self, dist_mat):
+        self.distances = DistanceProvider.from_matrix(dist_mat)
+
+    @classmethod
+    def from_arrays(cls, vertices, edges, locations, names, adj_mat, crs=None):
+        """Create a network from its precomputed parts (e.g. loaded from the data cache), without
+        triangulating the sites or computing the distances again.
 
-    def __getitem__(self, key: Literal['vertices', 'edges', 'locations', 'names', 'adj_mat', 'n', 'm', 'dist_mat']):
+        Args:
+            vertices (list): the ids of the sites
+            edges (np.array): the edges of the delaunay triangulation
+            locations (np.array): the locations of the sites
+            names (list): the names of the sites
+            adj_mat (csr_matrix): the adjacency matrix of the network
+            crs (pyproj.CRS): the coordinate reference system of the locations (None: euclidean distances)
+        Returns:
+            compute_network: the network
+        """
+        network = cls.__new__(cls)
+        network.vertices = vertices
+        network.edges = edges
+        network.locations = locations
+        network.names = names
+        network.adj_mat = adj_mat
+        network.n = len(vertices)
+        network.m = edges.shape[0]
+        network.distances = distance_provider(locations, crs=crs)
+        return network
+
+    def __getitem__(self, key: Literal['vertices', 'edges', 'locations', 'names', 'adj_mat', 'n', 'm', 'dist_mat',
+                                       'distances']):
         if key == "vertices":
             return self.vertices
         elif key == "edges":
@@ -184,10 +328,13 @@ class compute_network:
             return self.m
         elif key == "dist_mat":
             return self.dist_mat
+        elif key == "distances":
+            return self.distances
         else:
             raise AttributeError(f"Network object has no attribute {key}")
 
-    def __setitem__(self, key: Literal['vertices', 'edges', 'locations', 'names', 'adj_mat', 'n', 'm', 'dist_mat'], value):
+    def __setitem__(self, key: Literal['vertices', 'edges', 'locations', 'names', 'adj_mat', 'n', 'm', 'dist_mat',
+                                       'distances'], value):
         if key == "vertices":
             self.vertices = value
         elif key == "edges":
@@ -204,11 +351,121 @@ class compute_network:
             self.m = value
         elif key == "dist_mat":
             self.dist_mat = value
+        elif key == "distances":
+            self.distances = value
         else:
             raise AttributeError(f"Network object has no attribute {key}")
 
 
 
+def read_features_and_network(file, feature_states_file, crs=None, cache=True, logger=None):
+    """Read the features from a csv file (see read_features_from_csv) and compute the network of the
+    sites (see compute_network). The results are cached in a directory '.sbayes_cache' next to the
+    features file, addressed by the hash of both input files and the CRS, such that later runs load
+    them from the cache instead of parsing, encoding and triangulating again.
+
+    Args:
+        file (str): file location of the csv file
+        feature_states_file (str): file location of the csv file with the applicable states per feature
+        crs (pyproj.CRS): the coordinate reference system of the locations (None: euclidean distances)
+        cache (bool): load the data from the cache (and add it to the cache, if it is not there yet)?
+        logger (logging.Logger): the logger reporting a failed cache write (default: the module logger)
+    Returns:
+        (tuple, compute_network): the output of read_features_from_csv and the network
+    """
+    if not cache:
+        features = read_features_from_csv(file=file, feature_states_file=feature_states_file)
+        return features, compute_network(features[0], crs=crs)
+
+    key = content_hash(DATA_CACHE_VERSION, file_hash(file), file_hash(feature_states_file),
+                       None if crs is None else crs.to_wkt())
+    cache_path = Path(file).parent / '.sbayes_cache' / ('data_' + key[:32] + '.npz')
+
+    if cache_path.exists():
+        return load_data_cache(cache_path, crs=crs)
+
+    features = read_features_from_csv(file=file, feature_states_file=feature_states_file)
+    network = compute_network(features[0], crs=crs)
+    try:
+        cache_path.parent.mkdir(exist_ok=True)
+        write_data_cache(cache_path, features, network)
+    except OSError as e:
+        if logger is None:
+            logger = logging.getLogger(__name__)
+        logger.warning('Data could not be cached in %s: %s', cache_path, e)
+
+    return features, network
+
+
+def write_data_cache(path, features, network):
+    """Write the features and the network of the sites to an (uncompressed) npz file. The file is
+    replaced atomically, so that readers never see a partially written cache. The distances are not
+    cached, they are computed on demand from the locations.
+
+    Args:
+        path (Path): the cache file
+        features (tuple): the output of read_features_from_csv
+        network (compute_network): the network of the sites
+    """
+    (sites, site_names, features, feature_names, state_names, applicable_states,
+     families, family_names, log) = features
+
+    meta = {'site_ids': list(site_names['external']),
+            'site_names': list(sites['names']),
+            'feature_names': list(feature_names['external']),
+            'state_names': state_names['external'],
+            'family_names': family_names['external'],
+            'log': log}
+    adj_mat = network.adj_mat.tocsr()
+
+    tmp_path = str(path) + '.tmp'
+    with open(tmp_path, 'wb') as cache_file:
+        np.savez(cache_file, meta=np.array(json.dumps(meta)),
+                 locations=sites['locations'], features=features, applicable_states=applicable_states,
+                 families=families, edges=network.edges, adj_data=adj_mat.data, adj_indices=adj_mat.indices,
+                 adj_indptr=adj_mat.indptr, adj_shape=np.array(adj_mat.shape))
+    os.replace(tmp_path, path)
+
+
+def load_data_cache(path, crs=None):
+    """Load the features and the network of the sites from the cache (see write_data_cache).
+
+    Args:
+        path (Path): the cache file
+        crs (pyproj.CRS): the coordinate reference system of the locations (None: euclidean distances)
+    Returns:
+        (tuple, compute_network): the output of read_features_from_csv and the network
+    """
+    with np.load(path) as cached:
+        meta = json.loads(str(cached['meta']))
+        locations = cached['locations']
+        n_sites = locations.shape[0]
+
+        sites = {'locations': locations,
+                 'id': list(range(n_sites)),
+                 'cz': None,
+                 'names': pd.Series(meta['site_names'], name='name')}
+        site_names = {'external': pd.Series(meta['site_ids'], name='id'),
+                      'internal': list(range(n_sites))}
+        feature_names = {'external': np.array(meta['feature_names'], dtype=object),
+                         'internal': list(range(len(meta['feature_names'])))}
+        state_names = {'external': meta['state_names'],
+                       'internal': [range_like(s) for s in meta['state_names']]}
+        family_names = {'external': meta['family_names'],
+                        'internal': list(range(len(meta['family_names'])))}
+        log = meta['log'] + f" (loaded from the cache {path})"
+
+        features = (sites, site_names, cached['features'], feature_names, state_names,
+                    cached['applicable_states'], cached['families'], family_names, log)
+
+        adj_mat = csr_matrix((cached['adj_data'], cached['adj_indices'], cached['adj_indptr']),
+                             shape=tuple(cached['adj_shape']))
+        network = compute_network.from_arrays(vertices=sites['id'], edges=cached['edges'], locations=locations,
+                                              names=sites['names'], adj_mat=adj_mat, crs=crs)
+
+    return features, network
+
+
 def subset_features(features, subset):
     """This function returns the subset of a feature array
         Args:
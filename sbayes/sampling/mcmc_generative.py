@@ -4,11 +4,20 @@ from __future__ import absolute_import, division, print_function, \
     unicode_literals
 import math as _math
 import abc as _abc
+import multiprocessing as _multiprocessing
+import os as _os
+import pickle as _pickle
 import random as _random
 import time as _time
 import numpy as _np
 
 from collections import defaultdict
+from copy import copy as _copy
+
+
+class LogProbability(float):
+    """A transition probability on the log-scale. Operators can return q and q_back as LogProbability
+    when the probabilities themselves would under- or overflow."""
 
 
 class MCMCGenerative(metaclass=_abc.ABCMeta):
@@ -23,13 +32,27 @@ class MCMCGenerative(metaclass=_abc.ABCMeta):
 
     IS_WARMUP = False
 
+    # Minimum distance between neighbouring temperatures of an adapted ladder
+    MIN_TEMPERATURE_SPACING = 1e-3
+
     def __init__(self, operators, inheritance, families, prior, n_zones, n_chains,
-                 mc3=False, swap_period=None, chain_swaps=None, show_screen_log=False, **kwargs):
+                 mc3=False, swap_period=None, chain_swaps=None, max_temperature=1., adapt_temperatures=False,
+                 target_swap_rate=0.234, n_workers=1, vectorize_chains=False, checkpoint_path=None,
+                 checkpoint_every=0, show_screen_log=False, **kwargs):
 
         # Sampling attributes
         self.n_chains = n_chains
         self.chain_idx = list(range(self.n_chains))
 
+        # All chains take a step of the same operator together and are evaluated at once (see step_chains)
+        self.vectorize_chains = vectorize_chains
+
+        # The chain for which a step is proposed (for operators which evaluate the tempered posterior)
+        self.proposing_chain = 0
+
+        # Number of worker processes the chains are distributed to (1: all chains run in this process)
+        self.n_workers = min(n_workers, n_chains)
+
         # Number of zones
         self.n_zones = n_zones
 
@@ -55,6 +78,13 @@ class MCMCGenerative(metaclass=_abc.ABCMeta):
         self.swap_period = swap_period
         self.chain_swaps = chain_swaps
 
+        # Temperature ladder: the i-th chain in chain_idx runs at temperatures[i] (the first chain is cold)
+        self.temperatures = _np.geomspace(1., max_temperature, self.n_chains)
+        self.adapt_temperatures = adapt_temperatures
+        self.target_swap_rate = target_swap_rate
+        self.chain_temperature = _np.ones(self.n_chains)
+        self.update_chain_temperature()
+
         # Initialize statistics
         self.statistics = {'sample_id': [],
                            'sample_likelihood': [],
@@ -70,9 +100,17 @@ class MCMCGenerative(metaclass=_abc.ABCMeta):
                            'n_swaps': 0,
                            'accepted_swaps': 0,
                            'swap_ratio': [],
+                           'temperatures': [],
                            'accept_operator': defaultdict(int),
                            'reject_operator': defaultdict(int)}
 
+        # Writer for the logged samples (None: logged samples are collected in self.statistics)
+        self.sample_writer = None
+
+        # The state of the run is saved to checkpoint_path every checkpoint_every steps (0: never)
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_every = checkpoint_every
+
         # State attributes
         self._ll = _np.full(self.n_chains, -_np.inf)
         self._prior = _np.full(self.n_chains, -_np.inf)
@@ -103,6 +141,18 @@ class MCMCGenerative(metaclass=_abc.ABCMeta):
         """
         pass
 
+    def likelihood_chains(self, samples, chains):
+        """Compute the (log) likelihood of the samples of several chains. Sub-classes can override this
+        to evaluate all chains at once.
+
+        Args:
+            samples (list): The current sample of each chain.
+            chains (list): The chains.
+        Returns:
+            list: (log)likelihood of each sample
+        """
+        return [self.likelihood(x, c) for x, c in zip(samples, chains)]
+
     @_abc.abstractmethod
     def generate_initial_sample(self):
         """Generate an initial sample from which the run should be started.
@@ -122,7 +172,7 @@ class MCMCGenerative(metaclass=_abc.ABCMeta):
             list, list: the operators (callable), their weights (float)
         """
 
-    def generate_samples(self, n_steps, n_samples, warm_up=False, warm_up_steps=None):
+    def generate_samples(self, n_steps, n_samples, warm_up=False, warm_up_steps=None, checkpoint=None):
         """Run the MCMC sampling procedure for the Generative model with Metropolis Hastings rejection
         step and options for multiple chains. Samples are returned, statistics saved in self.statistics.
 
@@ -131,20 +181,39 @@ class MCMCGenerative(metaclass=_abc.ABCMeta):
             n_samples (int): The number of samples
             warm_up (bool): Warm-up run or real sampling?
             warm_up_steps (int): Number of warm-up steps
+            checkpoint (dict): A checkpoint of an interrupted run (see save_checkpoint), which is continued
+                with the same results as the uninterrupted run (None: start a new run)
         Returns:
             list: The generated samples.
         """
 
-        # Generate samples using MCMC with several chains
-        sample = [None] * self.n_chains
+        # Warm-up with the chains distributed to several processes
+        if warm_up and self.n_workers > 1:
+            print("Tuning parameters in warm-up (%i processes)..." % self.n_workers)
+            return self.warm_up_parallel(warm_up_steps)
+
+        # Continue the sampling from a checkpoint (the chains of parallel runs are restored in the workers)
+        if checkpoint is not None and self.n_workers > 1:
+            print("Sampling from posterior in %i processes..." % self.n_workers)
+            self.generate_samples_parallel(n_steps, n_samples, checkpoint=checkpoint)
+            return
+
+        if checkpoint is not None:
+            sample = self.restore_checkpoint(checkpoint)
+            i_start = checkpoint['i_step']
 
-        # Generate initial samples
-        for c in self.chain_idx:
+        else:
+            # Generate samples using MCMC with several chains
+            sample = [None] * self.n_chains
+            i_start = 0
+
+            # Generate initial samples
+            for c in self.chain_idx:
 
-            sample[c] = self.generate_initial_sample()
-            # Compute the (log)-likelihood and the prior for each sample
-            self._ll[c] = self.likelihood(sample[c], c)
-            self._prior[c] = self.prior(sample[c], c)
+                sample[c] = self.generate_initial_sample()
+                # Compute the (log)-likelihood and the prior for each sample
+                self._ll[c] = self.likelihood(sample[c], c)
+                self._prior[c] = self.prior(sample[c], c)
 
         # # Probability of operators is different if there are zero zones
         # if self.n_zones == 0:
@@ -164,8 +233,7 @@ class MCMCGenerative(metaclass=_abc.ABCMeta):
                 warmup_progress = (i_warmup / warm_up_steps) * 100
                 if warmup_progress % 10 == 0:
                     print("warm-up", int(warmup_progress), "%")
-                for c in self.chain_idx:
-                    sample[c] = self.step(sample[c], c)
+                self.step_all(sample, self.chain_idx)
 
             # For the last sample find the best chain (highest posterior)
             posterior_samples = [self._ll[c] + self._prior[c] for c in self.chain_idx]
@@ -175,16 +243,24 @@ class MCMCGenerative(metaclass=_abc.ABCMeta):
             # Return the best sample
             return sample[best_chain]
 
+        # Function is called to sample from posterior, with the chains distributed to several processes
+        elif self.n_workers > 1:
+            print("Sampling from posterior in %i processes..." % self.n_workers)
+            self.generate_samples_parallel(n_steps, n_samples)
+
         # Function is called to sample from posterior
         else:
             print("Sampling from posterior...")
             steps_per_sample = int(_np.ceil(n_steps / n_samples))
             t_start = _time.time()
 
-            for i_step in range(n_steps):
+            if checkpoint is not None:
+                _random.setstate(checkpoint['random_state'])
+                _np.random.set_state(checkpoint['np_random_state'])
+
+            for i_step in range(i_start, n_steps):
                 # Generate samples for each chain
-                for c in self.chain_idx:
-                    sample[c] = self.step(sample[c], c)
+                self.step_all(sample, self.chain_idx)
 
                 # Log samples at fixed intervals
                 if i_step % steps_per_sample == 0:
@@ -196,50 +272,276 @@ class MCMCGenerative(metaclass=_abc.ABCMeta):
                 # For mc3: Exchange chains at fixed intervals
                 if self.mc3:
                     if (i_step+1) % self.swap_period == 0:
-                        self.swap_chains(sample)
+                        self.swap_chains()
 
                 # Print work status and likelihood at fixed intervals
                 if (i_step+1) % 1000 == 0:
-                    self.print_screen_log(i_step+1, sample)
+                    self.print_screen_log(i_step+1)
 
                 # Log the last sample of the first chain
                 if i_step % (n_steps-1) == 0 and i_step != 0:
                     self.log_last_sample(sample[self.chain_idx[0]])
 
+                # Save the state of the run at fixed intervals
+                if self.checkpoint_every and (i_step+1) % self.checkpoint_every == 0 and i_step+1 < n_steps:
+                    self.save_checkpoint(i_step+1, sample)
+
             t_end = _time.time()
             self.statistics['sampling_time'] = t_end - t_start
             self.statistics['time_per_sample'] = (t_end - t_start) / n_samples
-            self.statistics['acceptance_ratio'] = (self.statistics['accepted_steps'] / n_steps)
-            if self.statistics['n_swaps'] > 0:
-                self.statistics['swap_ratio'] = (self.statistics['accepted_swaps'] / self.statistics['n_swaps'])
+            self.log_run_statistics(n_steps)
+
+    def generate_samples_parallel(self, n_steps, n_samples, checkpoint=None):
+        """Sample from the posterior with the chains distributed to a pool of worker processes. The workers
+        run their chains independently up to the next step at which a sample is logged, chains are swapped,
+        the screen log is printed or a checkpoint is saved. Only the likelihood and prior of each chain (and
+        the logged sample) are sent back to this process. Samples and statistics are saved in self.statistics.
+
+        Args:
+            n_steps (int): The number of steps the sampler takes (without burn-in steps)
+            n_samples (int): The number of samples
+            checkpoint (dict): A checkpoint of an interrupted run (None: start a new run)
+        """
+        steps_per_sample = int(_np.ceil(n_steps / n_samples))
+        t_start = _time.time()
+
+        def next_step_at(i_step, period, offset=0):
+            """The first step from i_step on, for which (step + offset) is a multiple of period."""
+            return i_step + (-(i_step + offset) % period)
+
+        pool = ChainPool(self, self.n_workers)
+        try:
+            if checkpoint is not None:
+                samples = self.restore_checkpoint(checkpoint, evaluate=False)
+                pool.restore(samples, self._ll, self._prior, checkpoint['worker_states'])
+                i_step = checkpoint['i_step']
+
+                # The random state is restored after the workers were seeded
+                _random.setstate(checkpoint['random_state'])
+                _np.random.set_state(checkpoint['np_random_state'])
+
             else:
-                self.statistics['swap_ratio'] = 0
+                self._ll, self._prior = pool.initialize(self._ll, self._prior)
+                i_step = 0
+
+            while i_step < n_steps:
+                # Run all chains up to the next step at which something happens
+                i_event = min(next_step_at(i_step, steps_per_sample),
+                              next_step_at(i_step, 1000, offset=1),
+                              n_steps - 1)
+                if self.mc3:
+                    i_event = min(i_event, next_step_at(i_step, self.swap_period, offset=1))
+                if self.checkpoint_every:
+                    i_event = min(i_event, next_step_at(i_step, self.checkpoint_every, offset=1))
+
+                is_logged = (i_event % steps_per_sample == 0)
+                is_last = (i_event == n_steps - 1)
+                logged_chain = self.chain_idx[0] if (is_logged or is_last) else None
+
+                self._ll, self._prior, logged_sample = pool.run(n_steps=i_event - i_step + 1,
+                                                                chain_temperature=self.chain_temperature,
+                                                                logged_chain=logged_chain)
+
+                # Log samples, but only from the first chain
+                if is_logged:
+                    self.log_sample_statistics(logged_sample, c=self.chain_idx[0],
+                                               sample_id=int(i_event/steps_per_sample))
+
+                # For mc3: Exchange chains at fixed intervals
+                if self.mc3:
+                    if (i_event+1) % self.swap_period == 0:
+                        self.swap_chains()
+
+                # Print work status and likelihood at fixed intervals
+                if (i_event+1) % 1000 == 0:
+                    self.print_screen_log(i_event+1)
+
+                # Log the last sample of the first chain
+                if is_last and i_event != 0:
+                    self.log_last_sample(logged_sample)
+
+                # Save the state of the run at fixed intervals
+                if self.checkpoint_every and (i_event+1) % self.checkpoint_every == 0 and not is_last:
+                    samples, worker_states = pool.get_state()
+                    self.save_checkpoint(i_event+1, samples, worker_states)
+
+                i_step = i_event + 1
+
+        finally:
+            worker_statistics = pool.close()
+
+        # Collect the statistics of all workers (counts are summed)
+        for statistics in worker_statistics:
+            for key, value in statistics.items():
+                if isinstance(value, dict):
+                    for op_name, count in value.items():
+                        self.statistics[key][op_name] += count
+                else:
+                    self.statistics[key] += value
+
+        t_end = _time.time()
+        self.statistics['sampling_time'] = t_end - t_start
+        self.statistics['time_per_sample'] = (t_end - t_start) / n_samples
+        self.log_run_statistics(n_steps)
+
+    def warm_up_parallel(self, warm_up_steps):
+        """Run the independent warm-up chains in a pool of worker processes and return the best sample.
+        Apart from the likelihood and prior of each chain, only the best sample is sent back from the workers.
+
+        Args:
+            warm_up_steps (int): Number of warm-up steps
+        Returns:
+            Sample: The last sample of the chain with the highest posterior.
+        """
+        steps_per_block = int(_np.ceil(warm_up_steps / 10))
+
+        pool = ChainPool(self, self.n_workers)
+        try:
+            self._ll, self._prior = pool.initialize(self._ll, self._prior)
+
+            for i_warmup in range(0, warm_up_steps, steps_per_block):
+                print("warm-up", int((i_warmup / warm_up_steps) * 100), "%")
+                self._ll, self._prior, _ = pool.run(n_steps=min(steps_per_block, warm_up_steps - i_warmup),
+                                                    chain_temperature=self.chain_temperature)
+
+            # For the last sample find the best chain (highest posterior)
+            posterior_samples = [self._ll[c] + self._prior[c] for c in self.chain_idx]
+            best_chain = self.chain_idx[posterior_samples.index(max(posterior_samples))]
+
+            # Return the best sample
+            _, _, best_sample = pool.run(n_steps=0, chain_temperature=self.chain_temperature,
+                                         logged_chain=best_chain)
+        finally:
+            pool.close()
+
+        return best_sample
+
+    def save_checkpoint(self, i_step, samples, worker_states=None):
+        """Save the state of the sampling run to self.checkpoint_path: the current sample, likelihood and
+        prior of each chain, the order and temperatures of the chains, the statistics, the state of the
+        random number generators and of the sample writer. The file is replaced atomically, so that an
+        interrupted write leaves the previous checkpoint intact.
+
+        Args:
+            i_step (int): The next step of the run.
+            samples (list or dict): The current sample of each chain.
+            worker_states (list): The random state and statistics of each worker process (parallel runs).
+        """
+        checkpoint = {'i_step': i_step,
+                      'samples': [samples[c].copy() for c in range(self.n_chains)],
+                      'll': self._ll.copy(),
+                      'prior': self._prior.copy(),
+                      'chain_idx': list(self.chain_idx),
+                      'temperatures': self.temperatures.copy(),
+                      'statistics': self.statistics,
+                      'random_state': _random.getstate(),
+                      'np_random_state': _np.random.get_state(),
+                      'counters': self.get_counters(),
+                      'worker_states': worker_states,
+                      'sample_writer': None if self.sample_writer is None else self.sample_writer.get_state()}
+
+        tmp_path = str(self.checkpoint_path) + '.tmp'
+        with open(tmp_path, 'wb') as checkpoint_file:
+            _pickle.dump(checkpoint, checkpoint_file, protocol=_pickle.HIGHEST_PROTOCOL)
+        _os.replace(tmp_path, self.checkpoint_path)
+
+    def restore_checkpoint(self, checkpoint, evaluate=True):
+        """Restore the state of the chains from a checkpoint (the random state is restored separately,
+        right before the sampling continues).
+
+        Args:
+            checkpoint (dict): The checkpoint (see save_checkpoint).
+            evaluate (bool): Evaluate the samples once, to fill the caches of the likelihood and prior
+                (parallel runs evaluate the samples in the workers).
+        Returns:
+            list: The current sample of each chain.
+        """
+        samples = checkpoint['samples']
+        self.chain_idx = list(checkpoint['chain_idx'])
+        self.temperatures = checkpoint['temperatures'].copy()
+        self.update_chain_temperature()
+        self.statistics = checkpoint['statistics']
+
+        for c, sample in enumerate(samples):
+            sample.everything_changed()
+            if evaluate:
+                self.likelihood(sample, c)
+                self.prior(sample, c)
+
+        # The counters are restored after the evaluation, which is not part of the run
+        self.set_counters(checkpoint['counters'])
+
+        self._ll = checkpoint['ll'].copy()
+        self._prior = checkpoint['prior'].copy()
+        return samples
+
+    def worker_statistics(self):
+        """The statistics a worker process reports back to the main process (counts, which are summed
+        over all workers).
+
+        Returns:
+            dict: The statistics of the worker.
+        """
+        statistics = {key: self.statistics[key] for key in ['accepted_steps', 'accept_operator', 'reject_operator']}
+        statistics.update(self.get_counters())
+        return statistics
+
+    def get_counters(self):
+        """Counters which are kept outside of self.statistics while sampling (e.g. by caches). They are
+        saved in checkpoints and added to the statistics at the end of the run.
+
+        Returns:
+            dict: The counters (keys as in self.statistics).
+        """
+        return {}
+
+    def set_counters(self, counters):
+        """Restore the counters (see get_counters), e.g. from a checkpoint.
+
+        Args:
+            counters (dict): The counters.
+        """
+
+    def log_run_statistics(self, n_steps):
+        """Compute the acceptance ratio and the swap ratio at the end of a sampling run.
 
-    def swap_chains(self, sample):
+        Args:
+            n_steps (int): The number of steps the sampler took.
+        """
+        self.statistics['acceptance_ratio'] = (self.statistics['accepted_steps'] / n_steps)
+        if self.statistics['n_swaps'] > 0:
+            self.statistics['swap_ratio'] = (self.statistics['accepted_swaps'] / self.statistics['n_swaps'])
+        else:
+            self.statistics['swap_ratio'] = 0
+        self.statistics['temperatures'] = list(self.temperatures)
+
+    def update_chain_temperature(self):
+        """Assign the temperatures of the ladder to the chains, according to their order in chain_idx."""
+        self.chain_temperature[self.chain_idx] = self.temperatures
+
+    def swap_chains(self):
+        """Propose to swap the states of chains at neighbouring temperatures. Swaps are accepted with the
+        tempered Metropolis-Hastings ratio, computed from the cached likelihood of the chains (the prior
+        is not tempered and cancels out)."""
 
         for _ in range(self.chain_swaps):
 
             self.statistics['n_swaps'] += 1
 
-            # Chose random chains and try to swap with first chain
-            swap_from_idx = 0
+            # Chose a random chain and try to swap with the chain at the next higher temperature
+            swap_from_idx = _np.random.randint(self.n_chains - 1)
             swap_from = self.chain_idx[swap_from_idx]
 
-            swap_to_idx, = _np.random.choice(range(1, self.n_chains), 1)
+            swap_to_idx = swap_from_idx + 1
             swap_to = self.chain_idx[swap_to_idx]
 
-            # Compute lh and prior ratio for both chains
-            ll_from = self.likelihood(sample[swap_from], swap_from)
-            prior_from = self.prior(sample[swap_from], swap_from)
-
-            ll_to = self.likelihood(sample[swap_to], swap_to)
-            prior_to = self.prior(sample[swap_to], swap_to)
-            q_to = q_from = 1.
+            # Use the cached lh of both chains (the chains may run in other processes)
+            ll_from = self._ll[swap_from]
+            ll_to = self._ll[swap_to]
 
-            # Evaluate the metropolis-hastings ratio
-            mh_ratio = self.metropolis_hastings_ratio(ll_new=ll_to, ll_prev=ll_from,
-                                                      prior_new=prior_to, prior_prev=prior_from,
-                                                      q=q_to, q_back=q_from)
+            # Evaluate the tempered metropolis-hastings ratio
+            mh_ratio = ((1. / self.temperatures[swap_from_idx] - 1. / self.temperatures[swap_to_idx])
+                        * (ll_to - ll_from))
 
             # Swap chains according to MH-ratio and update
             if _math.log(_random.random()) < mh_ratio:
@@ -247,13 +549,68 @@ class MCMCGenerative(metaclass=_abc.ABCMeta):
                 self.chain_idx[swap_to_idx] = swap_from
                 self.statistics['accepted_swaps'] += 1
 
-            #     print("swapped")
-            # else:
-            #     print("not swapped")
+            if self.adapt_temperatures:
+                self.adapt_temperature_spacing(swap_from_idx, p_swap=_math.exp(min(mh_ratio, 0.)))
+
+        self.update_chain_temperature()
+
+    def adapt_temperature_spacing(self, i, p_swap):
+        """Adapt the temperature ladder towards the target swap rate, using the swap probability between
+        the i-th and the (i+1)-th temperature. The spacing is widened, if swaps are more likely than the
+        target rate, and narrowed otherwise. The adaptation decreases over time.
+
+        Args:
+            i (int): Position of the lower temperature in the ladder.
+            p_swap (float): The acceptance probability of the swap.
+        """
+        gain = (1 + self.statistics['n_swaps']) ** -0.6
+
+        # The spacing is floored, so that neighbouring temperatures never coincide (log(0) = -inf)
+        log_spacing = _np.log(_np.maximum(_np.diff(self.temperatures), self.MIN_TEMPERATURE_SPACING))
+        log_spacing[i] += gain * (p_swap - self.target_swap_rate)
+        self.temperatures[1:] = 1. + _np.cumsum(_np.exp(log_spacing))
+
+    def step_all(self, samples, chains):
+        """Perform one MH step in each of the given chains, either one chain after the other or all
+        chains together (if vectorize_chains is set).
+
+        Args:
+            samples (list or dict): The current sample of each chain (updated in place).
+            chains (list): The chains which take a step.
+        """
+        if self.vectorize_chains:
+            self.step_chains(samples, chains)
+        else:
+            for c in chains:
+                samples[c] = self.step(samples[c], c)
+
+    def step_chains(self, samples, chains):
+        """Perform one MH step in each of the given chains at once: all chains take a step of the same
+        (randomly chosen) operator, the likelihood of all candidates is evaluated together and the
+        candidates are accepted/rejected with the metropolis hastings acceptance probability.
 
-        # Set all 'what_changed' flags to true (to avoid caching errors)
-        for s in sample:
-            s.everything_changed()
+        Args:
+            samples (list or dict): The current sample of each chain (updated in place).
+            chains (list): The chains which take a step.
+        """
+
+        # Randomly choose one operator to propose new samples in all chains
+        propose_step = _np.random.choice(self.fn_operators, 1, p=self.p_operators)[0]
+        proposals = []
+        for c in chains:
+            self.proposing_chain = c
+            if self.IS_WARMUP:
+                proposals.append(propose_step(samples[c], c))
+            else:
+                proposals.append(propose_step(samples[c]))
+
+        # Compute the log-likelihood of all candidates at once
+        ll_candidates = self.likelihood_chains([candidate for candidate, _, _ in proposals], chains)
+
+        for c, (candidate, q, q_back), ll_candidate in zip(chains, proposals, ll_candidates):
+            prior_candidate = self.prior(candidate, c)
+            samples[c] = self.accept_or_reject(samples[c], candidate, c, ll_candidate, prior_candidate,
+                                               q, q_back, propose_step.__name__)
 
     def step(self, sample, c):
         """This function performs a full MH step: first, a new candidate sample is proposed
@@ -268,6 +625,7 @@ class MCMCGenerative(metaclass=_abc.ABCMeta):
 
         # Randomly choose one operator to propose new sample (grow/shrink/swap zones, alter weights/p_zones/p_families)
         propose_step = _np.random.choice(self.fn_operators, 1, p=self.p_operators)[0]
+        self.proposing_chain = c
         if self.IS_WARMUP:
             candidate, q, q_back = propose_step(sample, c)
         else:
@@ -279,21 +637,43 @@ class MCMCGenerative(metaclass=_abc.ABCMeta):
         # Compute the prior of the candidate
         prior_candidate = self.prior(candidate, c)
 
+        return self.accept_or_reject(sample, candidate, c, ll_candidate, prior_candidate, q, q_back,
+                                     propose_step.__name__)
+
+    def accept_or_reject(self, sample, candidate, c, ll_candidate, prior_candidate, q, q_back, operator_name):
+        """Accept or reject a candidate according to the metropolis hastings ratio and update the
+        likelihood, prior and statistics of the chain.
+
+        Args:
+            sample (Sample): The current sample.
+            candidate (Sample): The candidate (proposed in place of the current sample).
+            c (int): The current chain.
+            ll_candidate (float): The (log)likelihood of the candidate.
+            prior_candidate (float): The (log)prior of the candidate.
+            q (float): The transition probability.
+            q_back (float): The back-probability.
+            operator_name (str): The name of the operator which proposed the candidate.
+        Returns:
+            Sample: The sample after the step.
+        """
         # Evaluate the metropolis-hastings ratio
         mh_ratio = self.metropolis_hastings_ratio(ll_new=ll_candidate, ll_prev=self._ll[c],
                                                   prior_new=prior_candidate, prior_prev=self._prior[c],
-                                                  q=q, q_back=q_back)
+                                                  q=q, q_back=q_back, temperature=self.chain_temperature[c])
 
         # Accept/reject according to MH-ratio and update
         accept = _math.log(_random.random()) < mh_ratio
         if accept:
+            candidate.accept_proposal()
             sample = candidate
             self._ll[c] = ll_candidate
             self._prior[c] = prior_candidate
             self.statistics['accepted_steps'] += 1
-            self.statistics['accept_operator'][propose_step.__name__] += 1
+            self.statistics['accept_operator'][operator_name] += 1
         else:
-            self.statistics['reject_operator'][propose_step.__name__] += 1
+            # The candidate was proposed in place: restore the current sample
+            candidate.reject_proposal()
+            self.statistics['reject_operator'][operator_name] += 1
 
         return sample
 
@@ -305,22 +685,26 @@ class MCMCGenerative(metaclass=_abc.ABCMeta):
             ll_prev(float): the likelihood of the current sample
             prior_new(float): the prior of the candidate
             prior_prev(float): the prior of the current sample
-            q (float): the transition probability
-            q_back (float): the back-probability
-            temperature(float): the temperature of the MCMC
+            q (float): the transition probability (or its log as LogProbability)
+            q_back (float): the back-probability (or its log as LogProbability)
+            temperature(float): the temperature of the chain (the likelihood ratio is flattened for
+                temperatures > 1)
         Returns:
             (float): the metropolis-hastings ratio
         """
         ll_ratio = ll_new - ll_prev
-        try:
-            with _np.errstate(divide='ignore'):
-                log_q_ratio = _math.log(q / q_back)
+        if isinstance(q, LogProbability):
+            log_q_ratio = q - q_back
+        else:
+            try:
+                with _np.errstate(divide='ignore'):
+                    log_q_ratio = _math.log(q / q_back)
 
-        except ZeroDivisionError:
-            log_q_ratio = _math.inf
+            except ZeroDivisionError:
+                log_q_ratio = _math.inf
 
         prior_ratio = prior_new - prior_prev
-        mh_ratio = (ll_ratio * temperature) - log_q_ratio + prior_ratio
+        mh_ratio = (ll_ratio / temperature) - log_q_ratio + prior_ratio
 
         return mh_ratio
 
@@ -331,12 +715,22 @@ class MCMCGenerative(metaclass=_abc.ABCMeta):
             c (int): The current chain
             sample_id (int): Index of the logged sample.
         """
+        if self.sample_writer is not None:
+            # Write the sample to file right away (nothing is kept in memory)
+            self.sample_writer.write(sample, likelihood=self._ll[c], prior=self._prior[c])
+
+            if self.show_screen_log:
+                print('Log-likelihood: %.2f' % self._ll[c])
+                print('Accepted steps: %i' % self.statistics['accepted_steps'])
+            return
+
         self.statistics['sample_id'].append(sample_id)
-        self.statistics['sample_zones'].append(sample.zones)
-        self.statistics['sample_weights'].append(sample.weights)
-        self.statistics['sample_p_global'].append(sample.p_global)
-        self.statistics['sample_p_zones'].append(sample.p_zones)
-        self.statistics['sample_p_families'].append(sample.p_families)
+        # Samples are changed in place in later steps, hence the logged parameters are copied
+        self.statistics['sample_zones'].append(_copy(sample.zones))
+        self.statistics['sample_weights'].append(_copy(sample.weights))
+        self.statistics['sample_p_global'].append(_copy(sample.p_global))
+        self.statistics['sample_p_zones'].append(_copy(sample.p_zones))
+        self.statistics['sample_p_families'].append(_copy(sample.p_families))
         self.statistics['sample_likelihood'].append(self._ll[c])
         self.statistics['sample_prior'].append(self._prior[c])
 
@@ -349,12 +743,12 @@ class MCMCGenerative(metaclass=_abc.ABCMeta):
         Args:
             last_sample (Sample): A Sample object consisting of zones and weights
         """
-        self.statistics['last_sample'] = last_sample
+        self.statistics['last_sample'] = last_sample.copy()
 
-    def print_screen_log(self, i_step, sample):
+    def print_screen_log(self, i_step):
         i_step_str = str.ljust(str(i_step), 12)
 
-        likelihood = self.likelihood(sample[self.chain_idx[0]], self.chain_idx[0])
+        likelihood = self._ll[self.chain_idx[0]]
         likelihood_str = str.ljust('log-likelihood:  %.2f' % likelihood, 36)
 
         time_per_million = (_time.time() - self.t_start) / (i_step + 1) * 1000000
@@ -362,3 +756,212 @@ class MCMCGenerative(metaclass=_abc.ABCMeta):
 
         print(i_step_str + likelihood_str + time_str)
         # print('size0 =', 'sum(sample[self.chain_idx[0]].zones[0]))
+
+
+class ChainPool(object):
+
+    """A pool of worker processes, each running a fixed group of chains of one sampler. The chains stay
+    in their worker for the whole run, so that the cached likelihood and prior of each chain remain valid.
+    Every worker gets its own random number stream.
+
+    The workers get a copy of the sampler without its sample writer: the open result files stay with
+    this process. The pool works with all start methods of multiprocessing ('fork', 'spawn', 'forkserver').
+
+    Attributes:
+        chains_per_worker (list): The chains run by each worker.
+        connections (list): Pipes to the workers.
+        workers (list): The worker processes.
+    """
+
+    def __init__(self, sampler, n_workers, start_method=None):
+        """
+        Args:
+            sampler (MCMCGenerative): The sampler whose chains are run by the workers.
+            n_workers (int): The number of worker processes.
+            start_method (str): The start method of the workers (None: the default of the platform).
+        """
+        self.chains_per_worker = [list(range(w, sampler.n_chains, n_workers)) for w in range(n_workers)]
+        context = _multiprocessing.get_context(start_method)
+
+        # Seeds for the random number streams of the workers
+        seeds = _np.random.randint(2**31, size=n_workers)
+
+        # Detach the sample writer while the workers start: forked workers would share its file objects,
+        # spawned workers could not pickle them
+        sample_writer = sampler.sample_writer
+        sampler.sample_writer = None
+
+        self.connections = []
+        self.workers = []
+        try:
+            for chains, seed in zip(self.chains_per_worker, seeds):
+                connection, worker_connection = context.Pipe()
+                worker = context.Process(target=run_chains,
+                                         args=(sampler, chains, int(seed), worker_connection),
+                                         daemon=True)
+                worker.start()
+                worker_connection.close()
+
+                self.connections.append(connection)
+                self.workers.append(worker)
+        finally:
+            sampler.sample_writer = sample_writer
+
+    def send_all(self, command, args=None):
+        """Send a command to all workers and wait for all replies."""
+        for connection in self.connections:
+            connection.send((command, args))
+        return self.receive_all()
+
+    def receive_all(self):
+        """Wait for the replies of all workers."""
+        replies = []
+        for connection in self.connections:
+            reply = connection.recv()
+            if isinstance(reply, Exception):
+                raise reply
+            replies.append(reply)
+        return replies
+
+    def initialize(self, ll, prior):
+        """Generate the initial samples of all chains.
+
+        Args:
+            ll (np.array): The (log)-likelihood per chain (updated in place).
+            prior (np.array): The (log)-prior per chain (updated in place).
+        Returns:
+            np.array, np.array: The (log)-likelihood and prior of the initial samples.
+        """
+        for chains, (ll_worker, prior_worker, _) in zip(self.chains_per_worker, self.send_all('initialize')):
+            ll[chains] = ll_worker
+            prior[chains] = prior_worker
+        return ll, prior
+
+    def run(self, n_steps, chain_temperature, logged_chain=None):
+        """Advance all chains by n_steps MCMC steps.
+
+        Args:
+            n_steps (int): The number of steps.
+            chain_temperature (np.array): The current temperature of each chain (changed by swaps).
+            logged_chain (int): The chain whose current sample is returned (None: no sample is returned).
+        Returns:
+            np.array, np.array, Sample: The (log)-likelihood and prior per chain and the logged sample.
+        """
+        ll = _np.empty(sum(len(chains) for chains in self.chains_per_worker))
+        prior = _np.empty_like(ll)
+        logged_sample = None
+
+        replies = self.send_all('run', (n_steps, chain_temperature, logged_chain))
+        for chains, (ll_worker, prior_worker, sample) in zip(self.chains_per_worker, replies):
+            ll[chains] = ll_worker
+            prior[chains] = prior_worker
+            if sample is not None:
+                logged_sample = sample
+
+        return ll, prior, logged_sample
+
+    def get_state(self):
+        """Get the state of all chains and workers (for a checkpoint).
+
+        Returns:
+            dict, list: The current sample of each chain, the random state and statistics of each worker.
+        """
+        samples = {}
+        worker_states = []
+        for chain_samples, worker_state in self.send_all('get_state'):
+            samples.update(chain_samples)
+            worker_states.append(worker_state)
+        return samples, worker_states
+
+    def restore(self, samples, ll, prior, worker_states):
+        """Restore the state of all chains and workers from a checkpoint.
+
+        Args:
+            samples (list): The current sample of each chain.
+            ll (np.array): The (log)-likelihood per chain.
+            prior (np.array): The (log)-prior per chain.
+            worker_states (list): The random state and statistics of each worker.
+        """
+        for connection, chains, worker_state in zip(self.connections, self.chains_per_worker, worker_states):
+            connection.send(('restore', ({c: samples[c] for c in chains}, ll, prior, worker_state)))
+        self.receive_all()
+
+    def close(self):
+        """Stop the workers.
+
+        Returns:
+            list: The statistics of each worker.
+        """
+        try:
+            statistics = self.send_all('stop')
+        finally:
+            for worker in self.workers:
+                worker.join()
+        return statistics
+
+
+def run_chains(sampler, chains, seed, connection):
+    """Run a group of chains of a sampler in a worker process. The worker is controlled by commands
+    (´initialize´, ´run´, ´get_state´, ´restore´, ´stop´) received from ´connection´ and replies with the
+    likelihood and prior of its chains.
+
+    Args:
+        sampler (MCMCGenerative): The sampler.
+        chains (list): The chains run by this worker.
+        seed (int): The seed of the random number stream of this worker.
+        connection (multiprocessing.connection.Connection): The pipe to the main process.
+    """
+    _random.seed(seed)
+    _np.random.seed(seed)
+
+    sample = {}
+    while True:
+        command, args = connection.recv()
+        try:
+            if command == 'initialize':
+                for c in chains:
+                    sample[c] = sampler.generate_initial_sample()
+                    sampler._ll[c] = sampler.likelihood(sample[c], c)
+                    sampler._prior[c] = sampler.prior(sample[c], c)
+                reply = (sampler._ll[chains], sampler._prior[chains], None)
+
+            elif command == 'run':
+                n_steps, sampler.chain_temperature, logged_chain = args
+                for _ in range(n_steps):
+                    sampler.step_all(sample, chains)
+
+                if logged_chain in sample:
+                    logged_sample = sample[logged_chain]
+                else:
+                    logged_sample = None
+                reply = (sampler._ll[chains], sampler._prior[chains], logged_sample)
+
+            elif command == 'get_state':
+                reply = ({c: sample[c].copy() for c in chains},
+                         (_random.getstate(), _np.random.get_state(), sampler.worker_statistics()))
+
+            elif command == 'restore':
+                chain_samples, ll, prior, (random_state, np_random_state, statistics) = args
+                for c, chain_sample in chain_samples.items():
+                    sample[c] = chain_sample
+                    sampler.likelihood(chain_sample, c)
+                    sampler.prior(chain_sample, c)
+                    sampler._ll[c] = ll[c]
+                    sampler._prior[c] = prior[c]
+                sampler.statistics.update(statistics)
+                sampler.set_counters(statistics)
+                _random.setstate(random_state)
+                _np.random.set_state(np_random_state)
+                reply = (sampler._ll[chains], sampler._prior[chains], None)
+
+            elif command == 'stop':
+                connection.send(sampler.worker_statistics())
+                break
+
+            else:
+                raise ValueError('Unknown command: %s' % command)
+
+        except Exception as e:
+            reply = e
+
+        connection.send(reply)
@@ -5,45 +5,188 @@ import random as _random
 from copy import deepcopy
 
 import numpy as np
+from scipy.special import gammaln, logsumexp
 
-from sbayes.sampling.mcmc_generative import MCMCGenerative
-from sbayes.model import GenerativeLikelihood, GenerativePrior
-from sbayes.util import get_neighbours, normalize, dirichlet_pdf
+from sbayes.sampling.mcmc_generative import LogProbability, MCMCGenerative
+from sbayes.model import (GenerativeLikelihood, GenerativePrior, ZoneCache, compute_geo_prior_of_zone,
+                          compute_likelihood_of_chains, evaluate_size_prior, normalize_weights,
+                          zone_likelihood_kernel)
+from sbayes.util import NA_STATE, encode_state_indices, get_neighbours, normalize, dirichlet_pdf
 
 
-class IndexSet(set):
+class ChangeMasks(object):
+    """Boolean masks marking the parts of each parameter of a sample that changed since the last
+    evaluation of the likelihood (or the prior), i.e. where cached values are outdated.
 
-    def __init__(self, all_i=True):
-        super().__init__()
-        self.all = all_i
+    Attributes:
+        zones (np.array): Changed zones.
+            shape: (n_zones)
+        weights (np.array): Features where the weights changed.
+            shape: (n_features)
+        p_global (np.array): Features where the global probabilities changed.
+            shape: (n_features)
+        p_zones (np.array): Changed (zone, feature) pairs.
+            shape: (n_zones, n_features)
+        p_families (np.array): Changed (family, feature) pairs.
+            shape: (n_families, n_features)
+    """
 
-    def add(self, element):
-        super(IndexSet, self).add(element)
+    PARAMETERS = ('zones', 'weights', 'p_global', 'p_zones', 'p_families')
 
-    def clear(self):
-        super(IndexSet, self).clear()
-        self.all = False
+    def __init__(self, n_zones, n_features, n_families):
+        self.zones = np.ones(n_zones, dtype=bool)
+        self.weights = np.ones(n_features, dtype=bool)
+        self.p_global = np.ones(n_features, dtype=bool)
+        self.p_zones = np.ones((n_zones, n_features), dtype=bool)
+        self.p_families = np.ones((n_families, n_features), dtype=bool)
 
-    def __bool__(self):
-        return self.all or (len(self) > 0)
+    def add(self, parameter, index):
+        """Mark the element at ´index´ of ´parameter´ as changed."""
+        getattr(self, parameter)[index] = True
 
-    def __copy__(self):
-        # other = deepcopy(super(IndexSet, self))
-        other = IndexSet(all_i=self.all)
-        for element in self:
-            other.add(element)
+    def set_all(self):
+        for parameter in self.PARAMETERS:
+            getattr(self, parameter).fill(True)
 
-        return other
+    def clear(self):
+        for parameter in self.PARAMETERS:
+            getattr(self, parameter).fill(False)
 
-    def __deepcopy__(self, memo):
-        # other = deepcopy(super(IndexSet, self))
-        other = IndexSet(all_i=self.all)
-        for element in self:
-            other.add(deepcopy(element))
+    def update(self, other):
+        """Mark everything that changed in ´other´ as changed (element-wise union)."""
+        for parameter in self.PARAMETERS:
+            np.logical_or(getattr(self, parameter), getattr(other, parameter), out=getattr(self, parameter))
 
+    def copy(self):
+        other = ChangeMasks.__new__(ChangeMasks)
+        for parameter in self.PARAMETERS:
+            setattr(other, parameter, getattr(self, parameter).copy())
         return other
 
 
+class ZoneMembership(object):
+    """Index-lists, packed bitsets and sizes of the zones of a sample and the mask of occupied sites.
+    They are updated incrementally when a site enters or leaves a zone (see Sample.propose), such that
+    area steps scale with the size of the zones rather than with the number of sites.
+
+    Attributes:
+        zones (np.array): The zones the membership is kept consistent with.
+            shape: (n_zones, n_sites)
+        sites (list): Sorted index-list of the sites in each zone.
+        bitsets (np.array): Packed membership of each zone (see np.packbits).
+            shape: (n_zones, ceil(n_sites / 8))
+        sizes (np.array): Number of sites in each zone.
+            shape: (n_zones)
+        occupied (np.array): Sites which are in any of the zones.
+            shape: (n_sites)
+        n_occupied (int): Number of occupied sites.
+        adj_mat (csr_matrix): The adjacency matrix the neighbourhoods are tracked on (None until the
+            neighbourhoods are first requested, see get_neighbours).
+        neighbour_counts (np.array): For each zone and site, the number of sites in the zone adjacent to
+            the site.
+            shape: (n_zones, n_sites)
+        frontiers (list): Sorted index-list of the free sites adjacent to each zone.
+    """
+
+    def __init__(self, zones):
+        self.zones = zones
+        self.sites = [np.flatnonzero(zone) for zone in zones]
+        self.bitsets = np.packbits(zones, axis=-1)
+        self.sizes = np.count_nonzero(zones, axis=-1)
+        self.occupied = np.any(zones, axis=0)
+        self.n_occupied = np.count_nonzero(self.occupied)
+
+        self.adj_mat = None
+        self.neighbour_counts = None
+        self.frontiers = None
+
+    def track_neighbours(self, adj_mat):
+        """Compute the neighbour counts and frontiers of all zones on the given network. From then on
+        they are updated in O(degree) whenever a site enters or leaves a zone.
+
+        Args:
+            adj_mat (csr_matrix): The (symmetric) adjacency matrix.
+        """
+        self.adj_mat = adj_mat
+        self.neighbour_counts = np.ascontiguousarray(adj_mat.dot(self.zones.T.astype(np.int32)).T)
+        self.frontiers = [np.flatnonzero((counts > 0) & ~self.occupied) for counts in self.neighbour_counts]
+
+    def get_neighbours(self, z, adj_mat):
+        """The neighbourhood of a zone, excluding sites which belong to this or any other zone.
+
+        Args:
+            z (int): The zone.
+            adj_mat (csr_matrix): The adjacency matrix.
+        Returns:
+            (np.array): Sorted index-list of the neighbours.
+        """
+        if self.adj_mat is not adj_mat:
+            self.track_neighbours(adj_mat)
+        return self.frontiers[z]
+
+    def is_neighbour(self, z, site):
+        """Check whether a free site is adjacent to zone z (requires tracked neighbourhoods)."""
+        return self.neighbour_counts[z, site] > 0 and not self.occupied[site]
+
+    def set_site(self, z, site, value):
+        """Update the membership after a site entered or left a zone (in ´zones´).
+
+        Args:
+            z (int): The changed zone.
+            site (int): The site which entered or left the zone.
+            value (bool): True if the site entered the zone, False if it left the zone.
+        """
+        i = np.searchsorted(self.sites[z], site)
+        is_member = i < len(self.sites[z]) and self.sites[z][i] == site
+        if bool(value) == is_member:
+            return
+
+        if value:
+            self.sites[z] = np.insert(self.sites[z], i, site)
+            self.bitsets[z, site >> 3] |= 128 >> (site & 7)
+            self.sizes[z] += 1
+        else:
+            self.sites[z] = np.delete(self.sites[z], i)
+            self.bitsets[z, site >> 3] &= 255 ^ (128 >> (site & 7))
+            self.sizes[z] -= 1
+
+        occupied = np.any(self.zones[:, site])
+        occupied_changed = occupied != self.occupied[site]
+        self.n_occupied += int(occupied) - int(self.occupied[site])
+        self.occupied[site] = occupied
+
+        if self.adj_mat is None:
+            return
+
+        # An occupied site leaves the frontiers of all adjacent zones, a freed site enters them
+        if occupied_changed:
+            for z_adjacent in np.flatnonzero(self.neighbour_counts[:, site]):
+                frontier = self.frontiers[z_adjacent]
+                j = np.searchsorted(frontier, site)
+                if occupied:
+                    self.frontiers[z_adjacent] = np.delete(frontier, j)
+                else:
+                    self.frontiers[z_adjacent] = np.insert(frontier, j, site)
+
+        # Update the neighbour counts of zone z: free sites whose count becomes positive enter
+        # the frontier of z, free sites whose count drops to zero leave it
+        row = self.adj_mat.indices[self.adj_mat.indptr[site]:self.adj_mat.indptr[site + 1]]
+        counts = self.neighbour_counts[z]
+        if value:
+            counts[row] += 1
+            entered = np.sort(row[(counts[row] == 1) & ~self.occupied[row]])
+            self.frontiers[z] = np.insert(self.frontiers[z], np.searchsorted(self.frontiers[z], entered),
+                                          entered)
+        else:
+            counts[row] -= 1
+            left = row[(counts[row] == 0) & ~self.occupied[row]]
+            self.frontiers[z] = np.delete(self.frontiers[z], np.searchsorted(self.frontiers[z], left))
+
+    def free_sites(self):
+        """Index-list of the sites which are not in any zone."""
+        return np.flatnonzero(~self.occupied)
+
+
 class Sample(object):
     """
     Attributes:
@@ -67,19 +210,85 @@ class Sample(object):
         self.p_families = p_families
 
         # The sample contains information about which of its parameters was changed in the last MCMC step
-        self.what_changed = {}
-        self.everything_changed()
+        n_zones, n_features, n_families = self.get_dimensions()
+        self.what_changed = {'lh': ChangeMasks(n_zones, n_features, n_families),
+                             'prior': ChangeMasks(n_zones, n_features, n_families)}
+
+        # Changes of the current proposal (parameter, index, previous value, changed element)
+        self.proposed_changes = []
+
+        # Incrementally updated index-lists, bitsets and sizes of the zones (created on first use)
+        self._membership = None
+
+    @property
+    def membership(self):
+        """ZoneMembership: Index-lists, bitsets and sizes of the zones. The zones must only be changed
+        via ´propose´, otherwise the membership becomes outdated."""
+        if self._membership is None or self._membership.zones is not self.zones:
+            self._membership = ZoneMembership(self.zones)
+        return self._membership
+
+    def propose(self, parameter, index, value, changed):
+        """Change a slice of one parameter in place and remember the previous value, such that the
+        change can be reverted if the proposal is rejected.
+
+        Args:
+            parameter (str): The name of the changed parameter ('zones', 'weights', 'p_global', 'p_zones'
+                or 'p_families').
+            index (tuple): The index of the changed slice in the parameter array.
+            value (np.array or scalar): The proposed value of the slice.
+            changed (int or tuple): The element marked as changed in ´what_changed´ (e.g. the zone,
+                the feature or the (zone, feature) pair).
+        """
+        array = getattr(self, parameter)
+        previous = np.copy(array[index])
+        array[index] = value
+        self.proposed_changes.append((parameter, index, previous, changed))
+
+        if parameter == 'zones' and self._membership is not None:
+            self._membership.set_site(*index, value)
+
+        # The step changed the parameter (which has an influence on how the lh and the prior look like)
+        self.what_changed['lh'].add(parameter, changed)
+        self.what_changed['prior'].add(parameter, changed)
+
+    def accept_proposal(self):
+        """Keep the changes of the current proposal."""
+        self.proposed_changes.clear()
+
+    def reject_proposal(self):
+        """Revert the changes of the current proposal. The changed elements stay marked in ´what_changed´,
+        since the likelihood and prior were cached for the rejected proposal."""
+        for parameter, index, previous, changed in reversed(self.proposed_changes):
+            getattr(self, parameter)[index] = previous
+            if parameter == 'zones' and self._membership is not None:
+                self._membership.set_site(*index, previous)
+            self.what_changed['lh'].add(parameter, changed)
+            self.what_changed['prior'].add(parameter, changed)
+        self.proposed_changes.clear()
+
+    def get_dimensions(self):
+        """Number of zones, features and families of the sample (0 for parameters which are not set)."""
+        n_zones = len(self.zones) if self.zones is not None else 0
+        n_families = len(self.p_families) if self.p_families is not None else 0
+
+        if self.weights is not None:
+            n_features = len(self.weights)
+        elif self.p_global is not None:
+            n_features = self.p_global.shape[1]
+        else:
+            n_features = 0
+
+        return n_zones, n_features, n_families
 
     def everything_changed(self):
-        self.what_changed = {'lh': {'zones': IndexSet(), 'weights': True,
-                                    'p_global': IndexSet(), 'p_zones': IndexSet(), 'p_families': IndexSet()},
-                             'prior': {'zones': IndexSet(), 'weights': True,
-                                       'p_global': IndexSet(), 'p_zones': IndexSet(), 'p_families': IndexSet()}}
+        self.what_changed['lh'].set_all()
+        self.what_changed['prior'].set_all()
 
     def copy(self):
         zone_copied = deepcopy(self.zones)
         weights_copied = deepcopy(self.weights)
-        what_changed_copied = deepcopy(self.what_changed)
+        what_changed_copied = {channel: changes.copy() for channel, changes in self.what_changed.items()}
 
         if self.p_global is not None:
             p_global_copied = self.p_global.copy()
@@ -109,7 +318,8 @@ class ZoneMCMCGenerative(MCMCGenerative):
     """float: Probability at which grow operator only considers neighbours to add to the zone."""
 
     def __init__(self, network, features, min_size, max_size, var_proposal,
-                 p_grow_connected, initial_sample, initial_size, sample_from_prior=False, **kwargs):
+                 p_grow_connected, initial_sample, initial_size, sample_from_prior=False,
+                 zone_cache_mb=64, multiple_tries=None, **kwargs):
 
         super(ZoneMCMCGenerative, self).__init__(**kwargs)
 
@@ -134,6 +344,9 @@ class ZoneMCMCGenerative(MCMCGenerative):
         self.n = self.adj_mat.shape[0]
         self.p_grow_connected = p_grow_connected
 
+        # Number of tries of the multiple-try area operators (e.g. {'swap_zone': 4})
+        self.multiple_tries = multiple_tries or {}
+
         # Zone size /initial sample
         self.min_size = min_size
         self.max_size = max_size
@@ -143,6 +356,8 @@ class ZoneMCMCGenerative(MCMCGenerative):
         # Families
         if self.inheritance:
             self.n_families = self.families.shape[0]
+            self.family_of_site = np.argmax(self.families, axis=0)
+            self.has_family = np.any(self.families, axis=0)
 
         # Variance of the proposal distribution
         self.var_proposal_weight = var_proposal['weights']
@@ -162,16 +377,34 @@ class ZoneMCMCGenerative(MCMCGenerative):
                               'q_back_shrink': []
                               }
 
+        # LRU cache for the evaluation of single zones (shared by all chains, None if disabled)
+        if zone_cache_mb > 0:
+            self.zone_cache = ZoneCache(max_bytes=int(zone_cache_mb * 2**20))
+        else:
+            self.zone_cache = None
+        self.statistics['zone_cache_hits'] = 0
+        self.statistics['zone_cache_misses'] = 0
+
+        # The likelihood works on the compact state indices of the features (shared by all chains)
+        self.states = states = encode_state_indices(features)
+
         self.compute_lh_per_chain = [
             # GenerativeLikelihood(features, self.inheritance, self.families) for _ in range(self.n_chains)
-            GenerativeLikelihood(data=features, families=self.families, inheritance=self.inheritance)
+            GenerativeLikelihood(data=states, families=self.families, inheritance=self.inheritance,
+                                 zone_cache=self.zone_cache)
             for _ in range(self.n_chains)
         ]
 
         self.compute_prior_per_chain = [
-            GenerativePrior() for _ in range(self.n_chains)
+            GenerativePrior(zone_cache=self.zone_cache) for _ in range(self.n_chains)
         ]
 
+        # Likelihood and prior of single zones (with caches separate from the chains)
+        self.compute_lh_single_zone = GenerativeLikelihood(data=states, families=self.families,
+                                                           inheritance=self.inheritance,
+                                                           zone_cache=self.zone_cache)
+        self.compute_prior_single_zone = GenerativePrior(zone_cache=self.zone_cache)
+
     def prior(self, sample, chain):
         """Compute the (log) prior of a sample.
         Args:
@@ -223,6 +456,18 @@ class ZoneMCMCGenerative(MCMCGenerative):
 
         return log_lh
 
+    def likelihood_chains(self, samples, chains):
+        """Compute the (log) likelihood of the samples of several chains at once.
+        Args:
+            samples (list): The current sample of each chain.
+            chains (list): The chains.
+        Returns:
+            list: The (log) likelihood of each sample"""
+        if self.sample_from_prior:
+            return [0.] * len(chains)
+
+        return compute_likelihood_of_chains([self.compute_lh_per_chain[c] for c in chains], samples)
+
     def alter_weights(self, sample):
         """This function modifies one weight of one feature in the current sample
 
@@ -231,8 +476,6 @@ class ZoneMCMCGenerative(MCMCGenerative):
         Returns:
             Sample: The modified sample
         """
-        sample_new = sample.copy()
-
         # Randomly choose one of the features
         f_id = np.random.choice(range(self.n_features))
 
@@ -253,21 +496,15 @@ class ZoneMCMCGenerative(MCMCGenerative):
             weights_new = weights_new_t * weights_current.sum()
 
             # Update
-            sample_new.weights[f_id, weights_to_alter] = weights_new
+            sample.propose('weights', (f_id, weights_to_alter), weights_new, changed=f_id)
 
         else:
             # if inheritance is not considered, there are only two weights.
             weights_current = sample.weights[f_id, :]
             weights_new, q, q_back = self.dirichlet_proposal(weights_current, self.var_proposal_weight)
-            sample_new.weights[f_id, :] = weights_new
-
-        # The step changed the weights (which has an influence on how the lh and the prior look like)
-        sample_new.what_changed['lh']['weights'] = True
-        sample_new.what_changed['prior']['weights'] = True
-        sample.what_changed['lh']['weights'] = True
-        sample.what_changed['prior']['weights'] = True
+            sample.propose('weights', (f_id, slice(None)), weights_new, changed=f_id)
 
-        return sample_new, q, q_back
+        return sample, q, q_back
 
     def alter_p_global(self, sample):
         """This function modifies one p_global of one category and one feature in the current sample
@@ -276,8 +513,6 @@ class ZoneMCMCGenerative(MCMCGenerative):
             Returns:
                  Sample: The modified sample
         """
-        sample_new = sample.copy()
-
         # Randomly choose one of the features
         f_id = np.random.choice(range(self.n_features))
 
@@ -300,15 +535,9 @@ class ZoneMCMCGenerative(MCMCGenerative):
         p_new = p_new_t * p_current.sum()
 
         # Update sample
-        sample_new.p_global[0, f_id, states_to_alter] = p_new
+        sample.propose('p_global', (0, f_id, states_to_alter), p_new, changed=f_id)
 
-        # The step changed p_global (which has an influence on how the lh and the prior look like)
-        sample_new.what_changed['lh']['p_global'].add(f_id)
-        sample_new.what_changed['prior']['p_global'].add(f_id)
-        sample.what_changed['lh']['p_global'].add(f_id)
-        sample.what_changed['prior']['p_global'].add(f_id)
-
-        return sample_new, q, q_back
+        return sample, q, q_back
 
     def alter_p_zones(self, sample):
         """This function modifies one p_zones of one category, one feature and in zone in the current sample
@@ -317,8 +546,6 @@ class ZoneMCMCGenerative(MCMCGenerative):
             Returns:
                 Sample: The modified sample
                 """
-        sample_new = sample.copy()
-
         # Randomly choose one of the zones, one of the features and one of the categories
         z_id = np.random.choice(range(self.n_zones))
         f_id = np.random.choice(range(self.n_features))
@@ -342,15 +569,9 @@ class ZoneMCMCGenerative(MCMCGenerative):
         p_new = p_new_t * p_current.sum()
 
         # Update sample
-        sample_new.p_zones[z_id, f_id, states_to_alter] = p_new
+        sample.propose('p_zones', (z_id, f_id, states_to_alter), p_new, changed=(z_id, f_id))
 
-        # The step changed p_zones (which has an influence on how the lh and the prior look like)
-        sample_new.what_changed['lh']['p_zones'].add((z_id, f_id))
-        sample_new.what_changed['prior']['p_zones'].add((z_id, f_id))
-        sample.what_changed['lh']['p_zones'].add((z_id, f_id))
-        sample.what_changed['prior']['p_zones'].add((z_id, f_id))
-
-        return sample_new, q, q_back
+        return sample, q, q_back
 
     @staticmethod
     def dirichlet_proposal(w, step_precision):
@@ -392,9 +613,6 @@ class ZoneMCMCGenerative(MCMCGenerative):
             Returns:
                  Sample: The modified sample
         """
-
-        sample_new = sample.copy()
-
         # Randomly choose one of the families and one of the features
         fam_id = np.random.choice(range(self.n_families))
         f_id = np.random.choice(range(self.n_features))
@@ -418,15 +636,196 @@ class ZoneMCMCGenerative(MCMCGenerative):
         p_new = p_new_t * p_current.sum()
 
         # Update sample
-        sample_new.p_families[fam_id, f_id, states_to_alter] = p_new
+        sample.propose('p_families', (fam_id, f_id, states_to_alter), p_new, changed=(fam_id, f_id))
 
-        # The step changed p_families (which has an influence on how the lh and the prior look like)
-        sample_new.what_changed['lh']['p_families'].add((fam_id, f_id))
-        sample_new.what_changed['prior']['p_families'].add((fam_id, f_id))
-        sample.what_changed['lh']['p_families'].add((fam_id, f_id))
-        sample.what_changed['prior']['p_families'].add((fam_id, f_id))
+        return sample, q, q_back
 
-        return sample_new, q, q_back
+    def gibbs_p_global(self, sample):
+        """Resample the global probabilities of all features given latent component assignments
+        (see gibbs_probabilities).
+            Args:
+                 sample(Sample): The current sample with zones and parameters.
+            Returns:
+                 Sample: The modified sample
+        """
+        return self.gibbs_probabilities(sample, 'p_global')
+
+    def gibbs_p_zones(self, sample):
+        """Resample the probabilities of all features in all zones given latent component assignments
+        (see gibbs_probabilities).
+            Args:
+                 sample(Sample): The current sample with zones and parameters.
+            Returns:
+                 Sample: The modified sample
+        """
+        return self.gibbs_probabilities(sample, 'p_zones')
+
+    def gibbs_p_families(self, sample):
+        """Resample the probabilities of all features in all families given latent component assignments
+        (see gibbs_probabilities).
+            Args:
+                 sample(Sample): The current sample with zones and parameters.
+            Returns:
+                 Sample: The modified sample
+        """
+        return self.gibbs_probabilities(sample, 'p_families')
+
+    def gibbs_probabilities(self, sample, parameter):
+        """Data-augmentation step for the probabilities of one component (global, zones or families).
+        Each site and feature is assigned to one of the mixture components (drawn from weights * lh),
+        then every probability vector of the component is drawn from the Dirichlet posterior given the
+        states of the sites assigned to it.
+
+        The step is a proposal on the space augmented by the assignments: the transition probabilities
+        include the probability of the assignments under the current and the proposed parameters. For
+        uniform and counts priors the proposal is the exact conditional posterior and is always accepted
+        by the cold chain (this includes the universal priors on p_families, given p_global). Otherwise
+        (e.g. p_global, when the prior of p_families depends on it) the proposal is corrected by the
+        metropolis-hastings ratio.
+
+        Args:
+            sample(Sample): The current sample with zones and parameters.
+            parameter (str): The probabilities to resample ('p_global', 'p_zones' or 'p_families').
+        Returns:
+            Sample: The modified sample
+            float: The transition probability q.
+            float: The back probability q_back
+        """
+        component = {'p_global': 0, 'p_zones': 1, 'p_families': 2}[parameter]
+        p_current = getattr(sample, parameter)
+        observed = (self.states != NA_STATE)
+
+        # Draw the latent component of each (observed) site and feature
+        weighted_lh = self.weighted_component_lh(sample)
+        cumulative_lh = np.cumsum(weighted_lh, axis=-1)
+        u = np.random.random(observed.shape) * cumulative_lh[..., -1]
+        latent = np.minimum(np.sum(u[..., np.newaxis] > cumulative_lh, axis=-1), weighted_lh.shape[-1] - 1)
+        log_p_latent = self.log_latent_probability(weighted_lh, latent, observed)
+
+        # Count the states of the sites assigned to the component (per zone or family)
+        sites, features = np.nonzero(observed & (latent == component))
+        if parameter == 'p_global':
+            group_of_site = np.zeros(self.n, dtype=int)
+        elif parameter == 'p_zones':
+            group_of_site = np.zeros(self.n, dtype=int)
+            for z, zone_sites in enumerate(sample.membership.sites):
+                group_of_site[zone_sites] = z
+        else:
+            group_of_site = np.argmax(self.families, axis=0)
+
+        counts = np.zeros(p_current.shape)
+        np.add.at(counts, (group_of_site[sites], features, self.states[sites, features]), 1)
+
+        # Draw all probability vectors from their Dirichlet posterior at once
+        applicable = np.broadcast_to(self.applicable_states, p_current.shape)
+        alpha = np.where(applicable, self.get_conjugate_prior(sample, parameter) + counts, 0.)
+        p_new = np.random.gamma(np.where(applicable, alpha, 1.))
+        p_new = np.where(applicable, p_new, 0.)
+        p_new /= np.sum(p_new, axis=-1, keepdims=True)
+
+        # Probability of the assignments given the proposed probabilities (for the back-step)
+        weighted_lh_new = self.weighted_component_lh(sample, **{parameter: p_new})
+        log_p_latent_new = self.log_latent_probability(weighted_lh_new, latent, observed)
+
+        # The transition probabilities easily under- or overflow: they are returned on the log-scale
+        q = LogProbability(self.dirichlet_logpdf_masked(p_new, alpha, applicable) + log_p_latent)
+        q_back = LogProbability(self.dirichlet_logpdf_masked(p_current, alpha, applicable) + log_p_latent_new)
+
+        sample.propose(parameter, slice(None), p_new, changed=slice(None))
+
+        return sample, q, q_back
+
+    def weighted_component_lh(self, sample, p_global=None, p_zones=None, p_families=None):
+        """The likelihood of the features under each mixture component (global, zone, family), multiplied
+        by the normalized weight of the component.
+
+        Args:
+            sample (Sample): The current sample with zones and parameters.
+            p_global, p_zones, p_families (np.array): Probabilities used instead of those of the sample.
+        Returns:
+            np.array: The weighted likelihood per site, feature and component (0 where a site is not
+                assigned to a component).
+                shape: (n_sites, n_features, 3) or (n_sites, n_features, 2) without inheritance
+        """
+        p_global = sample.p_global if p_global is None else p_global
+        p_zones = sample.p_zones if p_zones is None else p_zones
+        p_families = sample.p_families if p_families is None else p_families
+
+        n_components = 3 if self.inheritance else 2
+        all_lh = np.zeros(self.states.shape + (n_components,))
+        assignment = np.zeros((self.n, n_components), dtype=bool)
+
+        all_lh[:, :, 0] = zone_likelihood_kernel(self.states, p_global[0])
+        assignment[:, 0] = True
+
+        membership = sample.membership
+        for z, zone_sites in enumerate(membership.sites):
+            all_lh[zone_sites, :, 1] = zone_likelihood_kernel(self.states[zone_sites], p_zones[z])
+        assignment[:, 1] = membership.occupied
+
+        if self.inheritance:
+            for fam, family in enumerate(self.families):
+                all_lh[family, :, 2] = zone_likelihood_kernel(self.states[family], p_families[fam])
+            assignment[:, 2] = np.any(self.families, axis=0)
+
+        return normalize_weights(sample.weights[np.newaxis, :, :], assignment) * all_lh
+
+    @staticmethod
+    def log_latent_probability(weighted_lh, latent, observed):
+        """The log-probability of the latent component assignments of the observed sites and features."""
+        lh_latent = np.take_along_axis(weighted_lh, latent[..., np.newaxis], axis=-1)[..., 0]
+        return np.sum(np.log(lh_latent[observed] / np.sum(weighted_lh, axis=-1)[observed]))
+
+    def get_conjugate_prior(self, sample, parameter):
+        """The Dirichlet parameters of the prior of the given probabilities (uniform, counts or, for
+        p_families, universal given p_global). For other prior types the uniform prior is returned.
+
+        Args:
+            sample (Sample): The current sample.
+            parameter (str): 'p_global', 'p_zones' or 'p_families'.
+        Returns:
+            np.array: The Dirichlet parameters (1 for non-applicable states).
+                shape: (n_vectors, n_features, n_states)
+        """
+        alpha = np.ones(getattr(sample, parameter).shape)
+        if parameter == 'p_global' and self.prior_p_global['type'] == 'counts':
+            for f, dirichlet in enumerate(self.prior_p_global['dirichlet']):
+                alpha[0, f, self.applicable_states[f]] = dirichlet
+
+        elif parameter == 'p_families':
+            prior_type = self.prior_p_families['type']
+            if prior_type == 'counts':
+                for fam, family_dirichlet in enumerate(self.prior_p_families['dirichlet']):
+                    for f, dirichlet in enumerate(family_dirichlet):
+                        alpha[fam, f, self.applicable_states[f]] = dirichlet
+
+            elif prior_type in ['universal', 'counts_and_universal']:
+                # Pseudocounts derived from p_global (and the family counts), plus 1 as in counts_to_dirichlet
+                pseudocounts = self.prior_p_families['strength'] * sample.p_global
+                if prior_type == 'counts_and_universal':
+                    pseudocounts = pseudocounts + self.prior_p_families['counts']
+                alpha = np.where(self.applicable_states, pseudocounts + 1., 1.) * np.ones(alpha.shape)
+
+        return alpha
+
+    @staticmethod
+    def dirichlet_logpdf_masked(p, alpha, mask):
+        """The joint log-density of a set of Dirichlet distributions over the states in ´mask´.
+
+        Args:
+            p (np.array): The probability vectors.
+                shape: (n_vectors, n_features, n_states)
+            alpha (np.array): The Dirichlet parameters.
+                shape: (n_vectors, n_features, n_states)
+            mask (np.array): The applicable states.
+                shape: (n_vectors, n_features, n_states)
+        Returns:
+            float: The joint log-density.
+        """
+        alpha = np.where(mask, alpha, 0.)
+        log_p = np.log(np.where(mask, p, 1.))
+        return (np.sum(gammaln(np.sum(alpha, axis=-1))) - np.sum(gammaln(alpha[mask]))
+                + np.sum((alpha - 1.)[mask] * log_p[mask]))
 
     def swap_zone(self, sample):
         """ This functions swaps sites in one of the zones of the current sample
@@ -437,64 +836,58 @@ class ZoneMCMCGenerative(MCMCGenerative):
         Returns:
             Sample: The modified sample.
          """
-        sample_new = sample.copy()
-        zones_current = sample.zones
-        occupied = np.any(zones_current, axis=0)
+        membership = sample.membership
 
         # Randomly choose one of the zones to modify
-        z_id = np.random.choice(range(zones_current.shape[0]))
-        zone_current = zones_current[z_id, :]
+        z_id = np.random.choice(range(sample.zones.shape[0]))
 
-        neighbours = get_neighbours(zone_current, occupied, self.adj_mat)
+        neighbours = membership.get_neighbours(z_id, self.adj_mat)
         connected_step = (_random.random() < self.p_grow_connected)
         if connected_step:
             # All neighbors that are not yet occupied by other zones are candidates
             candidates = neighbours
         else:
             # All free sites are candidates
-            candidates = ~occupied
+            candidates = membership.free_sites()
 
         # When stuck (all neighbors occupied) return current sample and reject the step (q_back = 0)
-        if not np.any(candidates):
+        if len(candidates) == 0:
             q, q_back = 1., 0.
             return sample, q, q_back
 
-        # Add a site to the zone
-        site_new = _random.choice(candidates.nonzero()[0])
-        sample_new.zones[z_id, site_new] = 1
+        # Choose a site to add to the zone...
+        site_new = _random.choice(candidates)
 
-        # Remove a site from the zone
-        removal_candidates = self.get_removal_candidates(zone_current)
+        # ...and a site to remove from the zone
+        removal_candidates = self.get_removal_candidates(sample, z_id)
         site_removed = _random.choice(removal_candidates)
-        sample_new.zones[z_id, site_removed] = 0
 
         # # Compute transition probabilities
-        back_neighbours = get_neighbours(zone_current, occupied, self.adj_mat)
+        back_neighbours = neighbours
         # q = 1. / np.count_nonzero(candidates)
         # q_back = 1. / np.count_nonzero(back_neighbours)
 
         # Transition probability growing to the new zone
-        q_non_connected = 1 / np.count_nonzero(~occupied)
+        n_free = self.n - membership.n_occupied
+        q_non_connected = 1 / n_free
         q = (1 - self.p_grow_connected) * q_non_connected
-        if neighbours[site_new]:
-            q_connected = 1 / np.count_nonzero(neighbours)
+        if membership.is_neighbour(z_id, site_new):
+            q_connected = 1 / len(neighbours)
             q += self.p_grow_connected * q_connected
 
         # Transition probability of growing back to the original zone
-        q_back_non_connected = 1 / np.count_nonzero(~occupied)
+        q_back_non_connected = 1 / n_free
         q_back = (1 - self.p_grow_connected) * q_back_non_connected
         # If z is a neighbour of the new zone, the back step could also be a connected grow step
-        if back_neighbours[site_removed]:
-            q_back_connected = 1 / np.count_nonzero(back_neighbours)
+        if membership.is_neighbour(z_id, site_removed):
+            q_back_connected = 1 / len(back_neighbours)
             q_back += self.p_grow_connected * q_back_connected
 
-        # The step changed the zone (which has an influence on how the lh and the prior look like)
-        sample_new.what_changed['lh']['zones'].add(z_id)
-        sample.what_changed['lh']['zones'].add(z_id)
-        sample_new.what_changed['prior']['zones'].add(z_id)
-        sample.what_changed['prior']['zones'].add(z_id)
-        #return sample_new, 1., 1.
-        return sample_new, q, q_back
+        # Swap the sites
+        sample.propose('zones', (z_id, site_new), True, changed=z_id)
+        sample.propose('zones', (z_id, site_removed), False, changed=z_id)
+
+        return sample, q, q_back
 
     def grow_zone(self, sample):
         """ This functions grows one of the zones in the current sample (i.e. it adds a new site to one of the zones)
@@ -505,60 +898,51 @@ class ZoneMCMCGenerative(MCMCGenerative):
             (Sample): The modified sample.
         """
 
-        sample_new = sample.copy()
-        zones_current = sample.zones
-        occupied = np.any(zones_current, axis=0)
+        membership = sample.membership
 
         # Randomly choose one of the zones to modify
-        z_id = np.random.choice(range(zones_current.shape[0]))
-        zone_current = zones_current[z_id, :]
+        z_id = np.random.choice(range(sample.zones.shape[0]))
 
         # Check if zone is small enough to grow
-        current_size = np.count_nonzero(zone_current)
+        current_size = membership.sizes[z_id]
 
         if current_size >= self.max_size:
             # Zone too big to grow: don't modify the sample and reject the step (q_back = 0)
             q, q_back = 1., 0.
             return sample, q, q_back
 
-        neighbours = get_neighbours(zone_current, occupied, self.adj_mat)
+        neighbours = membership.get_neighbours(z_id, self.adj_mat)
         connected_step = (_random.random() < self.p_grow_connected)
         if connected_step:
             # All neighbors that are not yet occupied by other zones are candidates
             candidates = neighbours
         else:
             # All free sites are candidates
-            candidates = ~occupied
+            candidates = membership.free_sites()
 
         # When stuck (no candidates) return current sample and reject the step (q_back = 0)
-        if not np.any(candidates):
+        if len(candidates) == 0:
             q, q_back = 1., 0.
             return sample, q, q_back
 
-        # Choose a random candidate and add it to the zone
-        site_new = _random.choice(candidates.nonzero()[0])
-        sample_new.zones[z_id, site_new] = 1
+        # Choose a random candidate
+        site_new = _random.choice(candidates)
 
         # Transition probability when growing
-        q_non_connected = 1 / np.count_nonzero(~occupied)
+        q_non_connected = 1 / (self.n - membership.n_occupied)
         q = (1 - self.p_grow_connected) * q_non_connected
 
-        if neighbours[site_new]:
-            q_connected = 1 / np.count_nonzero(neighbours)
+        if membership.is_neighbour(z_id, site_new):
+            q_connected = 1 / len(neighbours)
             q += self.p_grow_connected * q_connected
 
         # Back-probability (shrinking)
         q_back = 1 / (current_size + 1)
 
-        # q = q_back = 1.
+        # Add the candidate to the zone
+        sample.propose('zones', (z_id, site_new), True, changed=z_id)
 
-        # The step changed the zone (which has an influence on how the lh and the prior look like)
-        sample_new.what_changed['lh']['zones'].add(z_id)
-        sample.what_changed['lh']['zones'].add(z_id)
-        sample_new.what_changed['prior']['zones'].add(z_id)
-        sample.what_changed['prior']['zones'].add(z_id)
-        #return sample_new, 1., 1.
-        return sample_new, q, q_back
+        return sample, q, q_back
 
     def shrink_zone(self, sample):
         """ This functions shrinks one of the zones in the current sample (i.e. it removes one site from one zone)
@@ -569,50 +953,456 @@ class ZoneMCMCGenerative(MCMCGenerative):
         Returns:
             (Sample): The modified sample.
         """
-        sample_new = sample.copy()
-        zones_current = sample.zones
+        membership = sample.membership
 
         # Randomly choose one of the zones to modify
-        z_id = np.random.choice(range(zones_current.shape[0]))
-        zone_current = zones_current[z_id, :]
+        z_id = np.random.choice(range(sample.zones.shape[0]))
 
         # Check if zone is big enough to shrink
-        current_size = np.count_nonzero(zone_current)
+        current_size = membership.sizes[z_id]
         if current_size <= self.min_size:
             # Zone is too small to shrink: don't modify the sample and reject the step (q_back = 0)
             q, q_back = 1., 0.
             return sample, q, q_back
 
         # Zone is big enough: shrink
-        removal_candidates = self.get_removal_candidates(zone_current)
+        removal_candidates = self.get_removal_candidates(sample, z_id)
         site_removed = _random.choice(removal_candidates)
-        sample_new.zones[z_id, site_removed] = 0
+        sample.propose('zones', (z_id, site_removed), False, changed=z_id)
 
         # Transition probability when shrinking.
         q = 1 / len(removal_candidates)
         # Back-probability (growing)
-        zone_new = sample_new.zones[z_id]
-        occupied_new = np.any(sample_new.zones, axis=0)
-        back_neighbours = get_neighbours(zone_new, occupied_new, self.adj_mat)
+        back_neighbours = membership.get_neighbours(z_id, self.adj_mat)
 
         # The back step could always be a non-connected grow step
-        q_back_non_connected = 1 / np.count_nonzero(~occupied_new)
+        q_back_non_connected = 1 / (self.n - membership.n_occupied)
         q_back = (1 - self.p_grow_connected) * q_back_non_connected
 
         # If z is a neighbour of the new zone, the back step could also be a connected grow step
-        if back_neighbours[site_removed]:
-            q_back_connected = 1 / np.count_nonzero(back_neighbours)
+        if membership.is_neighbour(z_id, site_removed):
+            q_back_connected = 1 / len(back_neighbours)
             q_back += self.p_grow_connected * q_back_connected
 
-        # q = q_back = 1.
+        return sample, q, q_back
+
+    def grow_zone_informed(self, sample):
+        """Grow one of the zones with an informed proposal (see informed_grow).
+        Args:
+            sample(Sample): The current sample with zones and weights.
 
-        # The step changed the zone (which has an influence on how the lh and the prior look like)
-        sample_new.what_changed['lh']['zones'].add(z_id)
-        sample.what_changed['lh']['zones'].add(z_id)
-        sample_new.what_changed['prior']['zones'].add(z_id)
-        sample.what_changed['prior']['zones'].add(z_id)
-        #return sample_new, 1., 1.
-        return sample_new, q, q_back
+        Returns:
+            (Sample): The modified sample.
+        """
+        return self.informed_grow(sample, self.p_grow_connected, self.max_size)
+
+    def shrink_zone_informed(self, sample):
+        """Shrink one of the zones with an informed proposal (see informed_shrink).
+        Args:
+            sample(Sample): The current sample with zones and weights.
+
+        Returns:
+            (Sample): The modified sample.
+        """
+        return self.informed_shrink(sample, self.p_grow_connected)
+
+    def informed_grow(self, sample, p_grow_connected, max_size):
+        """Grow one of the zones by a locally balanced, informed proposal: in connected steps the likelihood
+        change of adding each neighbour is computed at once and the new site is drawn proportionally to
+        the square root of the likelihood ratio. Non-connected steps choose a free site at random.
+
+        Args:
+            sample (Sample): The current sample with zones and weights.
+            p_grow_connected (float): Probability of a connected step.
+            max_size (int): Maximum size of a zone.
+        Returns:
+            Sample: The modified sample.
+            float: The transition probability q.
+            float: The back probability q_back
+        """
+        membership = sample.membership
+
+        # Randomly choose one of the zones to modify
+        z_id = np.random.choice(range(sample.zones.shape[0]))
+
+        # Check if zone is small enough to grow
+        if membership.sizes[z_id] >= max_size:
+            # Zone too big to grow: don't modify the sample and reject the step (q_back = 0)
+            q, q_back = 1., 0.
+            return sample, q, q_back
+
+        neighbours = membership.get_neighbours(z_id, self.adj_mat)
+        p_neighbours = self.informed_grow_probabilities(sample, z_id, neighbours)
+
+        connected_step = (_random.random() < p_grow_connected)
+        if connected_step:
+            # When stuck (no neighbours) return current sample and reject the step (q_back = 0)
+            if len(neighbours) == 0:
+                q, q_back = 1., 0.
+                return sample, q, q_back
+            i_new = np.random.choice(len(neighbours), p=p_neighbours)
+            site_new = neighbours[i_new]
+        else:
+            free_sites = membership.free_sites()
+            if len(free_sites) == 0:
+                q, q_back = 1., 0.
+                return sample, q, q_back
+            site_new = free_sites[np.random.randint(len(free_sites))]
+            i_new = np.searchsorted(neighbours, site_new)
+
+        # Transition probability when growing
+        q = (1 - p_grow_connected) / (self.n - membership.n_occupied)
+        if membership.is_neighbour(z_id, site_new):
+            q += p_grow_connected * p_neighbours[i_new]
+
+        # Add the candidate to the zone
+        sample.propose('zones', (z_id, site_new), True, changed=z_id)
+
+        # Back-probability (informed shrinking)
+        zone_sites = membership.sites[z_id]
+        q_back = self.informed_shrink_probabilities(sample, z_id, zone_sites)[np.searchsorted(zone_sites, site_new)]
+
+        return sample, q, q_back
+
+    def informed_shrink(self, sample, p_grow_connected):
+        """Shrink one of the zones by a locally balanced, informed proposal: the likelihood change of
+        removing each site of the zone is computed at once and the removed site is drawn proportionally
+        to the square root of the likelihood ratio.
+
+        Args:
+            sample (Sample): The current sample with zones and weights.
+            p_grow_connected (float): Probability of a connected step in the (informed) back-step.
+        Returns:
+            Sample: The modified sample.
+            float: The transition probability q.
+            float: The back probability q_back
+        """
+        membership = sample.membership
+
+        # Randomly choose one of the zones to modify
+        z_id = np.random.choice(range(sample.zones.shape[0]))
+
+        # Check if zone is big enough to shrink
+        if membership.sizes[z_id] <= self.min_size:
+            # Zone is too small to shrink: don't modify the sample and reject the step (q_back = 0)
+            q, q_back = 1., 0.
+            return sample, q, q_back
+
+        removal_candidates = self.get_removal_candidates(sample, z_id)
+        p_removal = self.informed_shrink_probabilities(sample, z_id, removal_candidates)
+        i_removed = np.random.choice(len(removal_candidates), p=p_removal)
+        site_removed = removal_candidates[i_removed]
+
+        # Transition probability when shrinking
+        q = p_removal[i_removed]
+
+        sample.propose('zones', (z_id, site_removed), False, changed=z_id)
+
+        # Back-probability (growing): a non-connected or an informed connected step
+        back_neighbours = membership.get_neighbours(z_id, self.adj_mat)
+        q_back = (1 - p_grow_connected) / (self.n - membership.n_occupied)
+        if membership.is_neighbour(z_id, site_removed):
+            p_back = self.informed_grow_probabilities(sample, z_id, back_neighbours)
+            q_back += p_grow_connected * p_back[np.searchsorted(back_neighbours, site_removed)]
+
+        return sample, q, q_back
+
+    def informed_grow_probabilities(self, sample, z_id, candidates):
+        """The probability of adding each of the candidates to zone z_id in an informed grow step."""
+        log_lh_ratio = (self.site_log_lh(sample, candidates, z_id)
+                        - self.site_log_lh(sample, candidates, None))
+        return self.locally_balanced(log_lh_ratio)
+
+    def informed_shrink_probabilities(self, sample, z_id, candidates):
+        """The probability of removing each of the candidates from zone z_id in an informed shrink step."""
+        log_lh_ratio = (self.site_log_lh(sample, candidates, None)
+                        - self.site_log_lh(sample, candidates, z_id))
+        return self.locally_balanced(log_lh_ratio)
+
+    @staticmethod
+    def locally_balanced(log_ratio):
+        """Normalized weights of a locally balanced proposal (balancing function sqrt(t)).
+
+        Args:
+            log_ratio (np.array): The log-ratio of the target density after and before each move.
+        Returns:
+            np.array: The probability of each move.
+        """
+        if len(log_ratio) == 0:
+            return log_ratio
+        w = np.exp(0.5 * (log_ratio - np.max(log_ratio)))
+        return w / np.sum(w)
+
+    def site_log_lh(self, sample, sites, z_id):
+        """The log-likelihood of the given sites (summed over features), with the sites assigned to zone
+        z_id or to no zone. The likelihood of a site only depends on its own assignment, so the
+        likelihood change of adding or removing any site is computed in one batch.
+
+        Args:
+            sample (Sample): The current sample.
+            sites (np.array): Index-list of the sites.
+            z_id (int): The zone the sites are assigned to (None: no zone).
+        Returns:
+            np.array: The log-likelihood of each site.
+                shape: (len(sites))
+        """
+        states = self.states[sites]
+        n_components = 3 if self.inheritance else 2
+        all_lh = np.zeros(states.shape + (n_components,))
+        assignment = np.zeros((len(sites), n_components), dtype=bool)
+
+        all_lh[:, :, 0] = zone_likelihood_kernel(states, sample.p_global[0])
+        assignment[:, 0] = True
+
+        if z_id is not None:
+            all_lh[:, :, 1] = zone_likelihood_kernel(states, sample.p_zones[z_id])
+            assignment[:, 1] = True
+
+        if self.inheritance:
+            p_families = sample.p_families[self.family_of_site[sites]]
+            all_lh[:, :, 2] = np.take_along_axis(p_families, states[..., np.newaxis].astype(int), axis=-1)[..., 0]
+            assignment[:, 2] = self.has_family[sites]
+
+        weights = normalize_weights(sample.weights[np.newaxis, :, :], assignment)
+        weighted_lh = np.sum(weights * all_lh, axis=-1)
+        weighted_lh[states == NA_STATE] = 1.
+        return np.sum(np.log(weighted_lh), axis=-1)
+
+    def swap_zone_mtm(self, sample):
+        """Swap sites in one of the zones with a multiple-try proposal (see multiple_try_area_step).
+        Args:
+            sample(Sample): The current sample with zones and weights.
+
+        Returns:
+            (Sample): The modified sample.
+        """
+        return self.multiple_try_area_step(sample, 'swap', self.multiple_tries['swap_zone'],
+                                           self.p_grow_connected, self.max_size)
+
+    def grow_zone_mtm(self, sample):
+        """Grow one of the zones with a multiple-try proposal (see multiple_try_area_step).
+        Args:
+            sample(Sample): The current sample with zones and weights.
+
+        Returns:
+            (Sample): The modified sample.
+        """
+        return self.multiple_try_area_step(sample, 'grow', self.multiple_tries['grow_zone'],
+                                           self.p_grow_connected, self.max_size)
+
+    def shrink_zone_mtm(self, sample):
+        """Shrink one of the zones with a multiple-try proposal (see multiple_try_area_step).
+        Args:
+            sample(Sample): The current sample with zones and weights.
+
+        Returns:
+            (Sample): The modified sample.
+        """
+        return self.multiple_try_area_step(sample, 'shrink', self.multiple_tries['shrink_zone'],
+                                           self.p_grow_connected, self.max_size)
+
+    def multiple_try_area_step(self, sample, move, k, p_grow_connected, max_size):
+        """Multiple-try Metropolis step (Liu, Liang and Wong, 2000) in one of the zones: k candidates are
+        drawn from the proposal of a grow, shrink or swap step and their (tempered) posterior relative to
+        the current sample is evaluated in one batch. One candidate is selected proportionally to its weight
+        (posterior / proposal probability). From the selected candidate k-1 reference points are drawn by
+        the reverse move, the k-th is the current sample. The MTM acceptance probability (the summed weights
+        of the candidates over the summed weights of the reference points) is passed on as log q and
+        q_back, so that the step is accepted by the usual metropolis hastings ratio.
+
+        Args:
+            sample (Sample): The current sample with zones and weights.
+            move (str): The kind of step ('grow', 'shrink' or 'swap').
+            k (int): The number of tries.
+            p_grow_connected (float): Probability of a connected step when growing.
+            max_size (int): Maximum size of a zone.
+        Returns:
+            Sample: The modified sample.
+            LogProbability: The transition probability q.
+            LogProbability: The back probability q_back
+        """
+        temperature = self.chain_temperature[self.proposing_chain]
+        reverse_move = {'grow': 'shrink', 'shrink': 'grow', 'swap': 'swap'}[move]
+
+        # Randomly choose one of the zones to modify
+        z_id = np.random.choice(range(sample.zones.shape[0]))
+
+        # Draw the candidates and weight them
+        sites_new, sites_removed, valid = self.draw_area_moves(sample, z_id, move, k, p_grow_connected, max_size)
+        log_proposal = self.area_moves_log_proposal(sample, z_id, sites_new, sites_removed, p_grow_connected)
+        log_posterior = self.area_moves_log_posterior(sample, z_id, sites_new, sites_removed, temperature)
+        log_weights = np.where(valid, log_posterior - log_proposal, -np.inf)
+
+        # When stuck (no valid candidate) return current sample and reject the step (q_back = 0)
+        if not np.any(valid):
+            q, q_back = 1., 0.
+            return sample, q, q_back
+
+        # Select one of the candidates
+        p_select = np.exp(log_weights - np.max(log_weights))
+        j = np.random.choice(k, p=p_select / np.sum(p_select))
+        site_new, site_removed = sites_new[j], sites_removed[j]
+
+        if site_new >= 0:
+            sample.propose('zones', (z_id, site_new), True, changed=z_id)
+        if site_removed >= 0:
+            sample.propose('zones', (z_id, site_removed), False, changed=z_id)
+
+        # Draw the reference points from the candidate (the last one is the way back to the current sample)
+        ref_new, ref_removed, ref_valid = self.draw_area_moves(sample, z_id, reverse_move, k - 1,
+                                                               p_grow_connected, max_size)
+        ref_new = np.append(ref_new, site_removed)
+        ref_removed = np.append(ref_removed, site_new)
+        ref_valid = np.append(ref_valid, True)
+
+        ref_log_proposal = self.area_moves_log_proposal(sample, z_id, ref_new, ref_removed, p_grow_connected)
+        ref_log_posterior = (log_posterior[j] +
+                             self.area_moves_log_posterior(sample, z_id, ref_new, ref_removed, temperature))
+        ref_log_weights = np.where(ref_valid, ref_log_posterior - ref_log_proposal, -np.inf)
+
+        q = LogProbability(log_posterior[j] - logsumexp(log_weights))
+        q_back = LogProbability(-logsumexp(ref_log_weights))
+        return sample, q, q_back
+
+    def draw_area_moves(self, sample, z_id, move, k, p_grow_connected, max_size):
+        """Draw k moves of zone z_id from the proposal distribution of a grow, shrink or swap step.
+
+        Args:
+            sample (Sample): The current sample.
+            z_id (int): The zone to modify.
+            move (str): The kind of step ('grow', 'shrink' or 'swap').
+            k (int): The number of moves.
+            p_grow_connected (float): Probability of a connected step when growing.
+            max_size (int): Maximum size of a zone.
+        Returns:
+            np.array: The site added by each move (-1: none).
+                shape: (k)
+            np.array: The site removed by each move (-1: none).
+                shape: (k)
+            np.array: Is the move possible (otherwise the step would be rejected)?
+                shape: (k)
+        """
+        membership = sample.membership
+        sites_new = np.full(k, -1)
+        sites_removed = np.full(k, -1)
+        valid = np.ones(k, dtype=bool)
+
+        if move in ('grow', 'swap'):
+            if move == 'grow' and membership.sizes[z_id] >= max_size:
+                valid[:] = False
+
+            # Connected steps choose among the neighbours, the others among all free sites
+            connected = np.random.random(k) < p_grow_connected
+            for step_type, candidates in [(connected, membership.get_neighbours(z_id, self.adj_mat)),
+                                          (~connected, membership.free_sites())]:
+                if len(candidates) == 0:
+                    valid[step_type] = False
+                else:
+                    sites_new[step_type] = candidates[np.random.randint(len(candidates),
+                                                                        size=np.count_nonzero(step_type))]
+
+        if move in ('shrink', 'swap'):
+            removal_candidates = self.get_removal_candidates(sample, z_id)
+            if (move == 'shrink' and membership.sizes[z_id] <= self.min_size) or len(removal_candidates) == 0:
+                valid[:] = False
+            else:
+                sites_removed = removal_candidates[np.random.randint(len(removal_candidates), size=k)]
+
+        sites_new[~valid] = -1
+        sites_removed[~valid] = -1
+        return sites_new, sites_removed, valid
+
+    def area_moves_log_proposal(self, sample, z_id, sites_new, sites_removed, p_grow_connected):
+        """The log-probability of proposing each of the moves of zone z_id (see draw_area_moves).
+
+        Args:
+            sample (Sample): The current sample.
+            z_id (int): The zone to modify.
+            sites_new (np.array): The site added by each move (-1: none).
+            sites_removed (np.array): The site removed by each move (-1: none).
+            p_grow_connected (float): Probability of a connected step when growing.
+        Returns:
+            np.array: The log proposal probability of each move.
+        """
+        membership = sample.membership
+        log_q = np.zeros(len(sites_new))
+
+        grow = sites_new >= 0
+        if np.any(grow):
+            neighbours = membership.get_neighbours(z_id, self.adj_mat)
+            q = np.full(np.count_nonzero(grow), (1 - p_grow_connected) / (self.n - membership.n_occupied))
+            if len(neighbours) > 0:
+                q += p_grow_connected * np.isin(sites_new[grow], neighbours) / len(neighbours)
+            # Moves to non-neighbours are impossible when p_grow_connected == 1 (log q = -inf)
+            with np.errstate(divide='ignore'):
+                log_q[grow] = np.log(q)
+
+        shrink = sites_removed >= 0
+        if np.any(shrink):
+            log_q[shrink] -= np.log(len(self.get_removal_candidates(sample, z_id)))
+
+        return log_q
+
+    def area_moves_log_posterior(self, sample, z_id, sites_new, sites_removed, temperature=1.):
+        """The (tempered) log-posterior after each of the moves of zone z_id, relative to the current
+        sample. The likelihood only changes at the moved sites, the prior only in the size- and geo-prior.
+
+        Args:
+            sample (Sample): The current sample.
+            z_id (int): The zone to modify.
+            sites_new (np.array): The site added by each move (-1: none).
+            sites_removed (np.array): The site removed by each move (-1: none).
+            temperature (float): The temperature of the chain.
+        Returns:
+            np.array: The log-posterior ratio of each move.
+        """
+        log_posterior = np.zeros(len(sites_new))
+        grow = sites_new >= 0
+        shrink = sites_removed >= 0
+
+        # Likelihood: the change of all moved sites is computed at once
+        if not self.sample_from_prior:
+            sites = np.unique(np.concatenate([sites_new[grow], sites_removed[shrink]]))
+            log_lh_gain = self.site_log_lh(sample, sites, z_id) - self.site_log_lh(sample, sites, None)
+            log_posterior[grow] += log_lh_gain[np.searchsorted(sites, sites_new[grow])]
+            log_posterior[shrink] -= log_lh_gain[np.searchsorted(sites, sites_removed[shrink])]
+            log_posterior /= temperature
+
+        # Prior: only the size- and geo-prior depend on the zones
+        zone = sample.zones[z_id]
+        geo_prior = self.geo_prior
+        if geo_prior['type'] == 'uniform':
+            def zone_log_prior(z):
+                return evaluate_size_prior(z[np.newaxis])
+        else:
+            # The geo-prior is the mean over the edges of all zones
+            others = [compute_geo_prior_of_zone(sample.zones[z], geo_prior, self.network,
+                                                zone_cache=self.zone_cache)[1]
+                      for z in range(sample.zones.shape[0]) if z != z_id]
+            sum_others = sum(np.sum(lp) for lp in others)
+            n_others = sum(len(lp) for lp in others)
+            previous = (zone, compute_geo_prior_of_zone(zone, geo_prior, self.network,
+                                                        zone_cache=self.zone_cache)[0])
+
+            def zone_log_prior(z):
+                log_prior = compute_geo_prior_of_zone(z, geo_prior, self.network,
+                                                      zone_cache=self.zone_cache, previous=previous)[1]
+                return (evaluate_size_prior(z[np.newaxis])
+                        + (sum_others + np.sum(log_prior)) / (n_others + len(log_prior)))
+
+        log_prior_current = zone_log_prior(zone)
+        log_prior_moves = {}
+        for i, move in enumerate(zip(sites_new, sites_removed)):
+            if move not in log_prior_moves:
+                new_zone = zone.copy()
+                if move[0] >= 0:
+                    new_zone[move[0]] = True
+                if move[1] >= 0:
+                    new_zone[move[1]] = False
+                log_prior_moves[move] = zone_log_prior(new_zone) - log_prior_current
+            log_posterior[i] += log_prior_moves[move]
+
+        return log_posterior
 
     def generate_initial_zones(self):
         """For each chain (c) generate initial zones by
@@ -697,7 +1487,7 @@ class ZoneMCMCGenerative(MCMCGenerative):
 
         # Take a random free site and use it as seed for the new zone
         try:
-            i = _random.sample(sites_free, 1)[0]
+            i = _random.sample(sorted(sites_free), 1)[0]
             zone[i] = already_in_zone[i] = 1
         except ValueError:
             raise self.ZoneError
@@ -727,7 +1517,7 @@ class ZoneMCMCGenerative(MCMCGenerative):
 
         # B: Use weights from a previous run
         if self.initial_sample.weights is not None:
-            initial_weights = self.initial_sample.weights
+            initial_weights = self.initial_sample.weights.copy()
 
         # A: Initialize new weights
         else:
@@ -754,7 +1544,7 @@ class ZoneMCMCGenerative(MCMCGenerative):
 
         # B: Use p_global from a previous run
         if self.initial_sample.p_global is not None:
-            initial_p_global = self.initial_sample.p_global
+            initial_p_global = self.initial_sample.p_global.copy()
 
         # A: Initialize new p_global using the MLE
         else:
@@ -910,16 +1700,16 @@ class ZoneMCMCGenerative(MCMCGenerative):
         return sample
 
     @staticmethod
-    def get_removal_candidates(zone):
+    def get_removal_candidates(sample, z_id):
         """Finds sites which can be removed from the given zone.
 
         Args:
-            zone (np.array): The zone for which removal candidates are found.
-                shape(n_sites)
+            sample (Sample): The current sample.
+            z_id (int): The zone for which removal candidates are found.
         Returns:
-            (list): Index-list of removal candidates.
+            (np.array): Index-list of removal candidates.
         """
-        return zone.nonzero()[0]
+        return sample.membership.sites[z_id]
 
     class ZoneError(Exception):
         pass
@@ -945,6 +1735,55 @@ class ZoneMCMCGenerative(MCMCGenerative):
     def log_sample_statistics(self, sample, c, sample_id):
         super(ZoneMCMCGenerative, self).log_sample_statistics(sample, c, sample_id)
 
+    def log_run_statistics(self, n_steps):
+        super(ZoneMCMCGenerative, self).log_run_statistics(n_steps)
+
+        for key, count in self.get_counters().items():
+            self.statistics[key] += count
+
+    def get_counters(self):
+        if self.zone_cache is None:
+            return {}
+        return {'zone_cache_hits': self.zone_cache.hits, 'zone_cache_misses': self.zone_cache.misses}
+
+    def set_counters(self, counters):
+        # The cached evaluations are not saved: after a restore, the cache is filled again from scratch
+        if self.zone_cache is not None:
+            self.zone_cache.hits = counters['zone_cache_hits']
+            self.zone_cache.misses = counters['zone_cache_misses']
+
+    def evaluate_single_zones(self, sample):
+        """Evaluate the contribution of each zone of a sample to the likelihood and the prior
+        (makes it possible to rank zones). The chains are not affected, since the single zones are
+        evaluated with separate caches.
+
+        Args:
+            sample(Sample): A Sample object consisting of zones and parameters.
+        Returns:
+            list, list: The (log) likelihood and the (log) prior of each zone alone.
+        """
+        log_lh = []
+        log_prior = []
+        for z in range(len(sample.zones)):
+            single_zone = Sample(zones=sample.zones[np.newaxis, z], weights=sample.weights,
+                                 p_global=sample.p_global, p_zones=sample.p_zones[np.newaxis, z],
+                                 p_families=sample.p_families)
+
+            if self.sample_from_prior:
+                log_lh.append(0.)
+            else:
+                log_lh.append(self.compute_lh_single_zone(sample=single_zone))
+
+            log_prior.append(self.compute_prior_single_zone(sample=single_zone, inheritance=self.inheritance,
+                                                            geo_prior_meta=self.geo_prior,
+                                                            prior_weights_meta=self.prior_weights,
+                                                            prior_p_global_meta=self.prior_p_global,
+                                                            prior_p_zones_meta=self.prior_p_zones,
+                                                            prior_p_families_meta=self.prior_p_families,
+                                                            network=self.network))
+
+        return log_lh, log_prior
+
 
 class ZoneMCMCWarmup(ZoneMCMCGenerative):
 
@@ -962,6 +1801,33 @@ class ZoneMCMCWarmup(ZoneMCMCGenerative):
     def alter_p_zones(self, sample, c=0):
         return super(ZoneMCMCWarmup, self).alter_p_zones(sample)
 
+    def gibbs_p_global(self, sample, c=0):
+        return super(ZoneMCMCWarmup, self).gibbs_p_global(sample)
+
+    def grow_zone_informed(self, sample, c=0):
+        return self.informed_grow(sample, self.p_grow_connected[c], self.max_size[c])
+
+    def swap_zone_mtm(self, sample, c=0):
+        return self.multiple_try_area_step(sample, 'swap', self.multiple_tries['swap_zone'],
+                                           self.p_grow_connected[c], self.max_size[c])
+
+    def grow_zone_mtm(self, sample, c=0):
+        return self.multiple_try_area_step(sample, 'grow', self.multiple_tries['grow_zone'],
+                                           self.p_grow_connected[c], self.max_size[c])
+
+    def shrink_zone_mtm(self, sample, c=0):
+        return self.multiple_try_area_step(sample, 'shrink', self.multiple_tries['shrink_zone'],
+                                           self.p_grow_connected[c], self.max_size[c])
+
+    def shrink_zone_informed(self, sample, c=0):
+        return self.informed_shrink(sample, self.p_grow_connected[c])
+
+    def gibbs_p_zones(self, sample, c=0):
+        return super(ZoneMCMCWarmup, self).gibbs_p_zones(sample)
+
+    def gibbs_p_families(self, sample, c=0):
+        return super(ZoneMCMCWarmup, self).gibbs_p_families(sample)
+
     def swap_zone(self, sample, c=0):
         """ This functions swaps sites in one of the zones of the current sample
         (i.e. in of the zones a site is removed and another one added)
@@ -971,66 +1837,59 @@ class ZoneMCMCWarmup(ZoneMCMCGenerative):
         Returns:
             Sample: The modified sample.
          """
-        sample_new = sample.copy()
-        zones_current = sample.zones
-        occupied = np.any(zones_current, axis=0)
+        membership = sample.membership
 
         # Randomly choose one of the zones to modify
-        z_id = np.random.choice(range(zones_current.shape[0]))
-        zone_current = zones_current[z_id, :]
+        z_id = np.random.choice(range(sample.zones.shape[0]))
 
-        neighbours = get_neighbours(zone_current, occupied, self.adj_mat)
+        neighbours = membership.get_neighbours(z_id, self.adj_mat)
         connected_step = (_random.random() < self.p_grow_connected[c])
         if connected_step:
             # All neighbors that are not yet occupied by other zones are candidates
             candidates = neighbours
         else:
             # All free sites are candidates
-            candidates = ~occupied
+            candidates = membership.free_sites()
 
         # When stuck (all neighbors occupied) return current sample and reject the step (q_back = 0)
-        if not np.any(candidates):
+        if len(candidates) == 0:
             q, q_back = 1., 0.
             return sample, q, q_back
 
-        # Add a site to the zone
-        site_new = _random.choice(candidates.nonzero()[0])
-        sample_new.zones[z_id, site_new] = 1
+        # Choose a site to add to the zone...
+        site_new = _random.choice(candidates)
 
-        # Remove a site from the zone
-        removal_candidates = self.get_removal_candidates(zone_current)
+        # ...and a site to remove from the zone
+        removal_candidates = self.get_removal_candidates(sample, z_id)
         site_removed = _random.choice(removal_candidates)
-        sample_new.zones[z_id, site_removed] = 0
 
         # # Compute transition probabilities
-        back_neighbours = get_neighbours(zone_current, occupied, self.adj_mat)
+        back_neighbours = neighbours
         # q = 1. / np.count_nonzero(candidates)
         # q_back = 1. / np.count_nonzero(back_neighbours)
 
         # Transition probability growing to the new zone
-        q_non_connected = 1 / np.count_nonzero(~occupied)
+        n_free = self.n - membership.n_occupied
+        q_non_connected = 1 / n_free
 
         q = (1 - self.p_grow_connected[c]) * q_non_connected
-        if neighbours[site_new]:
-            q_connected = 1 / np.count_nonzero(neighbours)
+        if membership.is_neighbour(z_id, site_new):
+            q_connected = 1 / len(neighbours)
             q += self.p_grow_connected[c] * q_connected
 
         # Transition probability of growing back to the original zone
-        q_back_non_connected = 1 / np.count_nonzero(~occupied)
+        q_back_non_connected = 1 / n_free
         q_back = (1 - self.p_grow_connected[c]) * q_back_non_connected
         # If z is a neighbour of the new zone, the back step could also be a connected grow step
-        if back_neighbours[site_removed]:
-            q_back_connected = 1 / np.count_nonzero(back_neighbours)
+        if membership.is_neighbour(z_id, site_removed):
+            q_back_connected = 1 / len(back_neighbours)
             q_back += self.p_grow_connected[c] * q_back_connected
 
-        # The step changed the zone (which has an influence on how the lh and the prior look like)
-        sample_new.what_changed['lh']['zones'].add(z_id)
-        sample.what_changed['lh']['zones'].add(z_id)
-        sample_new.what_changed['prior']['zones'].add(z_id)
-        sample.what_changed['prior']['zones'].add(z_id)
-        # return sample_new, 1., 1.
+        # Swap the sites
+        sample.propose('zones', (z_id, site_new), True, changed=z_id)
+        sample.propose('zones', (z_id, site_removed), False, changed=z_id)
 
-        return sample_new, q, q_back
+        return sample, q, q_back
 
     def grow_zone(self, sample, c=0):
         """ This functions grows one of the zones in the current sample (i.e. it adds a new site to one of the zones)
@@ -1040,46 +1899,42 @@ class ZoneMCMCWarmup(ZoneMCMCGenerative):
         Returns:
             (Sample): The modified sample.
         """
-        sample_new = sample.copy()
-        zones_current = sample.zones
-        occupied = np.any(zones_current, axis=0)
+        membership = sample.membership
 
         # Randomly choose one of the zones to modify
-        z_id = np.random.choice(range(zones_current.shape[0]))
-        zone_current = zones_current[z_id, :]
+        z_id = np.random.choice(range(sample.zones.shape[0]))
 
         # Check if zone is small enough to grow
-        current_size = np.count_nonzero(zone_current)
+        current_size = membership.sizes[z_id]
 
         if current_size >= self.max_size[c]:
             # Zone too big to grow: don't modify the sample and reject the step (q_back = 0)
             q, q_back = 1., 0.
             return sample, q, q_back
 
-        neighbours = get_neighbours(zone_current, occupied, self.adj_mat)
+        neighbours = membership.get_neighbours(z_id, self.adj_mat)
         connected_step = (_random.random() < self.p_grow_connected[c])
         if connected_step:
             # All neighbors that are not yet occupied by other zones are candidates
             candidates = neighbours
         else:
             # All free sites are candidates
-            candidates = ~occupied
+            candidates = membership.free_sites()
 
         # When stuck (no candidates) return current sample and reject the step (q_back = 0)
-        if not np.any(candidates):
+        if len(candidates) == 0:
             q, q_back = 1., 0.
             return sample, q, q_back
 
-        # Choose a random candidate and add it to the zone
-        site_new = _random.choice(candidates.nonzero()[0])
-        sample_new.zones[z_id, site_new] = 1
+        # Choose a random candidate
+        site_new = _random.choice(candidates)
 
         # Transition probability when growing
-        q_non_connected = 1 / np.count_nonzero(~occupied)
+        q_non_connected = 1 / (self.n - membership.n_occupied)
         q = (1 - self.p_grow_connected[c]) * q_non_connected
 
-        if neighbours[site_new]:
-            q_connected = 1 / np.count_nonzero(neighbours)
+        if membership.is_neighbour(z_id, site_new):
+            q_connected = 1 / len(neighbours)
             q += self.p_grow_connected[c] * q_connected
 
         # Back-probability (shrinking)
@@ -1096,14 +1951,10 @@ class ZoneMCMCWarmup(ZoneMCMCGenerative):
         # except ZeroDivisionError:
         #     pass
 
-        # The step changed the zone (which has an influence on how the lh and the prior look like)
-        sample_new.what_changed['lh']['zones'].add(z_id)
-        sample.what_changed['lh']['zones'].add(z_id)
-        sample_new.what_changed['prior']['zones'].add(z_id)
-        sample.what_changed['prior']['zones'].add(z_id)
+        # Add the candidate to the zone
+        sample.propose('zones', (z_id, site_new), True, changed=z_id)
 
-        #return sample_new, 1., 1.
-        return sample_new, q, q_back
+        return sample, q, q_back
 
     def shrink_zone(self, sample, c=0):
         """ This functions shrinks one of the zones in the current sample (i.e. it removes one site from one zone)
@@ -1114,39 +1965,35 @@ class ZoneMCMCWarmup(ZoneMCMCGenerative):
         Returns:
             (Sample): The modified sample.
         """
-        sample_new = sample.copy()
-        zones_current = sample.zones
+        membership = sample.membership
 
         # Randomly choose one of the zones to modify
-        z_id = np.random.choice(range(zones_current.shape[0]))
-        zone_current = zones_current[z_id, :]
+        z_id = np.random.choice(range(sample.zones.shape[0]))
 
         # Check if zone is big enough to shrink
-        current_size = np.count_nonzero(zone_current)
+        current_size = membership.sizes[z_id]
         if current_size <= self.min_size:
             # Zone is too small to shrink: don't modify the sample and reject the step (q_back = 0)
             q, q_back = 1., 0.
             return sample, q, q_back
 
         # Zone is big enough: shrink
-        removal_candidates = self.get_removal_candidates(zone_current)
+        removal_candidates = self.get_removal_candidates(sample, z_id)
         site_removed = _random.choice(removal_candidates)
-        sample_new.zones[z_id, site_removed] = 0
+        sample.propose('zones', (z_id, site_removed), False, changed=z_id)
 
         # Transition probability when shrinking.
         q = 1 / len(removal_candidates)
         # Back-probability (growing)
-        zone_new = sample_new.zones[z_id]
-        occupied_new = np.any(sample_new.zones, axis=0)
-        back_neighbours = get_neighbours(zone_new, occupied_new, self.adj_mat)
+        back_neighbours = membership.get_neighbours(z_id, self.adj_mat)
 
         # The back step could always be a non-connected grow step
-        q_back_non_connected = 1 / np.count_nonzero(~occupied_new)
+        q_back_non_connected = 1 / (self.n - membership.n_occupied)
         q_back = (1 - self.p_grow_connected[c]) * q_back_non_connected
 
         # If z is a neighbour of the new zone, the back step could also be a connected grow step
-        if back_neighbours[site_removed]:
-            q_back_connected = 1 / np.count_nonzero(back_neighbours)
+        if membership.is_neighbour(z_id, site_removed):
+            q_back_connected = 1 / len(back_neighbours)
             q_back += self.p_grow_connected[c] * q_back_connected
 
         # Back-probability (shrinking)
@@ -1155,13 +2002,7 @@ class ZoneMCMCWarmup(ZoneMCMCGenerative):
         # self.q_areas_stats['q_shrink'].append(q)
         # self.q_areas_stats['q_back_shrink'].append(q_back)
 
-        # The step changed the zone (which has an influence on how the lh and the prior look like)
-        sample_new.what_changed['lh']['zones'].add(z_id)
-        sample.what_changed['lh']['zones'].add(z_id)
-        sample_new.what_changed['prior']['zones'].add(z_id)
-        sample.what_changed['prior']['zones'].add(z_id)
-        #return sample_new, 1., 1.
-        return sample_new, q, q_back
+        return sample, q, q_back
 
     def alter_p_families(self, sample, c=0):
         return super(ZoneMCMCWarmup, self).alter_p_families(sample)
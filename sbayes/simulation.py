@@ -7,7 +7,6 @@
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
-import logging
 import numpy as np
 
 from sbayes.preprocessing import (compute_network, read_sites,
@@ -24,7 +23,7 @@ from sbayes.util import assess_correlation_probabilities
 class Simulation:
     def __init__(self, experiment):
 
-        self.path_log = experiment.path_results + 'experiment.log'
+        self.logger = experiment.logger
         self.config = experiment.config['simulation']
 
         self.sites_file = experiment.config['simulation']['SITES']
@@ -58,20 +57,19 @@ class Simulation:
         self.n_correlated = 10
 
     def log_simulation(self):
-        logging.basicConfig(format='%(message)s', filename=self.path_log, level=logging.DEBUG)
-        logging.info("\n")
-        logging.info("SIMULATION")
-        logging.info("##########################################")
-        logging.info(self.log_read_sites)
-        logging.info("Inheritance is simulated: %s", self.config['INHERITANCE'])
-        logging.info("Simulated features: %s", self.config['N_FEATURES'])
-        logging.info("Simulated intensity for universal pressure: %s", self.config['I_UNIVERSAL'])
-        logging.info("Simulated intensity for contact: %s", self.config['I_CONTACT'])
-        logging.info("Simulated intensity for inheritance: %s", self.config['I_INHERITANCE'])
-        logging.info("Simulated level of entropy for universal pressure: %s", self.config['E_UNIVERSAL'])
-        logging.info("Simulated level of entropy for contact: %s", self.config['E_CONTACT'])
-        logging.info("Simulated level of entropy for inheritance: %s", self.config['E_INHERITANCE'])
-        logging.info("Simulated area: %s", self.config['AREA'])
+        self.logger.info("\n")
+        self.logger.info("SIMULATION")
+        self.logger.info("##########################################")
+        self.logger.info(self.log_read_sites)
+        self.logger.info("Inheritance is simulated: %s", self.config['INHERITANCE'])
+        self.logger.info("Simulated features: %s", self.config['N_FEATURES'])
+        self.logger.info("Simulated intensity for universal pressure: %s", self.config['I_UNIVERSAL'])
+        self.logger.info("Simulated intensity for contact: %s", self.config['I_CONTACT'])
+        self.logger.info("Simulated intensity for inheritance: %s", self.config['I_INHERITANCE'])
+        self.logger.info("Simulated level of entropy for universal pressure: %s", self.config['E_UNIVERSAL'])
+        self.logger.info("Simulated level of entropy for contact: %s", self.config['E_CONTACT'])
+        self.logger.info("Simulated level of entropy for inheritance: %s", self.config['E_INHERITANCE'])
+        self.logger.info("Simulated area: %s", self.config['AREA'])
 
     def run_simulation(self):
 
@@ -2,8 +2,12 @@
 # -*- coding: utf-8 -*-
 import pickle
 import datetime
+import hashlib
 import csv
+import logging
 import os
+import re
+from collections import OrderedDict
 from math import sqrt, floor, ceil
 
 import typing as t
@@ -13,15 +17,18 @@ import pandas as pd
 import scipy.spatial as spatial
 from scipy.special import betaln
 import scipy.stats as stats
-from scipy.sparse import csr_matrix
+from scipy.sparse import csr_matrix, issparse
 import matplotlib.pyplot as plt
 from matplotlib.collections import LineCollection
-from itertools import combinations
+from itertools import combinations, permutations
 from fastcluster import linkage
 
 
 EPS = np.finfo(float).eps
 
+# State index of NA features in the integer-coded feature matrix (see encode_state_indices)
+NA_STATE = -1
+
 FAST_DIRICHLET = True
 if FAST_DIRICHLET:
     def dirichlet_pdf(x, alpha): return np.exp(stats.dirichlet._logpdf(x, alpha))
@@ -77,6 +84,173 @@ def compute_distance(a, b):
     return dist
 
 
+def euclidean_distances(a, b):
+    """Compute the Euclidean distances between pairs of points.
+
+    Args:
+        a (np.array): The x and y coordinates of the first point of each pair.
+            shape: (n_pairs, 2)
+        b (np.array): The x and y coordinates of the second point of each pair.
+            shape: (n_pairs, 2)
+
+    Returns:
+        np.array: The distance between the points of each pair.
+            shape: (n_pairs)
+    """
+    return np.linalg.norm(a - b, axis=-1)
+
+
+class DistanceProvider(object):
+    """Provides the distances between the sites of a network. Distances are computed on demand
+    for the pairs or the subsets of sites that are needed, instead of storing the dense matrix of
+    all distances (n_sites x n_sites). Distance matrices of subsets are kept in a small
+    least-recently-used cache.
+
+    Attributes:
+        points (np.array): The coordinates of the sites used by the metric.
+            shape: (n_sites, 2)
+        metric (callable): Computes the distances between pairs of points (see euclidean_distances).
+        metric_name (str): The name of the metric.
+        dist_mat (np.array): A precomputed matrix of all distances (None: computed on demand).
+            shape: (n_sites, n_sites)
+        max_bytes (int): The memory budget of the cache.
+    """
+
+    def __init__(self, points, metric=euclidean_distances, dist_mat=None, max_bytes=2**25):
+        self.points = np.asarray(points, dtype=float)
+        self.metric = metric
+        self.metric_name = metric.__name__
+        self.dist_mat = dist_mat
+        self.n = len(self.points)
+
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self.cache = OrderedDict()
+
+    @classmethod
+    def from_matrix(cls, dist_mat):
+        """Provide the distances of a precomputed (dense) distance matrix.
+
+        Args:
+            dist_mat (np.array): The distances between all sites.
+                shape: (n_sites, n_sites)
+        Returns:
+            DistanceProvider: the distances
+        """
+        dist_mat = np.asarray(dist_mat)
+        provider = cls(np.empty((dist_mat.shape[0], 0)), dist_mat=dist_mat)
+        provider.metric_name = 'precomputed'
+        return provider
+
+    def pairs(self, i, j):
+        """The distances between pairs of sites (the indices are broadcast against each other).
+
+        Args:
+            i (np.array): The index of the first site of each pair.
+            j (np.array): The index of the second site of each pair.
+        Returns:
+            np.array: The distance of each pair.
+        """
+        i, j = np.broadcast_arrays(np.asarray(i, dtype=int), np.asarray(j, dtype=int))
+        if self.dist_mat is not None:
+            return self.dist_mat[i, j]
+        if i.size == 0:
+            return np.zeros(i.shape)
+        return self.metric(self.points[i.ravel()], self.points[j.ravel()]).reshape(i.shape)
+
+    def submatrix(self, rows, cols=None):
+        """The matrix of distances between two subsets of sites. Distance matrices within a single
+        subset (cols=None) are cached.
+
+        Args:
+            rows (np.array): The indices of the sites in the rows.
+            cols (np.array): The indices of the sites in the columns (None: the same as rows).
+        Returns:
+            np.array: The distances between the sites.
+                shape: (len(rows), len(cols))
+        """
+        rows = np.asarray(rows, dtype=int)
+        if cols is not None:
+            return self.pairs(rows[:, np.newaxis], np.asarray(cols, dtype=int)[np.newaxis, :])
+
+        key = rows.tobytes()
+        distances = self.cache.get(key)
+        if distances is not None:
+            self.cache.move_to_end(key)
+            return distances
+
+        distances = self.pairs(rows[:, np.newaxis], rows[np.newaxis, :])
+        if distances.nbytes <= self.max_bytes:
+            self.cache[key] = distances
+            self.n_bytes += distances.nbytes
+            while self.n_bytes > self.max_bytes:
+                _, evicted = self.cache.popitem(last=False)
+                self.n_bytes -= evicted.nbytes
+
+        return distances
+
+    def sparse(self, graph, sites=None):
+        """The distances along the edges of a sparse graph (e.g. a Delaunay triangulation), as a
+        sparse matrix with the same structure as the graph.
+
+        Args:
+            graph (csr_matrix): The edges of the graph.
+                shape: (n_sites, n_sites) or (len(sites), len(sites))
+            sites (np.array): The sites represented by the nodes of the graph (None: all sites).
+        Returns:
+            csr_matrix: The sparse graph weighted by distance.
+        """
+        graph = csr_matrix(graph)
+        i, j = graph.nonzero()
+        if sites is not None:
+            i, j = sites[i], sites[j]
+        weighted = csr_matrix((self.pairs(i, j), graph.nonzero()), shape=graph.shape)
+        weighted.eliminate_zeros()
+        return weighted
+
+    def nearest(self, k, block_size=1024):
+        """The k nearest neighbours of each site. The distances are computed in blocks of sites, such
+        that the matrix of all distances is never held in memory.
+
+        Args:
+            k (int): The number of neighbours.
+            block_size (int): The number of sites per block.
+        Returns:
+            np.array: The indices of the k nearest neighbours of each site (in no particular order).
+                shape: (n_sites, k)
+        """
+        nearest = np.empty((self.n, k), dtype=int)
+        all_sites = np.arange(self.n)
+        for start in range(0, self.n, block_size):
+            block = all_sites[start:start + block_size]
+            distances = np.array(self.submatrix(block, all_sites), dtype=float)
+            distances[np.arange(len(block)), block] = np.inf
+            nearest[block] = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        return nearest
+
+    def dense(self, block_size=1024):
+        """The dense matrix of all distances, computed in blocks of sites. Distances are symmetric,
+        so only the upper triangle is computed and mirrored.
+
+        Args:
+            block_size (int): The number of sites per block.
+        Returns:
+            np.array: The distances between all sites.
+                shape: (n_sites, n_sites)
+        """
+        if self.dist_mat is not None:
+            return self.dist_mat
+        dist_mat = np.empty((self.n, self.n))
+        all_sites = np.arange(self.n)
+        for start in range(0, self.n, block_size):
+            block = all_sites[start:start + block_size]
+            dist_mat[block, start:] = self.submatrix(block, all_sites[start:])
+
+        lower = np.tril_indices(self.n, -1)
+        dist_mat[lower] = dist_mat.T[lower]
+        return dist_mat
+
+
 def dump(data, path):
     """Dump the given data to the given path (using pickle)."""
     with open(path, 'wb') as dump_file:
@@ -90,6 +264,64 @@ def load_from(path):
         return pickle.load(dump_file)
 
 
+def content_hash(*objects):
+    """Compute a hash of the content of (nested) dicts, lists and tuples of numpy arrays, sparse
+    matrices and scalars. Equal content gives the same hash in every session.
+
+    Args:
+        objects: The objects to hash.
+
+    Returns:
+        str: The hexadecimal sha256 hash.
+    """
+    h = hashlib.sha256()
+
+    def update(obj):
+        if isinstance(obj, dict):
+            h.update(b'{')
+            for key in sorted(obj, key=str):
+                update(key)
+                update(obj[key])
+            h.update(b'}')
+        elif isinstance(obj, (list, tuple)):
+            h.update(b'[')
+            for item in obj:
+                update(item)
+            h.update(b']')
+        elif issparse(obj):
+            obj = obj.tocsr()
+            update(['sparse', obj.shape, obj.data, obj.indices, obj.indptr])
+        elif isinstance(obj, np.ndarray):
+            if obj.dtype == object:
+                update(obj.tolist())
+            else:
+                h.update(repr((obj.dtype.str, obj.shape)).encode())
+                h.update(np.ascontiguousarray(obj).tobytes())
+        else:
+            h.update(repr(obj).encode())
+
+    for o in objects:
+        update(o)
+    return h.hexdigest()
+
+
+def file_hash(path, block_size=2**20):
+    """Compute the sha256 hash of the content of a file.
+
+    Args:
+        path (str or Path): The file.
+        block_size (int): Number of bytes read at once.
+
+    Returns:
+        str: The hexadecimal sha256 hash.
+    """
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
 def bounding_box(points):
     """ This function retrieves the bounding box for a set of 2-dimensional input points
 
@@ -127,6 +359,25 @@ def get_neighbours(zone, already_in_zone, adj_mat):
     return neighbours
 
 
+def bitset_changes(bitsets, other_bitsets):
+    """Find the sites where two sets of packed bitsets (e.g. the zones before and after a step) differ.
+    Only the bytes which differ are unpacked.
+
+    Args:
+        bitsets (np.array): packed bitsets (see np.packbits)
+            shape (n_zones, ceil(n_sites / 8))
+        other_bitsets (np.array): packed bitsets to compare to
+            shape (n_zones, ceil(n_sites / 8))
+
+    Returns:
+        np.array: Sorted index-list of the sites which differ in any of the bitsets
+    """
+    diff = np.bitwise_or.reduce(np.bitwise_xor(bitsets, other_bitsets), axis=0)
+    changed_bytes = np.flatnonzero(diff)
+    i_byte, i_bit = np.nonzero(np.unpackbits(diff[changed_bytes]).reshape(-1, 8))
+    return changed_bytes[i_byte] * 8 + i_bit
+
+
 def compute_delaunay(locations):
     """Computes the Delaunay triangulation between a set of point locations
 
@@ -147,6 +398,36 @@ def compute_delaunay(locations):
     return csr_matrix((data, indices, indptr), shape=(n, n))
 
 
+def compute_mst_graph(adj_mat, distances, k_nearest=0):
+    """Computes a sparse graph for the minimum spanning trees of the geo-prior: the edges of the
+    Delaunay triangulation of the network and (optionally) the edges to the k nearest neighbours
+    of each site, weighted by distance
+
+    Args:
+        adj_mat (csr_matrix): the adjacency matrix of the network (Delaunay triangulation)
+            shape (n_sites, n_sites)
+        distances (DistanceProvider or np.array): the distances of the network (or its distance matrix)
+        k_nearest (int): the number of nearest neighbours connected to each site
+    Returns:
+        (csr_matrix) sparse graph weighted by distance
+            shape (n_sites, n_sites)
+    """
+    if not isinstance(distances, DistanceProvider):
+        distances = DistanceProvider.from_matrix(distances)
+    adjacency = csr_matrix(adj_mat, dtype=bool)
+
+    n = distances.n
+    k_nearest = min(k_nearest, n - 1)
+    if k_nearest > 0:
+        nearest = distances.nearest(k_nearest)
+
+        knn = csr_matrix((np.ones(nearest.size, dtype=bool), (np.repeat(np.arange(n), k_nearest), nearest.ravel())),
+                         shape=(n, n))
+        adjacency = adjacency + knn + knn.T
+
+    return distances.sparse(adjacency)
+
+
 def n_smallest_distances(a, n, return_idx: bool):
     """ This function finds the n smallest distances in a distance matrix
 
@@ -198,6 +479,32 @@ def set_experiment_name():
     return now
 
 
+def get_logger(name, log_path, to_screen=False):
+    """Get a logger writing to its own log file (and to the screen), without configuring the
+    global root logger. Independent runs in the same process (or in parallel processes) each use
+    their own logger.
+
+    Args:
+        name (str): The name of the logger.
+        log_path (Path): The path of the log file.
+        to_screen (bool): Print the messages to the screen as well?
+    Returns:
+        logging.Logger: The logger.
+    """
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+
+    if not logger.handlers:
+        file_handler = logging.FileHandler(log_path)
+        file_handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(file_handler)
+        if to_screen:
+            logger.addHandler(logging.StreamHandler())
+
+    return logger
+
+
 def zones_autosimilarity(zones, t):
     """
     This function computes the similarity of consecutive zones in a chain
@@ -273,6 +580,25 @@ def encode_states(features_raw, feature_states):
     return features_bin.astype(bool), state_names, applicable_states, na_number
 
 
+def encode_state_indices(features):
+    """Compact integer-coding of the one-hot encoded features: the index of the state of each site and
+    feature (NA_STATE for NA features). This needs n_states times less memory than the one-hot
+    encoding and the likelihood of a state becomes a lookup ´p[feature, state]´.
+
+    Args:
+        features (np.array): One-hot encoded features.
+            shape: (n_sites, n_features, n_states)
+
+    Returns:
+        np.array: The state index of each site and feature.
+            shape: (n_sites, n_features)
+    """
+    assert features.shape[-1] <= np.iinfo(np.int8).max
+    states = np.argmax(features, axis=-1).astype(np.int8)
+    states[~np.any(features, axis=-1)] = NA_STATE
+    return states
+
+
 def normalize_str(s):
     if pd.isna(s):
         return s
@@ -519,7 +845,7 @@ def counts_to_dirichlet(counts: t.Sequence[t.Sequence[int]], categories: t.Seque
             'uniform': A uniform prior probability over the probability simplex Dir(1,...,1)
             'jeffrey': The Jeffrey's prior Dir(0.5,...,0.5)
             'naught': A natural exponential family prior Dir(0,...,0).
-        outdated_features (IndexSet): Indices of the features where the counts changed
+        outdated_features (np.array): Boolean mask of the features where the counts changed
                                   (i.e. they need to be updated).
     Returns:
         list: a dirichlet distribution derived from pseudocounts
@@ -528,11 +854,11 @@ def counts_to_dirichlet(counts: t.Sequence[t.Sequence[int]], categories: t.Seque
 
     prior_map = {'uniform': 1, 'jeffrey': 0.5, 'naught': 0}
 
-    if outdated_features is None or outdated_features.all:
+    if outdated_features is None or dirichlet is None:
         outdated_features = range(n_features)
         dirichlet = [None] * n_features
     else:
-        assert dirichlet is not None
+        outdated_features = np.flatnonzero(outdated_features)
 
     for feat in outdated_features:
         cat = categories[feat]
@@ -764,6 +1090,57 @@ def collect_row_for_writing(s, samples, data, config, steps_per_sample):
     return row, column_names
 
 
+def best_area_permutation(area_sums, areas, perm):
+    """Find the permutation of the area labels of a sample, which best matches the previous samples.
+
+    Args:
+        area_sums (np.array): How often each site was in each area in the previous (matched) samples.
+            shape: (n_sites, n_areas)
+        areas (np.array): The areas of the sample.
+            shape: (n_sites, n_areas)
+        perm (list): All potential permutations of area labels.
+    Returns:
+        list: The best permutation.
+    """
+    def clustering_agreement(p):
+        """In how many sites does the permutation 'p'
+        match the previous sample?
+        """
+        return np.sum(area_sums * areas[:, p])
+
+    return list(max(perm, key=clustering_agreement))
+
+
+def ground_truth2file(samples, data, config, paths):
+    """
+    Writes the ground truth of simulated data to two text files, one for the parameters and one for the areas.
+
+    Args:
+        samples (dict): samples (including the ground truth)
+        data (Data): object of class data (features, priors, ...)
+        config(dict): config information
+        paths(dict): file path for the ground truth
+    """
+    try:
+        with open(paths['gt'], 'w', newline='') as file:
+            gt, gt_col_names = collect_gt_for_writing(samples=samples, data=data, config=config)
+            writer = csv.DictWriter(file, fieldnames=gt_col_names, delimiter='\t')
+            writer.writeheader()
+            writer.writerow(gt)
+
+    except IOError:
+        print("I/O error")
+
+    try:
+        with open(paths['gt_areas'], 'w', newline='') as file:
+            gt_areas = collect_gt_areas_for_writing(samples=samples)
+            file.write(gt_areas)
+            file.close()
+
+    except IOError:
+        print("I/O error")
+
+
 def samples2file(samples, data, config, paths):
     """
     Writes the MCMC to two text files, one for MCMC parameters and one for areas.
@@ -777,25 +1154,7 @@ def samples2file(samples, data, config, paths):
     print("Writing results to file ...")
     # Write ground truth to file (for simulated data only)
     if data.is_simulated:
-
-        try:
-            with open(paths['gt'], 'w', newline='') as file:
-                gt, gt_col_names = collect_gt_for_writing(samples=samples, data=data, config=config)
-                writer = csv.DictWriter(file, fieldnames=gt_col_names, delimiter='\t')
-                writer.writeheader()
-                writer.writerow(gt)
-
-        except IOError:
-            print("I/O error")
-
-        try:
-            with open(paths['gt_areas'], 'w', newline='') as file:
-                gt_areas = collect_gt_areas_for_writing(samples=samples)
-                file.write(gt_areas)
-                file.close()
-
-        except IOError:
-            print("I/O error")
+        ground_truth2file(samples, data, config, paths)
 
     # Results
     steps_per_sample = float(config['mcmc']['N_STEPS'] / config['mcmc']['N_SAMPLES'])
@@ -828,6 +1187,194 @@ def samples2file(samples, data, config, paths):
         print("I/O error")
 
 
+class SampleWriter(object):
+    """Writes the logged MCMC samples to the parameter and the area file while sampling, such
+    that memory use does not grow with the number of samples. The areas are matched to the
+    previous samples on the fly (as in postprocessing.match_areas) and ranked by their mean posterior
+    when the writer is closed (as in postprocessing.rank_areas).
+
+    Attributes:
+        paths (dict): file path for stats and areas
+        data (Data): object of class data (features, priors, ...)
+        config (dict): config information
+        evaluate_single_zones (callable): returns the likelihood and the prior of each area in a
+            sample alone (None: the single areas are neither evaluated nor ranked)
+        true_zones (np.array): the true areas (simulated data only)
+            shape: (n_zones, n_sites)
+        state (dict): the state of a writer saved in a checkpoint (see get_state): the files are
+            truncated to the state and continued (None: new files are written)
+    """
+
+    def __init__(self, paths, data, config, evaluate_single_zones=None, true_zones=None, state=None):
+        self.paths = paths
+        self.data = data
+        self.config = config
+        self.evaluate_single_zones = evaluate_single_zones
+        self.true_zones = true_zones
+
+        self.steps_per_sample = float(config['mcmc']['N_STEPS'] / config['mcmc']['N_SAMPLES'])
+        self.n_written = 0
+
+        # Running statistics for matching and ranking the areas
+        n_areas = config['model']['N_AREAS']
+        self.permutations = list(permutations(range(n_areas)))
+        self.area_sums = None
+        self.posterior_sums = np.zeros(n_areas)
+
+        if state is None:
+            self.parameters_file = open(paths['parameters'], 'w', newline='')
+            self.areas_file = open(paths['areas'], 'w', newline='')
+            self.parameters_writer = None
+        else:
+            self.set_state(state)
+
+    def get_state(self):
+        """The state of the writer (for a checkpoint): the running statistics and the offset of each file.
+
+        Returns:
+            dict: the state of the writer
+        """
+        self.parameters_file.flush()
+        self.areas_file.flush()
+        return {'n_written': self.n_written,
+                'area_sums': None if self.area_sums is None else self.area_sums.copy(),
+                'posterior_sums': self.posterior_sums.copy(),
+                'parameters_offset': self.parameters_file.tell(),
+                'areas_offset': self.areas_file.tell(),
+                'column_names': None if self.parameters_writer is None else self.parameters_writer.fieldnames}
+
+    def set_state(self, state):
+        """Continue writing from a saved state: samples written after the state was saved are removed.
+
+        Args:
+            state (dict): the state of the writer (see get_state)
+        """
+        self.n_written = state['n_written']
+        self.area_sums = state['area_sums']
+        self.posterior_sums = state['posterior_sums']
+
+        self.parameters_file = open(self.paths['parameters'], 'r+', newline='')
+        self.parameters_file.truncate(state['parameters_offset'])
+        self.parameters_file.seek(state['parameters_offset'])
+        self.areas_file = open(self.paths['areas'], 'r+', newline='')
+        self.areas_file.truncate(state['areas_offset'])
+        self.areas_file.seek(state['areas_offset'])
+
+        self.parameters_writer = None
+        if state['column_names'] is not None:
+            self.parameters_writer = csv.DictWriter(self.parameters_file, fieldnames=state['column_names'],
+                                                    delimiter='\t')
+
+    def write(self, sample, likelihood, prior):
+        """Match the areas of a sample to the previous samples and write it to file.
+
+        Args:
+            sample (Sample): the logged sample
+            likelihood (float): the (log) likelihood of the sample
+            prior (float): the (log) prior of the sample
+        """
+        if self.area_sums is None:
+            self.area_sums = np.zeros(sample.zones.T.shape)
+
+        best_match = best_area_permutation(self.area_sums, sample.zones.T, self.permutations)
+        zones = sample.zones[best_match]
+        self.area_sums += zones.T
+
+        samples = {'sample_zones': [zones],
+                   'sample_weights': [sample.weights],
+                   'sample_p_global': [sample.p_global],
+                   'sample_p_zones': [sample.p_zones[best_match]],
+                   'sample_p_families': [sample.p_families],
+                   'sample_likelihood': [likelihood],
+                   'sample_prior': [prior]}
+        if self.true_zones is not None:
+            samples['true_zones'] = self.true_zones
+
+        if self.evaluate_single_zones is not None:
+            lh_single_zones, prior_single_zones = self.evaluate_single_zones(sample)
+            lh_single_zones = [lh_single_zones[i] for i in best_match]
+            prior_single_zones = [prior_single_zones[i] for i in best_match]
+            posterior_single_zones = [lh + p for lh, p in zip(lh_single_zones, prior_single_zones)]
+            self.posterior_sums += posterior_single_zones
+
+            samples['sample_lh_single_zones'] = [lh_single_zones]
+            samples['sample_prior_single_zones'] = [prior_single_zones]
+            samples['sample_posterior_single_zones'] = [posterior_single_zones]
+
+        row, column_names = collect_row_for_writing(s=0, samples=samples, data=self.data, config=self.config,
+                                                    steps_per_sample=self.steps_per_sample)
+        row['Sample'] = int(self.n_written * self.steps_per_sample)
+
+        if self.parameters_writer is None:
+            self.parameters_writer = csv.DictWriter(self.parameters_file, fieldnames=column_names, delimiter='\t')
+            self.parameters_writer.writeheader()
+        self.parameters_writer.writerow(row)
+        self.areas_file.write(format_area_columns(zones) + '\n')
+
+        self.parameters_file.flush()
+        self.areas_file.flush()
+        self.n_written += 1
+
+    def close(self):
+        """Close the files and rank the areas by their mean posterior."""
+        self.parameters_file.close()
+        self.areas_file.close()
+
+        if self.evaluate_single_zones is None or self.n_written == 0:
+            return
+
+        ranked = np.argsort(-self.posterior_sums / self.n_written)
+        if np.all(ranked == np.arange(len(ranked))):
+            return
+
+        print("Ranking areas ...")
+        self.rank_parameters_file(ranked)
+        self.rank_areas_file(ranked)
+
+    def rank_parameters_file(self, ranked):
+        """Reorder the area-specific columns of the parameter file (one line at a time).
+
+        Args:
+            ranked (np.array): the old index of the area at each rank
+        """
+        def source_column(col_name):
+            """Name of the column, which holds the values of the ranked area 'col_name'."""
+            m = re.fullmatch(r'(size_a)(\d+)', col_name)
+            if m:
+                return m.group(1) + str(ranked[int(m.group(2))])
+            m = re.fullmatch(r'(gamma_a|lh_a|prior_a|post_a)(\d+)(_.*)?', col_name)
+            if m:
+                return m.group(1) + str(ranked[int(m.group(2)) - 1] + 1) + (m.group(3) or '')
+            return col_name
+
+        path = self.paths['parameters']
+        tmp_path = str(path) + '.tmp'
+        with open(path, 'r', newline='') as file_in, open(tmp_path, 'w', newline='') as file_out:
+            reader = csv.reader(file_in, delimiter='\t')
+            writer = csv.writer(file_out, delimiter='\t')
+
+            column_names = next(reader)
+            columns = [column_names.index(source_column(c)) for c in column_names]
+            writer.writerow(column_names)
+            for row in reader:
+                writer.writerow([row[i] for i in columns])
+        os.replace(tmp_path, path)
+
+    def rank_areas_file(self, ranked):
+        """Reorder the areas in the area file (one line at a time).
+
+        Args:
+            ranked (np.array): the old index of the area at each rank
+        """
+        path = self.paths['areas']
+        tmp_path = str(path) + '.tmp'
+        with open(path, 'r', newline='') as file_in, open(tmp_path, 'w', newline='') as file_out:
+            for line in file_in:
+                areas = line.rstrip('\n').split('\t')
+                file_out.write('\t'.join(areas[r] for r in ranked) + '\n')
+        os.replace(tmp_path, path)
+
+
 def linear_rescale(value, old_min, old_max, new_min, new_max):
     """
     Function to linear rescale a number to a new range
@@ -84,11 +84,11 @@ if __name__ == '__main__':
         for run in range(exp.config['mcmc']['N_RUNS']):
 
             # 4. Sample from posterior
-            mc.sample()
+            mc.sample(run=run)
 
             # 5. Evaluate ground truth
             mc.eval_ground_truth()
 
             # 6. Log sampling statistics and save samples to file
             mc.log_statistics()
-            mc.save_samples(run=run)
+            mc.save_samples()
@@ -1,11 +1,33 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-import numpy as np
+import copy
+import filecmp
+import os
+import pickle
+import random
+import shutil
+import tempfile
+import types
 import unittest
+import warnings
+from unittest import mock
+from pathlib import Path
+
+import numpy as np
 import matplotlib.pyplot as plt
+import pyproj
+from cartopy import geodesic
 
-from sbayes.model import GenerativeLikelihood
-from sbayes.sampling.zone_sampling import Sample
+from sbayes.cli import experiment_for_job, run_job, run_jobs_in_parallel
+from sbayes.experiment_setup import DEFAULT_CONFIG, Experiment
+from sbayes.mcmc_setup import MCMC
+from sbayes.model import (GenerativeLikelihood, GenerativePrior, ZoneCache, compute_likelihood_of_chains,
+                          compute_zone_likelihood, compute_mst_edges, update_mst_edges)
+from sbayes.preprocessing import compute_network, geodesic_distances, read_features_and_network
+from sbayes.sampling.mcmc_generative import ChainPool
+from sbayes.sampling.zone_sampling import Sample, ZoneMCMCGenerative, ZoneMCMCWarmup, ZoneMembership
+from sbayes.util import (NA_STATE, DistanceProvider, SampleWriter, compute_delaunay, compute_mst_graph,
+                         encode_state_indices, get_logger, get_neighbours, load_from)
 
 def binary_encoding(data, n_categories=None):
     if n_categories is None:
@@ -44,6 +66,85 @@ def broadcast_weights(w, n_features):
     return np.repeat([w], n_features, axis=0)
 
 
+def generate_sampler(operators, n_sites=40, n_features=6, n_categories=3, inheritance=True, n_chains=1,
+                     sampler_class=ZoneMCMCGenerative, **kwargs):
+    locations = np.random.uniform(0, 100, size=(n_sites, 2))
+    network = {'adj_mat': compute_delaunay(locations), 'locations': locations,
+               'dist_mat': np.linalg.norm(locations[:, None] - locations, axis=-1)}
+    features = generate_features((n_sites, n_features), n_categories)
+    families = np.zeros((2, n_sites), dtype=bool)
+    families[0, :10] = True
+    families[1, 25:35] = True
+    prior = {'geo': {'type': 'cost_based', 'scale': 20., 'graph': None}, 'weights': {'type': 'uniform'},
+             'universal': {'type': 'uniform'}, 'contact': {'type': 'uniform'}, 'inheritance': {'type': 'uniform'}}
+
+    operators = {op: 1 / len(operators) for op in operators}
+    kwargs.setdefault('max_size', 10)
+    kwargs.setdefault('p_grow_connected', 0.85)
+    return sampler_class(network=network, features=features, min_size=3,
+                         var_proposal={'weights': 20, 'universal': 30, 'contact': 10, 'inheritance': 10},
+                         initial_sample=Sample(None, None, None, None, None),
+                         initial_size=5, operators=operators, inheritance=inheritance,
+                         families=families if inheritance else None, prior=prior, n_zones=2,
+                         n_chains=n_chains, **kwargs)
+
+
+def evaluate_from_scratch(sampler, sample):
+    sample = sample.copy()
+    sample.everything_changed()
+    likelihood = GenerativeLikelihood(data=sampler.states, families=sampler.families,
+                                      inheritance=sampler.inheritance)(sample)
+    prior = GenerativePrior()(sample=sample, inheritance=sampler.inheritance, geo_prior_meta=sampler.geo_prior,
+                              prior_weights_meta=sampler.prior_weights, prior_p_global_meta=sampler.prior_p_global,
+                              prior_p_zones_meta=sampler.prior_p_zones,
+                              prior_p_families_meta=sampler.prior_p_families, network=sampler.network)
+    return likelihood, prior
+
+
+def generate_sample_writer(sampler, paths, n_steps, n_samples, state=None):
+    n_features = sampler.features.shape[1]
+    data = types.SimpleNamespace(feature_names={'external': ['f%i' % f for f in range(n_features)]},
+                                 state_names={'external': [['a', 'b', 'c']] * n_features},
+                                 family_names={'external': ['fam1', 'fam2']},
+                                 is_simulated=False)
+    config = {'mcmc': {'N_STEPS': n_steps, 'N_SAMPLES': n_samples},
+              'model': {'N_AREAS': sampler.n_zones, 'INHERITANCE': sampler.inheritance}}
+    return SampleWriter(paths, data, config, state=state)
+
+
+def record_job(experiment, data, run, n_areas=None, resume=False):
+    """Stands in for cli.run_job: records the process and the number of areas of the job."""
+    if n_areas is not None:
+        experiment = experiment_for_job(experiment, n_areas)
+    with open(experiment.path_results / ('job_%i.txt' % run), 'w') as job_file:
+        job_file.write('%i %i' % (os.getpid(), experiment.config['model']['N_AREAS']))
+
+
+def initialize_chain(sampler):
+    sample = sampler.generate_initial_sample()
+    sampler._ll[0] = sampler.likelihood(sample, 0)
+    sampler._prior[0] = sampler.prior(sample, 0)
+    return sample
+
+
+def generate_mcmc(sampler, config, path_results, logger_name):
+    """Set up an MCMC on the data of a (generated) sampler, with 2 areas and inheritance."""
+    n_features = sampler.features.shape[1]
+    network = dict(sampler.network, distances=DistanceProvider(sampler.network['locations'],
+                                                               dist_mat=sampler.network['dist_mat']))
+    data = types.SimpleNamespace(network=network, features=sampler.features, families=sampler.families,
+                                 feature_names={'external': ['f%i' % f for f in range(n_features)]},
+                                 state_names={'external': [['a', 'b', 'c']] * n_features},
+                                 family_names={'external': ['fam1', 'fam2']},
+                                 is_simulated=False)
+
+    config['model'].update({'N_AREAS': 2, 'INHERITANCE': True, 'MAX_M': 10})
+    config['mcmc']['STEPS'].update({'inheritance': 0.1})
+    experiment = types.SimpleNamespace(config=config, path_results=path_results,
+                                       logger=get_logger(logger_name, path_results / 'test.log'))
+    return MCMC(data=data, experiment=experiment)
+
+
 class TestLikelihood(unittest.TestCase):
 
     def test_family_area_overlap(self):
@@ -154,5 +255,865 @@ class TestLikelihood(unittest.TestCase):
         # self.assertTrue(lh_noverlap < lh_overlap)
 
 
+class TestZoneLikelihood(unittest.TestCase):
+
+    def test_batched_update_matches_full_evaluation(self):
+        N_SITES = 20
+        N_FEATURES = 6
+        N_CATEGORIES = 3
+
+        features = generate_features((N_SITES, N_FEATURES), N_CATEGORIES)
+        zones = np.zeros((2, N_SITES), dtype=bool)
+        zones[0, :5] = True
+        zones[1, 10:16] = True
+        p_zones = np.random.dirichlet(np.ones(N_CATEGORIES), size=(2, N_FEATURES))
+
+        lh = compute_zone_likelihood(features, zones, p_zones=p_zones)
+
+        # Change one feature in zone 0 and the membership of zone 1
+        p_zones[0, 2] = np.random.dirichlet(np.ones(N_CATEGORIES))
+        zones[1, 16] = True
+        outdated_indices = np.zeros((2, N_FEATURES), dtype=bool)
+        outdated_indices[0, 2] = True
+        outdated_zones = np.array([False, True])
+
+        lh = compute_zone_likelihood(features, zones, p_zones=p_zones, outdated_indices=outdated_indices,
+                                     outdated_zones=outdated_zones, cached_lh=lh)
+
+        for z in range(2):
+            for i_f in range(N_FEATURES):
+                lh_direct = features[zones[z], i_f, :].dot(p_zones[z, i_f, :])
+                np.testing.assert_allclose(lh[zones[z], i_f], lh_direct)
+
+    def test_state_indices_match_one_hot_encoding(self):
+        N_SITES = 20
+        N_FEATURES = 6
+        N_CATEGORIES = 3
+
+        features = generate_features((N_SITES, N_FEATURES), N_CATEGORIES)
+        features[3, 1, :] = False
+        features[12, 4, :] = False
+        zones = np.zeros((2, N_SITES), dtype=bool)
+        zones[0, :5] = True
+        zones[1, 10:16] = True
+        p_zones = np.random.dirichlet(np.ones(N_CATEGORIES), size=(2, N_FEATURES))
+
+        states = encode_state_indices(features)
+        self.assertEqual(states.dtype, np.int8)
+        self.assertEqual(states[3, 1], NA_STATE)
+
+        np.testing.assert_array_equal(compute_zone_likelihood(states, zones, p_zones=p_zones),
+                                      compute_zone_likelihood(features, zones, p_zones=p_zones))
+
+
+class TestIncrementalLikelihood(unittest.TestCase):
+
+    def test_single_site_area_move(self):
+        N_SITES = 30
+        N_FEATURES = 8
+        N_CATEGORIES = 3
+
+        features = generate_features((N_SITES, N_FEATURES), N_CATEGORIES)
+        families = np.zeros((1, N_SITES), dtype=bool)
+        families[0, 20:] = True
+        areas = np.zeros((1, N_SITES), dtype=bool)
+        areas[0, 5:12] = True
+
+        p_global = np.random.dirichlet(np.ones(N_CATEGORIES), size=(1, N_FEATURES))
+        p_areas = np.random.dirichlet(np.ones(N_CATEGORIES), size=(1, N_FEATURES))
+        p_families = np.random.dirichlet(np.ones(N_CATEGORIES), size=(1, N_FEATURES))
+        weights = broadcast_weights([0.4, 0.3, 0.3], N_FEATURES)
+
+        likelihood = GenerativeLikelihood(features, inheritance=True, families=families)
+        sample = Sample(areas, weights, p_global=p_global, p_zones=p_areas, p_families=p_families)
+        likelihood(sample)
+
+        # Grow the area by one site and shrink it by another
+        sample.propose('zones', (0, 12), True, changed=0)
+        sample.propose('zones', (0, 5), False, changed=0)
+        sample.accept_proposal()
+        lh_incremental = likelihood(sample)
+
+        sample.everything_changed()
+        lh_full = GenerativeLikelihood(features, inheritance=True, families=families)(sample)
+        self.assertAlmostEqual(lh_incremental, lh_full)
+
+    def test_chains_evaluated_together(self):
+        N_SITES = 30
+        N_FEATURES = 8
+        N_CATEGORIES = 3
+
+        features = generate_features((N_SITES, N_FEATURES), N_CATEGORIES)
+        areas = np.zeros((1, N_SITES), dtype=bool)
+        areas[0, 5:12] = True
+
+        likelihoods, samples = [], []
+        for _ in range(2):
+            p_global = np.random.dirichlet(np.ones(N_CATEGORIES), size=(1, N_FEATURES))
+            p_areas = np.random.dirichlet(np.ones(N_CATEGORIES), size=(1, N_FEATURES))
+            weights = broadcast_weights([0.5, 0.5], N_FEATURES)
+            sample = Sample(areas.copy(), weights, p_global=p_global, p_zones=p_areas, p_families=None)
+            likelihoods.append(GenerativeLikelihood(features, inheritance=False, families=None))
+            samples.append(sample)
+        compute_likelihood_of_chains(likelihoods, samples)
+
+        # One chain changes its area, the other one the weights of a feature
+        samples[0].propose('zones', (0, 12), True, changed=0)
+        samples[1].propose('weights', 3, [0.2, 0.8], changed=3)
+        lh_chains = compute_likelihood_of_chains(likelihoods, samples)
+
+        for sample, lh in zip(samples, lh_chains):
+            sample.everything_changed()
+            lh_full = GenerativeLikelihood(features, inheritance=False, families=None)(sample)
+            self.assertAlmostEqual(lh, lh_full)
+
+
+class TestProposal(unittest.TestCase):
+
+    def test_rejected_proposal_is_reverted(self):
+        N_SITES = 30
+        N_FEATURES = 8
+        N_CATEGORIES = 3
+
+        features = generate_features((N_SITES, N_FEATURES), N_CATEGORIES)
+        areas = np.zeros((1, N_SITES), dtype=bool)
+        areas[0, 5:12] = True
+
+        p_global = np.random.dirichlet(np.ones(N_CATEGORIES), size=(1, N_FEATURES))
+        p_areas = np.random.dirichlet(np.ones(N_CATEGORIES), size=(1, N_FEATURES))
+        weights = broadcast_weights([0.5, 0.5], N_FEATURES)
+
+        likelihood = GenerativeLikelihood(features, inheritance=False, families=None)
+        sample = Sample(areas, weights, p_global=p_global, p_zones=p_areas, p_families=None)
+        lh_before = likelihood(sample)
+        areas_before = sample.zones.copy()
+        p_areas_before = sample.p_zones.copy()
+
+        # Propose a new area and new area probabilities, evaluate and reject them
+        sample.propose('zones', (0, 20), True, changed=0)
+        sample.propose('p_zones', (0, 3), [0.2, 0.3, 0.5], changed=(0, 3))
+        likelihood(sample)
+        sample.reject_proposal()
+
+        np.testing.assert_array_equal(sample.zones, areas_before)
+        np.testing.assert_array_equal(sample.p_zones, p_areas_before)
+        self.assertAlmostEqual(likelihood(sample), lh_before)
+
+    def test_membership_follows_proposals(self):
+        N_SITES = 30
+        N_FEATURES = 8
+        N_CATEGORIES = 3
+
+        areas = np.zeros((2, N_SITES), dtype=bool)
+        areas[0, 5:12] = True
+        areas[1, 20:25] = True
+
+        p_global = np.random.dirichlet(np.ones(N_CATEGORIES), size=(1, N_FEATURES))
+        p_areas = np.random.dirichlet(np.ones(N_CATEGORIES), size=(2, N_FEATURES))
+        weights = broadcast_weights([0.5, 0.5], N_FEATURES)
+        sample = Sample(areas, weights, p_global=p_global, p_zones=p_areas, p_families=None)
+        adj_mat = compute_delaunay(np.random.uniform(0, 100, size=(N_SITES, 2)))
+        membership = sample.membership
+        membership.track_neighbours(adj_mat)
+
+        sample.propose('zones', (0, 12), True, changed=0)
+        sample.propose('zones', (1, 20), False, changed=1)
+        sample.accept_proposal()
+        sample.propose('zones', (0, 5), False, changed=0)
+        sample.reject_proposal()
+
+        expected = ZoneMembership(sample.zones.copy())
+        for z in range(2):
+            np.testing.assert_array_equal(membership.sites[z], expected.sites[z])
+        np.testing.assert_array_equal(membership.bitsets, expected.bitsets)
+        np.testing.assert_array_equal(membership.sizes, expected.sizes)
+        np.testing.assert_array_equal(membership.occupied, expected.occupied)
+        self.assertEqual(membership.n_occupied, expected.n_occupied)
+
+        # The incrementally updated frontiers match the neighbourhoods computed from scratch
+        for z in range(2):
+            neighbours = get_neighbours(sample.zones[z], expected.occupied, adj_mat)
+            np.testing.assert_array_equal(membership.get_neighbours(z, adj_mat), np.flatnonzero(neighbours))
+
+
+class TestChainPool(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_workers_with_all_start_methods(self):
+        for start_method in ['fork', 'spawn']:
+            sampler = generate_sampler(['grow_zone', 'shrink_zone', 'alter_weights', 'alter_p_zones'], n_chains=4)
+            paths = {'parameters': self.directory / (start_method + '_stats.txt'),
+                     'areas': self.directory / (start_method + '_areas.txt')}
+            sample_writer = generate_sample_writer(sampler, paths, n_steps=10, n_samples=1)
+            sampler.sample_writer = sample_writer
+
+            # The sample writer (with open files) is not sent to the workers
+            pool = ChainPool(sampler, 2, start_method=start_method)
+            try:
+                ll, prior = pool.initialize(sampler._ll, sampler._prior)
+                ll, prior, logged_sample = pool.run(n_steps=10, chain_temperature=sampler.chain_temperature,
+                                                    logged_chain=1)
+            finally:
+                worker_statistics = pool.close()
+            self.assertIs(sampler.sample_writer, sample_writer)
+            self.assertEqual(len(worker_statistics), 2)
+
+            # The workers report the likelihood and prior of the current sample of their chains
+            likelihood, prior_full = evaluate_from_scratch(sampler, logged_sample)
+            self.assertAlmostEqual(ll[1], likelihood)
+            self.assertAlmostEqual(prior[1], prior_full)
+
+            sample_writer.write(logged_sample, likelihood=ll[1], prior=prior[1])
+            sample_writer.close()
+            with open(paths['areas']) as areas_file:
+                self.assertEqual(len(areas_file.readlines()), 1)
+
+
+class TestTemperedChains(unittest.TestCase):
+
+    def test_swap_is_accepted_with_tempered_ratio(self):
+        sampler = generate_sampler(['alter_weights'], n_chains=3, mc3=True, chain_swaps=1, max_temperature=4.)
+        sampler._ll[:] = [-120., -100., -90.]
+        np.testing.assert_allclose(sampler.temperatures, [1., 2., 4.])
+
+        # Swap the chains at the first and second temperature: (1/T_0 - 1/T_1) * (ll_1 - ll_0)
+        log_ratio = (1. / 1. - 1. / 2.) * (-100. - -120.)
+        self.assertGreater(log_ratio, 0)
+        with mock.patch('numpy.random.randint', return_value=0):
+            sampler.swap_chains()
+        self.assertEqual(sampler.chain_idx, [1, 0, 2])
+        np.testing.assert_array_equal(sampler.chain_temperature, [2., 1., 4.])
+
+        # Swap the chains at the second and third temperature (chain 0 at T_1, chain 2 at T_2)
+        sampler._ll[2] = -130.
+        log_ratio = (1. / 2. - 1. / 4.) * (-130. - -120.)
+        for u, accepted in [(np.exp(log_ratio) * 0.99, True), (np.exp(log_ratio) * 1.01, False)]:
+            sampler.chain_idx = [1, 0, 2]
+            with mock.patch('numpy.random.randint', return_value=1), \
+                    mock.patch('random.random', return_value=u):
+                sampler.swap_chains()
+            self.assertEqual(sampler.chain_idx, [1, 2, 0] if accepted else [1, 0, 2])
+
+    def test_adapted_ladder_stays_monotone(self):
+        for max_temperature in [1.5, 10.]:
+            sampler = generate_sampler(['alter_weights'], n_chains=5, mc3=True, chain_swaps=1,
+                                       max_temperature=max_temperature, adapt_temperatures=True)
+            for _ in range(1000):
+                sampler._ll[:] = np.random.normal(-100, 20, size=5)
+                sampler.swap_chains()
+
+                self.assertEqual(sampler.temperatures[0], 1.)
+                self.assertTrue(np.all(np.diff(sampler.temperatures) > 0))
+                np.testing.assert_array_equal(sampler.chain_temperature[sampler.chain_idx], sampler.temperatures)
+
+        # A flat ladder (e.g. from equal temperatures) does not break the adaptation
+        sampler.temperatures = np.ones(5)
+        sampler.adapt_temperature_spacing(0, p_swap=1.)
+        self.assertTrue(np.all(np.isfinite(sampler.temperatures)))
+        self.assertTrue(np.all(np.diff(sampler.temperatures) > 0))
+
+
+class TestWarmUp(unittest.TestCase):
+
+    N_CHAINS = 4
+    OPERATORS = ['grow_zone', 'shrink_zone', 'swap_zone', 'alter_weights', 'alter_p_global', 'alter_p_zones',
+                 'alter_p_families']
+
+    def generate_warmup(self, n_workers):
+        np.random.seed(1)
+        return generate_sampler(self.OPERATORS, n_chains=self.N_CHAINS, n_workers=n_workers,
+                                sampler_class=ZoneMCMCWarmup, max_size=[10, 12, 14, 16],
+                                p_grow_connected=[0.7, 0.8, 0.9, 1.])
+
+    def test_parallel_warm_up_returns_best_sample(self):
+        warmup = self.generate_warmup(n_workers=2)
+        np.random.seed(2)
+        best_sample = warmup.generate_samples(n_steps=0, n_samples=0, warm_up=True, warm_up_steps=100)
+
+        # The best sample is a valid sample with the highest posterior of all chains
+        self.assertEqual(best_sample.zones.shape, (2, 40))
+        self.assertTrue(np.all(best_sample.zones.sum(axis=1) >= 3))
+        self.assertFalse(np.any(best_sample.zones.sum(axis=0) > 1))
+        likelihood, prior = evaluate_from_scratch(warmup, best_sample)
+        self.assertAlmostEqual(likelihood + prior, np.max(warmup._ll + warmup._prior))
+
+    def test_single_worker_matches_sequential_warm_up(self):
+        warmup = self.generate_warmup(n_workers=1)
+        np.random.seed(2)
+        best_sample_parallel = warmup.warm_up_parallel(warm_up_steps=100)
+
+        # The worker seeds its random number streams with a seed drawn from np.random
+        warmup = self.generate_warmup(n_workers=1)
+        np.random.seed(2)
+        seed = int(np.random.randint(2**31, size=1)[0])
+        random.seed(seed)
+        np.random.seed(seed)
+        best_sample = warmup.generate_samples(n_steps=0, n_samples=0, warm_up=True, warm_up_steps=100)
+
+        np.testing.assert_array_equal(best_sample_parallel.zones, best_sample.zones)
+        np.testing.assert_allclose(best_sample_parallel.weights, best_sample.weights)
+        np.testing.assert_allclose(best_sample_parallel.p_zones, best_sample.p_zones)
+
+
+class TestParallelJobs(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def generate_experiment(self, n_areas, file_info):
+        experiment = Experiment(experiment_name='parallel_jobs')
+        experiment.config = {'model': {'N_AREAS': n_areas}, 'results': {'FILE_INFO': file_info}}
+        experiment.path_results = self.directory
+        experiment.logger = get_logger('sbayes.' + self.id(), self.directory / 'experiment.log')
+        return experiment
+
+    def test_grid_jobs_write_to_separate_directories(self):
+        experiment = self.generate_experiment('tbd', file_info='r')
+        jobs = [(run, n) for run in range(2) for n in [1, 2, 3]]
+        with mock.patch('sbayes.cli.run_job', record_job):
+            run_jobs_in_parallel(experiment, None, jobs, max_parallel=2)
+
+        for run, n in jobs:
+            with open(self.directory / ('n%i' % n) / ('job_%i.txt' % run)) as job_file:
+                pid, n_areas = map(int, job_file.read().split())
+            self.assertNotEqual(pid, os.getpid())
+            self.assertEqual(n_areas, n)
+
+        # The jobs work on copies of the config
+        self.assertEqual(experiment.config['model']['N_AREAS'], 'tbd')
+
+    def test_runs_write_to_the_results_directory(self):
+        experiment = self.generate_experiment(2, file_info='n')
+        with mock.patch('sbayes.cli.run_job', record_job):
+            run_jobs_in_parallel(experiment, None, [(0, None), (1, None)], max_parallel=2)
+        for run in range(2):
+            self.assertTrue((self.directory / ('job_%i.txt' % run)).exists())
+
+        # With the number of areas in the file names, grid jobs share the results directory
+        job_experiment = experiment_for_job(experiment, 3)
+        self.assertEqual(job_experiment.path_results, self.directory)
+        self.assertEqual(job_experiment.config['model']['N_AREAS'], 3)
+        self.assertEqual(experiment.config['model']['N_AREAS'], 2)
+
+    def test_job_logs_to_its_own_file(self):
+        experiment = self.generate_experiment('tbd', file_info='r')
+        with mock.patch('sbayes.cli.run_experiment') as run_experiment:
+            run_job(experiment, None, run=1, n_areas=4)
+
+        job_experiment, _, run = run_experiment.call_args[0]
+        self.assertEqual(run, 1)
+        self.assertEqual(job_experiment.path_results, self.directory / 'n4')
+        self.assertEqual(run_experiment.call_args[1]['logger'].handlers[0].baseFilename,
+                         str(self.directory / 'n4' / 'experiment_n4_1.log'))
+
+
+class TestResultFiles(unittest.TestCase):
+
+    N_STEPS = 40
+    N_SAMPLES = 4
+
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def generate_mcmc(self, stream_samples):
+        config = copy.deepcopy(DEFAULT_CONFIG)
+        config['mcmc'].update({'N_STEPS': self.N_STEPS, 'N_SAMPLES': self.N_SAMPLES, 'N_CHAINS': 1})
+        config['results'] = {'FILE_INFO': 'n', 'STREAM_SAMPLES': stream_samples}
+        return generate_mcmc(generate_sampler(['alter_weights']), config, self.directory,
+                             logger_name='sbayes.' + self.id())
+
+    def test_samples_are_written_to_the_files_of_the_run(self):
+        for stream_samples in [True, False]:
+            for run in [0, 1]:
+                mcmc = self.generate_mcmc(stream_samples)
+                mcmc.sample(run=run)
+                mcmc.save_samples()
+
+            # Each run has its own files, with all samples of the run
+            areas = []
+            for run in [0, 1]:
+                paths = mcmc.get_paths(run)
+                with open(paths['parameters']) as parameters_file:
+                    self.assertEqual(len(parameters_file.readlines()), self.N_SAMPLES + 1)
+                with open(paths['areas']) as areas_file:
+                    areas.append(areas_file.readlines())
+                self.assertEqual(len(areas[run]), self.N_SAMPLES)
+            self.assertNotEqual(areas[0], areas[1])
+            self.assertFalse((self.directory / 'n2' / 'stats_n2_2.txt').exists())
+
+
+class TestWarmUpCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def generate_mcmc(self, sampler, **warm_up):
+        config = copy.deepcopy(DEFAULT_CONFIG)
+        config['mcmc'].update({'N_CHAINS': 1, 'N_WORKERS': 1})
+        config['mcmc']['WARM_UP'].update({'N_WARM_UP_STEPS': 20, 'N_WARM_UP_CHAINS': 2, 'CACHE': True})
+        config['mcmc']['WARM_UP'].update(warm_up)
+        config['results'] = {'FILE_INFO': 'n', 'STREAM_SAMPLES': True}
+        return generate_mcmc(sampler, config, self.directory, logger_name='sbayes.' + self.id())
+
+    def test_key_depends_on_data_and_settings(self):
+        np.random.seed(1)
+        sampler = generate_sampler(['alter_weights'])
+        key = self.generate_mcmc(sampler).warm_up_cache_key()
+
+        # Same data and settings (and settings which do not affect the warm-up): same key
+        self.assertEqual(self.generate_mcmc(sampler).warm_up_cache_key(), key)
+        self.assertEqual(self.generate_mcmc(sampler, INVALIDATE_CACHE=True).warm_up_cache_key(), key)
+
+        self.assertNotEqual(self.generate_mcmc(sampler, N_WARM_UP_STEPS=21).warm_up_cache_key(), key)
+        self.assertNotEqual(self.generate_mcmc(sampler, N_WARM_UP_CHAINS=3).warm_up_cache_key(), key)
+
+        mcmc = self.generate_mcmc(sampler)
+        mcmc.data.features = mcmc.data.features.copy()
+        mcmc.data.features[0] = mcmc.data.features[0, :, ::-1]
+        self.assertNotEqual(mcmc.warm_up_cache_key(), key)
+
+    def test_warm_up_is_loaded_from_the_cache(self):
+        np.random.seed(1)
+        sampler = generate_sampler(['alter_weights'])
+        mcmc = self.generate_mcmc(sampler)
+        mcmc.warm_up()
+        cache_files = list(self.directory.glob('warm_up_*.pkl'))
+        self.assertEqual(len(cache_files), 1)
+
+        # The second warm-up does not run the warm-up chains
+        with mock.patch('sbayes.mcmc_setup.ZoneMCMCWarmup') as warmup_class:
+            cached = self.generate_mcmc(sampler)
+            cached.warm_up()
+        warmup_class.assert_not_called()
+        np.testing.assert_array_equal(cached.sample_from_warm_up.zones, mcmc.sample_from_warm_up.zones)
+        np.testing.assert_array_equal(cached.sample_from_warm_up.weights, mcmc.sample_from_warm_up.weights)
+
+        # ... unless the cache is invalidated, then the new sample replaces the cached one
+        new_sample = mcmc.sample_from_warm_up.copy()
+        new_sample.zones = ~new_sample.zones
+        invalidated = self.generate_mcmc(sampler, INVALIDATE_CACHE=True)
+        with mock.patch.object(ZoneMCMCWarmup, 'generate_samples', return_value=new_sample) as generate_samples:
+            invalidated.warm_up()
+        generate_samples.assert_called_once()
+        self.assertEqual(list(self.directory.glob('warm_up_*.pkl')), cache_files)
+        np.testing.assert_array_equal(load_from(cache_files[0]).zones, new_sample.zones)
+
+
+class TestDataCache(unittest.TestCase):
+
+    N_SITES = 30
+
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+
+        # Features with a varying number of states, missing values and sites without a family
+        np.random.seed(1)
+        feature_states = {'f1': ['a', 'b', ''], 'f2': ['yes', 'no', 'maybe'], 'f3': ['0', '1', '']}
+        self.features_file = self.directory / 'features.csv'
+        with open(self.features_file, 'w') as features_file:
+            features_file.write('id,name,family,x,y,f1,f2,f3\n')
+            for i in range(self.N_SITES):
+                x, y = np.random.uniform(0, 40, size=2)
+                family = ['fam_a', 'fam_b', ''][i % 3]
+                states = [np.random.choice([s for s in states if s] + ['']) for states in feature_states.values()]
+                features_file.write(','.join(['l%i' % i, 'Language %i' % i, family, str(x), str(y)] + states) + '\n')
+        self.feature_states_file = self.directory / 'feature_states.csv'
+        with open(self.feature_states_file, 'w') as feature_states_file:
+            feature_states_file.write(','.join(feature_states) + '\n')
+            for row in zip(*feature_states.values()):
+                feature_states_file.write(','.join(row) + '\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assert_data_equal(self, data, cached_data):
+        (sites, site_names, features, feature_names, state_names, applicable_states,
+         families, family_names, log), network = data
+        (c_sites, c_site_names, c_features, c_feature_names, c_state_names, c_applicable_states,
+         c_families, c_family_names, c_log), c_network = cached_data
+
+        np.testing.assert_array_equal(c_sites['locations'], sites['locations'])
+        self.assertEqual(c_sites['id'], sites['id'])
+        self.assertIsNone(c_sites['cz'])
+        self.assertEqual(list(c_sites['names']), list(sites['names']))
+        self.assertEqual(list(c_site_names['external']), list(site_names['external']))
+        self.assertEqual(c_site_names['internal'], site_names['internal'])
+        np.testing.assert_array_equal(c_features, features)
+        self.assertEqual(c_features.dtype, features.dtype)
+        self.assertEqual(list(c_feature_names['external']), list(feature_names['external']))
+        self.assertEqual(c_feature_names['internal'], feature_names['internal'])
+        self.assertEqual(c_state_names['external'], state_names['external'])
+        self.assertEqual(c_state_names['internal'], state_names['internal'])
+        np.testing.assert_array_equal(c_applicable_states, applicable_states)
+        np.testing.assert_array_equal(c_families, families)
+        self.assertEqual(c_family_names['external'], family_names['external'])
+        self.assertEqual(c_family_names['internal'], family_names['internal'])
+        self.assertTrue(c_log.startswith(log))
+
+        self.assertEqual(c_network['vertices'], network['vertices'])
+        np.testing.assert_array_equal(c_network['edges'], network['edges'])
+        np.testing.assert_array_equal(c_network['locations'], network['locations'])
+        self.assertEqual(list(c_network['names']), list(network['names']))
+        self.assertEqual((c_network['adj_mat'] != network['adj_mat']).nnz, 0)
+        self.assertEqual((c_network['n'], c_network['m']), (network['n'], network['m']))
+        self.assertEqual(c_network['distances'].metric_name, network['distances'].metric_name)
+        np.testing.assert_allclose(c_network['distances'].dense(), network['distances'].dense())
+
+    def test_cached_data_matches_the_csv_files(self):
+        for crs in [None, pyproj.CRS('EPSG:4326')]:
+            data = read_features_and_network(self.features_file, self.feature_states_file, crs=crs, cache=False)
+
+            # The first read writes the cache, the second read loads it
+            with mock.patch('sbayes.preprocessing.load_data_cache') as load:
+                written = read_features_and_network(self.features_file, self.feature_states_file, crs=crs)
+            load.assert_not_called()
+            with mock.patch('sbayes.preprocessing.read_features_from_csv') as read_csv:
+                cached = read_features_and_network(self.features_file, self.feature_states_file, crs=crs)
+            read_csv.assert_not_called()
+
+            self.assert_data_equal(data, written)
+            self.assert_data_equal(data, cached)
+
+        # One cache file per CRS, no partially written files
+        cache_files = sorted(p.name for p in (self.directory / '.sbayes_cache').iterdir())
+        self.assertEqual(len(cache_files), 2)
+        self.assertTrue(all(name.endswith('.npz') for name in cache_files))
+
+    def test_failed_cache_write_is_logged(self):
+        logger = get_logger('sbayes.' + self.id(), self.directory / 'test.log')
+        with mock.patch('sbayes.preprocessing.write_data_cache', side_effect=OSError('disk full')), \
+                self.assertLogs(logger, level='WARNING') as logs:
+            data = read_features_and_network(self.features_file, self.feature_states_file, logger=logger)
+        self.assertIn('disk full', logs.output[0])
+        self.assertEqual(data[1]['n'], self.N_SITES)
+
+
+class TestGeodesicDistances(unittest.TestCase):
+
+    def test_distances_match_cartopy(self):
+        np.random.seed(1)
+        n_pairs = 5000
+        random_points = np.column_stack([np.random.uniform(-180, 180, size=2 * n_pairs),
+                                         np.degrees(np.arcsin(np.random.uniform(-1, 1, size=2 * n_pairs)))])
+        a, b = [random_points[:n_pairs]], [random_points[n_pairs:]]
+
+        # Coincident points
+        a.append(random_points[:100])
+        b.append(random_points[:100])
+
+        # Points on the equator (including nearly antipodal ones) and at or near the poles
+        lon = np.random.uniform(-180, 180, size=(2, 100))
+        a.append(np.column_stack([lon[0], np.zeros(100)]))
+        b.append(np.column_stack([lon[1], np.zeros(100)]))
+        a += [[[0., 0.]], [[10., 0.]], [[0., 90.]], [[0., 90.]], [[30., 89.999]]]
+        b += [[[179.5, 0.]], [[-170.2, 0.]], [[0., -90.]], [[45., 60.]], [[-150., 89.999]]]
+
+        # Nearly antipodal points
+        antipodes = np.column_stack([random_points[:100, 0] - 180, -random_points[:100, 1]])
+        a.append(random_points[:100])
+        b.append(antipodes + np.random.uniform(-0.5, 0.5, size=(100, 2)))
+
+        a, b = np.concatenate(a), np.concatenate(b)
+        distances = geodesic_distances(a, b)
+        expected = np.asarray(geodesic.Geodesic().inverse(a, b))[:, 0]
+        np.testing.assert_allclose(distances, expected, rtol=0, atol=1e-3)
+        np.testing.assert_array_equal(geodesic_distances(a[:1], a[:1]), [0.])
+
+
+class TestGeoPrior(unittest.TestCase):
+
+    def assert_same_tree(self, edges, expected_edges):
+        self.assertEqual(set(map(frozenset, zip(*edges))), set(map(frozenset, zip(*expected_edges))))
+
+    def test_mst_update_matches_recomputation(self):
+        N_SITES = 100
+
+        euclidean_locations = np.random.uniform(0, 100, size=(N_SITES, 2))
+        euclidean_network = {'locations': euclidean_locations, 'distances': DistanceProvider(euclidean_locations)}
+
+        # Geodesic distances of sites spread over the northern hemisphere (longitude, latitude)
+        sites = {'id': list(range(N_SITES)), 'names': [str(i) for i in range(N_SITES)],
+                 'locations': np.column_stack([np.random.uniform(-180, 180, N_SITES),
+                                               np.random.uniform(0, 85, N_SITES)])}
+        geodesic_network = compute_network(sites, crs=pyproj.CRS('EPSG:4326'))
+
+        for network in [euclidean_network, geodesic_network]:
+            zone = np.zeros(N_SITES, dtype=bool)
+            zone[:20] = True
+            edges = compute_mst_edges(zone, network)
+
+            # Add and remove sites: the updated tree is the recomputed tree
+            rng = np.random.RandomState(1)
+            for _ in range(100):
+                new_zone = zone.copy()
+                if rng.random_sample() < 0.5 or np.count_nonzero(zone) <= 5:
+                    new_zone[rng.choice(np.flatnonzero(~zone))] = True
+                else:
+                    new_zone[rng.choice(np.flatnonzero(zone))] = False
+
+                new_edges = update_mst_edges(edges, zone, new_zone, network)
+                if network is euclidean_network and np.count_nonzero(new_zone) > np.count_nonzero(zone):
+                    self.assertIsNotNone(new_edges)
+                if new_edges is None:
+                    new_edges = compute_mst_edges(new_zone, network)
+                self.assert_same_tree(new_edges, compute_mst_edges(new_zone, network))
+                zone, edges = new_zone, new_edges
+
+    def test_mst_on_network_graph(self):
+        N_SITES = 100
+
+        locations = np.random.uniform(0, 100, size=(N_SITES, 2))
+        dist_mat = np.linalg.norm(locations[:, None] - locations, axis=-1)
+        network = {'locations': locations, 'dist_mat': dist_mat}
+        graph = compute_mst_graph(compute_delaunay(locations), dist_mat, k_nearest=3)
+
+        # A compact zone of the 20 sites closest to the first site
+        zone = np.zeros(N_SITES, dtype=bool)
+        zone[np.argsort(dist_mat[0])[:20]] = True
+
+        edges = compute_mst_edges(zone, network, graph=graph)
+        self.assertAlmostEqual(np.sum(dist_mat[edges]), np.sum(dist_mat[compute_mst_edges(zone, network)]))
+
+    def test_distances_on_demand_match_distance_matrix(self):
+        N_SITES = 100
+
+        locations = np.random.uniform(0, 100, size=(N_SITES, 2))
+        dist_mat = np.linalg.norm(locations[:, None] - locations, axis=-1)
+        distances = DistanceProvider(locations, max_bytes=dist_mat.nbytes)
+
+        sites = np.sort(np.random.choice(N_SITES, size=20, replace=False))
+        np.testing.assert_allclose(distances.submatrix(sites), dist_mat[np.ix_(sites, sites)])
+        np.testing.assert_allclose(distances.pairs(sites[:-1], sites[1:]), dist_mat[sites[:-1], sites[1:]])
+
+        # The sparse graphs (Delaunay and k nearest neighbours) are the same as on the dense matrix
+        adj_mat = compute_delaunay(locations)
+        graph = compute_mst_graph(adj_mat, distances, k_nearest=3)
+        self.assertEqual((graph != compute_mst_graph(adj_mat, dist_mat, k_nearest=3)).nnz, 0)
+
+        network = {'locations': locations, 'distances': distances}
+        zone = np.zeros(N_SITES, dtype=bool)
+        zone[sites] = True
+        edges = compute_mst_edges(zone, network)
+        self.assertAlmostEqual(np.sum(dist_mat[edges]),
+                               np.sum(dist_mat[compute_mst_edges(zone, {'locations': locations, 'dist_mat': dist_mat})]))
+
+    def test_dense_distance_matrix_is_computed_once(self):
+        N_SITES = 50
+
+        locations = np.random.uniform(0, 100, size=(N_SITES, 2))
+        sites = {'id': list(range(N_SITES)), 'locations': locations, 'names': [str(i) for i in range(N_SITES)]}
+        network = compute_network(sites)
+        self.assertIsNone(network.distances.dist_mat)
+
+        # The dense matrix is only computed (with a warning) when it is asked for, and then kept
+        with self.assertWarns(UserWarning):
+            dist_mat = network['dist_mat']
+        np.testing.assert_allclose(dist_mat, np.linalg.norm(locations[:, None] - locations, axis=-1))
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            self.assertIs(network['dist_mat'], dist_mat)
+
+
+class TestZoneCache(unittest.TestCase):
+
+    def test_least_recently_used_zone_is_evicted(self):
+        zones = np.eye(3, 16, dtype=bool)
+        values = [np.full(10, i, dtype=float) for i in range(3)]
+
+        # The budget holds two entries (key: kind and 16 packed sites, value: 10 floats)
+        cache = ZoneCache(max_bytes=2 * (len('lh') + 2 + values[0].nbytes))
+        cache.put(ZoneCache.key('lh', zones[0]), values[0])
+        cache.put(ZoneCache.key('lh', zones[1]), values[1])
+
+        # Using the first zone makes the second one the least recently used
+        np.testing.assert_array_equal(cache.get(ZoneCache.key('lh', zones[0])), values[0])
+        cache.put(ZoneCache.key('lh', zones[2]), values[2])
+
+        self.assertIsNone(cache.get(ZoneCache.key('lh', zones[1])))
+        np.testing.assert_array_equal(cache.get(ZoneCache.key('lh', zones[2])), values[2])
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+
+class TestInformedAreaSteps(unittest.TestCase):
+
+    def test_informed_steps_from_fresh_sample(self):
+        # The first area step of a chain can be a shrink (before the neighbourhoods are tracked)
+        for operators in [['shrink_zone_informed', 'alter_weights'], ['grow_zone_informed', 'shrink_zone_informed']]:
+            sampler = generate_sampler(operators)
+            sample = initialize_chain(sampler)
+            for _ in range(50):
+                sample = sampler.step(sample, 0)
+
+            likelihood, prior = evaluate_from_scratch(sampler, sample)
+            self.assertAlmostEqual(sampler._ll[0], likelihood)
+            self.assertAlmostEqual(sampler._prior[0], prior)
+
+    def test_grow_and_shrink_are_reversible(self):
+        sampler = generate_sampler(['grow_zone_informed', 'shrink_zone_informed'])
+        sample = initialize_chain(sampler)
+        sampler.likelihood(sample, 0)
+        membership = sample.membership
+
+        for _ in range(20):
+            _, q, q_back = sampler.grow_zone_informed(sample)
+            if q_back == 0:
+                sample.reject_proposal()
+                continue
+            z_id, site_new = sample.proposed_changes[0][1]
+            sample.accept_proposal()
+            sampler.likelihood(sample, 0)
+
+            # The informed shrink removes the added site with the back-probability of the grow step
+            zone_sites = membership.sites[z_id]
+            p_shrink = sampler.informed_shrink_probabilities(sample, z_id, zone_sites)
+            self.assertAlmostEqual(p_shrink[np.searchsorted(zone_sites, site_new)], q_back)
+
+            # ... and vice versa: removing the site again is the reverse of the grow step
+            sample.propose('zones', (z_id, site_new), False, changed=z_id)
+            neighbours = membership.get_neighbours(z_id, sampler.adj_mat)
+            p_grow = sampler.informed_grow_probabilities(sample, z_id, neighbours)
+            q_grow = (1 - sampler.p_grow_connected) / (sampler.n - membership.n_occupied)
+            if membership.is_neighbour(z_id, site_new):
+                q_grow += sampler.p_grow_connected * p_grow[np.searchsorted(neighbours, site_new)]
+            self.assertAlmostEqual(q_grow, q)
+            sample.reject_proposal()
+
+
+class TestGibbsSteps(unittest.TestCase):
+
+    def test_gibbs_steps_are_always_accepted(self):
+        operators = ['gibbs_p_global', 'gibbs_p_zones', 'gibbs_p_families']
+        sampler = generate_sampler(operators)
+        sample = initialize_chain(sampler)
+
+        for operator in operators * 2:
+            candidate, q, q_back = getattr(sampler, operator)(sample)
+            likelihood = sampler.likelihood(candidate, 0)
+            prior = sampler.prior(candidate, 0)
+
+            # With uniform priors the proposal is the exact conditional posterior
+            mh_ratio = sampler.metropolis_hastings_ratio(likelihood, sampler._ll[0], prior, sampler._prior[0],
+                                                         q, q_back)
+            self.assertAlmostEqual(mh_ratio, 0.)
+
+            sample.accept_proposal()
+            sampler._ll[0], sampler._prior[0] = likelihood, prior
+
+            # The cached likelihood still matches a full evaluation after the step
+            likelihood_full, prior_full = evaluate_from_scratch(sampler, sample)
+            self.assertAlmostEqual(likelihood, likelihood_full)
+            self.assertAlmostEqual(prior, prior_full)
+
+
+class TestMultipleTryAreaSteps(unittest.TestCase):
+
+    def test_log_posterior_of_moves_matches_full_evaluation(self):
+        sampler = generate_sampler(['grow_zone_mtm', 'shrink_zone_mtm', 'swap_zone_mtm'],
+                                   multiple_tries={'grow_zone': 3, 'shrink_zone': 3, 'swap_zone': 3})
+        sample = initialize_chain(sampler)
+        likelihood, prior = evaluate_from_scratch(sampler, sample)
+
+        z_id = 0
+        zone_sites = sample.membership.sites[z_id]
+        free_sites = sample.membership.free_sites()
+        sites_new = np.array([free_sites[0], -1, free_sites[1]])
+        sites_removed = np.array([-1, zone_sites[0], zone_sites[1]])
+        log_posterior = sampler.area_moves_log_posterior(sample, z_id, sites_new, sites_removed)
+
+        # Grow, shrink and swap
+        for i in range(3):
+            moved = sample.copy()
+            if sites_new[i] >= 0:
+                moved.zones[z_id, sites_new[i]] = True
+            if sites_removed[i] >= 0:
+                moved.zones[z_id, sites_removed[i]] = False
+            likelihood_moved, prior_moved = evaluate_from_scratch(sampler, moved)
+            self.assertAlmostEqual(log_posterior[i], likelihood_moved + prior_moved - likelihood - prior)
+
+        # Without non-connected steps, growing to a site which is not a neighbour is impossible
+        with np.errstate(divide='raise'):
+            log_q = sampler.area_moves_log_proposal(sample, z_id, sites_new, sites_removed, p_grow_connected=1.)
+        neighbours = sample.membership.get_neighbours(z_id, sampler.adj_mat)
+        for i in [0, 2]:
+            self.assertEqual(np.isneginf(log_q[i]), sites_new[i] not in neighbours)
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    N_STEPS = 200
+    N_SAMPLES = 20
+    OPERATORS = ['grow_zone', 'shrink_zone', 'swap_zone', 'alter_weights', 'alter_p_global', 'alter_p_zones',
+                 'alter_p_families']
+
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def result_paths(self, name):
+        return {'parameters': self.directory / (name + '_stats.txt'),
+                'areas': self.directory / (name + '_areas.txt')}
+
+    def run_sampler(self, name, n_workers, checkpoint=None, writer_state=None):
+        np.random.seed(1)
+        sampler = generate_sampler(self.OPERATORS, n_chains=2, n_workers=n_workers,
+                                   checkpoint_path=self.directory / 'checkpoint.pkl', checkpoint_every=70)
+
+        paths = self.result_paths(name)
+        sampler.sample_writer = generate_sample_writer(sampler, paths, self.N_STEPS, self.N_SAMPLES,
+                                                       state=writer_state)
+
+        np.random.seed(2)
+        random.seed(2)
+        sampler.generate_samples(self.N_STEPS, self.N_SAMPLES, checkpoint=checkpoint)
+        sampler.sample_writer.close()
+        return sampler, paths
+
+    def test_resumed_run_matches_uninterrupted_run(self):
+        for n_workers in [1, 2]:
+            sampler, paths = self.run_sampler('full', n_workers)
+            with open(self.directory / 'checkpoint.pkl', 'rb') as checkpoint_file:
+                checkpoint = pickle.load(checkpoint_file)
+            self.assertEqual(checkpoint['i_step'], 140)
+
+            # The resumed run writes to files which also contain samples written after the checkpoint
+            # (as after a crash): they are truncated to the state of the checkpoint
+            paths_resumed = self.result_paths('resumed')
+            for key in paths:
+                shutil.copy(paths[key], paths_resumed[key])
+                with open(paths_resumed[key], 'a') as resumed_file:
+                    resumed_file.write('incomplete sample\n' * 100)
+            resumed, paths_resumed = self.run_sampler('resumed', n_workers, checkpoint=checkpoint,
+                                                      writer_state=checkpoint['sample_writer'])
+
+            self.assertEqual(resumed.statistics['accepted_steps'], sampler.statistics['accepted_steps'])
+
+            # The zone cache is empty after the restore, but counts all lookups of the run
+            lookups = [s.statistics['zone_cache_hits'] + s.statistics['zone_cache_misses'] for s in [sampler, resumed]]
+            self.assertEqual(lookups[0], lookups[1])
+            self.assertLessEqual(resumed.statistics['zone_cache_hits'], sampler.statistics['zone_cache_hits'])
+            self.assertGreater(resumed.statistics['zone_cache_hits'], 0)
+            np.testing.assert_allclose(resumed.statistics['sample_likelihood'],
+                                       sampler.statistics['sample_likelihood'], rtol=1e-10)
+            self.assertTrue(filecmp.cmp(paths['areas'], paths_resumed['areas'], shallow=False))
+            with open(paths['parameters']) as full_file, open(paths_resumed['parameters']) as resumed_file:
+                self.assertEqual(len(full_file.readlines()), len(resumed_file.readlines()))
+
+
 if __name__ == '__main__':
     unittest.main()